@@ -1,17 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os
-import hashlib
 import asyncio
 import json # Keep json for meta handling
 import time
-from memory.deepseek_utils import deepseek_chat_completion
+from memory.deepseek_utils import deepseek_chat_completion, upstream_stats, close_session as close_deepseek_session
 from memory.task_queue import background_task_queue
 
 from memory import db, inner_voice, learn, ask_back, budget, monitor, orchestrator, manifest
 from memory.inter_manus_sync import inter_manus_sync
+from memory.embeddings import embedder
+from memory import vector_search
+from memory.signature_index import signature_index
+from memory.hybrid_search import hybrid_search
+from memory.query_cache import query_cache
+from memory.response_cache import response_cache, semantic_cache
+from memory.single_flight import single_flight
+from memory.local_responder import local_responder, savings_report
+from memory.router import model_router, what_if
+from memory.pagination import STREAM_BATCH_ROWS, encode_cursor, decode_cursor, iter_rows
+from memory.write_buffer import write_buffer
+from memory.log_sink import log_sink
+from memory.ledger import ledger
+from memory import workers
+from memory.retention import retention
+from memory import bulk
 
 app = FastAPI()
 
@@ -23,62 +39,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def text_to_vector(text: str) -> List[float]:
-    """Convert text to 192-dim vector using MD5 hash"""
-    hash_obj = hashlib.md5(text.encode())
-    hash_bytes = hash_obj.digest()
-    # Extend to 192 dimensions by repeating and padding
-    extended = (hash_bytes * 12)[:24]  # 24 bytes = 192 bits
-    return [float(b) / 255.0 for b in extended]
-
 class QueryRequest(BaseModel):
     q: str
     kind: Optional[str] = None
     top_k: int = 3
+    metric: str = "l1" # "l1" or "cosine"; lower score is better for both
+    nprobe: Optional[int] = None # ANN lists to scan; higher trades speed for recall
+    mode: str = "vector" # "vector", "hamming" (near-duplicates on MD5 signatures) or "hybrid" (BM25 + vector)
+    cursor: Optional[str] = None # /query/page only: next_cursor of the previous page
 
 class SpendRequest(BaseModel):
     tokens: int
 
 class DocumentResponse(BaseModel):
-    score: float
+    score: float # distance (lower is better), except hybrid mode: fused relevance (higher is better)
     doc: Dict[str, Any]
 
-@app.post("/query", response_model=List[DocumentResponse])
-async def query_documents(request: QueryRequest):
-    try:
-        query_vector = text_to_vector(request.q)
-        
-        pool = await db.get_db_pool()
-        
-        # Build query for SQLite
-        # Note: SQLite does not have a native vector type or cosine similarity operator.
-        # The 'embedding - ?' is a placeholder. For actual vector similarity, 
-        # a custom function or a dedicated vector search library would be needed.
-        # For now, it will perform a subtraction, which is not a true similarity metric.
-        base_query = """
-        SELECT id, text, kind, meta, 
-               (SELECT SUM(ABS(CAST(json_extract(T1.value, '$') AS REAL) - CAST(json_extract(T2.value, '$') AS REAL))) 
-                FROM json_each(conv_turn.embedding) AS T1, json_each(?) AS T2 
-                WHERE T1.key = T2.key) as score -- Placeholder for L1 distance
-        FROM conv_turn 
-        WHERE embedding IS NOT NULL
-        """
-        params = [json.dumps(query_vector)]
-        
-        if request.kind:
-            base_query += " AND kind = ?"
-            params.append(request.kind)
-            
-        base_query += " ORDER BY score ASC LIMIT ?" # ASC for distance (lower is better)
-        params.append(request.top_k)
-        
-        cursor = await pool.execute(base_query, params)
-        results = await cursor.fetchall()
-        
+class QueryPage(BaseModel):
+    documents: List[DocumentResponse]
+    next_cursor: Optional[str] = None # None once the results are exhausted
+
+def ndjson(items) -> StreamingResponse:
+    """Stream an async iterator of JSON-serialisable items, one per line."""
+    async def lines():
+        async for item in items:
+            yield json.dumps(item) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def search_hits(requests: List[QueryRequest]) -> List[List[tuple]]:
+    """(turn_id, score) hits for each request; vector queries sharing a metric are scored together."""
+    await workers.index_sync.catch_up()
+    hits = [[] for _ in requests]
+    by_metric: Dict[str, List[int]] = {}
+    for i, request in enumerate(requests):
+        if request.mode == "hamming":
+            await signature_index.ensure_loaded()
+            hits[i] = signature_index.search(request.q, request.top_k, request.kind)
+        elif request.mode == "hybrid":
+            hits[i] = await hybrid_search(request.q, request.top_k, request.kind, request.metric)
+        else:
+            by_metric.setdefault(request.metric, []).append(i)
+
+    for metric, indexes in by_metric.items():
+        group = [requests[i] for i in indexes]
+        results = await vector_search.search_batch(
+            embedder.encode([r.q for r in group]),
+            [r.top_k for r in group],
+            [r.kind for r in group],
+            metric,
+            [r.nprobe for r in group])
+        for i, result in zip(indexes, results):
+            hits[i] = result
+    return hits
+
+async def fetch_documents(hits: List[List[tuple]]) -> List[List[DocumentResponse]]:
+    """Load the rows behind every hit list with a single query."""
+    turn_ids = list({turn_id for query_hits in hits for turn_id, _ in query_hits})
+    rows = {}
+    if turn_ids:
+        placeholders = ",".join("?" * len(turn_ids))
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                f"SELECT id, text, kind, meta FROM conv_turn WHERE id IN ({placeholders})", turn_ids)
+            rows = {row["id"]: row for row in await cursor.fetchall()}
+
+    responses = []
+    for query_hits in hits:
         response = []
-        for row in results:
+        for turn_id, score in query_hits:
+            row = rows.get(turn_id)
+            if row is None:
+                continue
             response.append(DocumentResponse(
-                score=float(row["score"]),
+                score=score,
                 doc={
                     "id": row["id"],
                     "text": row["text"],
@@ -86,12 +119,155 @@ async def query_documents(request: QueryRequest):
                     "meta": json.loads(row["meta"]) if row["meta"] else None
                 }
             ))
+        responses.append(response)
+    return responses
+
+async def run_queries(requests: List[QueryRequest]) -> List[List[DocumentResponse]]:
+    """Serve what the query cache can, search the rest in one batch and cache it."""
+    await workers.index_sync.catch_up() # other workers' turns invalidate cached results
+    keys = [(r.q, r.kind, r.top_k, r.metric, r.nprobe, r.mode) for r in requests]
+    results = [query_cache.get(key, r.kind) for key, r in zip(keys, requests)]
+    missed = [i for i, result in enumerate(results) if result is None]
+    if missed:
+        generations = [query_cache.generation(requests[i].kind) for i in missed]
+        hits = await search_hits([requests[i] for i in missed])
+        for i, generation, documents in zip(missed, generations, await fetch_documents(hits)):
+            query_cache.put(keys[i], documents, requests[i].kind, generation)
+            results[i] = documents
+    return results
+
+@app.post("/query", response_model=List[DocumentResponse])
+async def query_documents(request: QueryRequest):
+    try:
+        return (await run_queries([request]))[0]
         
-        return response
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/query/batch", response_model=List[List[DocumentResponse]])
+async def query_documents_batch(requests: List[QueryRequest]):
+    """Answer many queries in one request, scoring them in a single pass where possible."""
+    try:
+        return await run_queries(requests)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def hit_order(mode: str, turn_id: int, score: float) -> tuple:
+    """Total order of hits, best first: distance ascending, or fused score descending for hybrid."""
+    return (-score, turn_id) if mode == "hybrid" else (score, turn_id)
+
+@app.post("/query/page", response_model=QueryPage)
+async def query_documents_page(request: QueryRequest):
+    """Keyset-paginated /query: top_k is the page size, cursor continues after the last hit seen.
+
+    The cursor holds the (score, id) of the last returned hit, so hits that
+    were already served are skipped even if new turns shift ranks between pages."""
+    try:
+        after = decode_cursor(request.cursor, {"id": int, "score": (int, float), "depth": int}) if request.cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        depth = after["depth"] if after else 0
+        deeper = request.model_copy(update={"top_k": depth + request.top_k, "cursor": None})
+        hits = sorted((await search_hits([deeper]))[0], key=lambda h: hit_order(request.mode, *h))
+        if after:
+            last = hit_order(request.mode, after["id"], after["score"])
+            hits = [h for h in hits if hit_order(request.mode, *h) > last]
+        hits = hits[:request.top_k]
+
+        next_cursor = None
+        if len(hits) == request.top_k:
+            turn_id, score = hits[-1]
+            next_cursor = encode_cursor({"id": turn_id, "score": score, "depth": depth + request.top_k})
+        return QueryPage(documents=(await fetch_documents([hits]))[0], next_cursor=next_cursor)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/query/stream")
+async def query_documents_stream(request: QueryRequest):
+    """NDJSON variant of /query for large top_k: documents are loaded and sent in batches."""
+    try:
+        hits = (await search_hits([request]))[0]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def documents():
+        for start in range(0, len(hits), STREAM_BATCH_ROWS):
+            for document in (await fetch_documents([hits[start:start + STREAM_BATCH_ROWS]]))[0]:
+                yield document.model_dump()
+    return ndjson(documents())
+
+@app.post("/query/archive", response_model=List[DocumentResponse])
+async def query_documents_archive(request: QueryRequest, since: Optional[int] = None):
+    """Vector /query over the hot table and the cold archive together.
+
+    Archived turns come back with doc["archived"] = True; since (unix ts)
+    limits how far back the archive partitions are scanned."""
+    if request.mode != "vector":
+        raise HTTPException(status_code=400, detail="Archive search supports vector mode only")
+    try:
+        hot = (await run_queries([request]))[0]
+        cold = await retention.cold_search(embedder.embed(request.q), request.top_k, request.kind,
+                                           request.metric, since)
+        documents = hot + [DocumentResponse(score=score, doc=doc) for score, doc in cold]
+        return sorted(documents, key=lambda d: d.score)[:request.top_k]
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/retention")
+async def get_retention_report():
+    """Hot table size vs page cache, archive partitions and retention counters"""
+    try:
+        return await retention.report()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/chat/cache")
+async def get_response_cache_stats():
+    """Hit/miss counters of the orchestrator's caches and coalesced calls (this worker)"""
+    return {"exact": response_cache.stats(), "semantic": semantic_cache.stats(),
+            "single_flight": single_flight.stats()}
+
+@app.get("/chat/local")
+async def get_local_responder_stats(days: int = 7):
+    """Requests the local fast path answered (this worker) and, from orchestrator_logs,
+    the latency and budget it saved over the last `days`"""
+    return {"worker": local_responder.stats(), **await savings_report(days)}
+
+@app.get("/chat/logs")
+async def get_log_sink_stats():
+    """Orchestrator log sink buffer fill, rows written, and entries clipped, sampled or only counted (this worker)"""
+    return log_sink.stats()
+
+@app.get("/upstream")
+async def get_upstream_status():
+    """DeepSeek circuit breaker state, call latency percentiles and hedging counters (this worker)"""
+    return upstream_stats()
+
+@app.get("/router")
+async def get_router_report():
+    """Routes with their learned latency/cost and the most recent routing decisions"""
+    await model_router.refresh()
+    return model_router.report()
+
+@app.get("/router/what-if")
+async def get_router_what_if(days: int = 7):
+    """Logged DeepSeek requests replayed through the router: actual vs routed vs all-reasoner cost and latency"""
+    return await what_if(days)
+
+@app.get("/query/signatures")
+async def get_signature_index_stats():
+    """Hamming-mode searches, how many found fewer than top_k within the probe radius, and full-scan fallbacks"""
+    return signature_index.stats()
+
+@app.get("/query/cache")
+async def get_query_cache_stats():
+    """Hit/miss counters of the /query result cache"""
+    return query_cache.stats()
+
 @app.post("/spend")
 async def spend_tokens(request: SpendRequest):
     try:
@@ -103,36 +279,137 @@ async def spend_tokens(request: SpendRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/ledger")
+async def get_ledger():
+    """Today's token spend, balance and per-category totals"""
+    await ledger.refresh()
+    return ledger.totals()
+
+@app.get("/bulk/export")
+async def bulk_export(tables: Optional[str] = None):
+    """Stream conv_turn, concepts, links and lessons as gzip NDJSON (comma-separated tables to narrow it)."""
+    names = tables.split(",") if tables else bulk.BULK_TABLES
+    unknown = set(names) - set(bulk.BULK_TABLES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tables: {sorted(unknown)}")
+    return StreamingResponse(bulk.export_gzip(names), media_type="application/gzip",
+                             headers={"Content-Disposition": "attachment; filename=memory.ndjson.gz"})
+
+@app.post("/bulk/import")
+async def bulk_import(request: Request):
+    """Load a gzip NDJSON body produced by /bulk/export; returns rows/sec per table."""
+    try:
+        return await bulk.import_lines(bulk.gunzip_lines(request.stream()))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 class ChatRequest(BaseModel):
     msg: str
+    timeout: Optional[float] = None  # seconds the caller will wait (/chat/stream: for the first chunk); default orchestrator.ORCHESTRATOR_DEADLINE
+
+async def remember_exchange(msg: str, reply: str, fallback: Optional[str] = None):
+    """Store both turns of a chat exchange and queue reflection/learning on it.
+    fallback marks a stand-in reply given while DeepSeek was unavailable."""
+    # Store user turn; it is queued and commits together with the assistant turn
+    await db.add_turn(role="user", text=msg, embedding=embedder.embed(msg), durable=False)
+
+    # Store assistant turn from orchestrator
+    await db.add_turn(role="assistant", text=reply, meta={"fallback": fallback} if fallback else None)
+
+    # Reflect & learn in background
+    await background_task_queue.add_task(inner_voice.reflect, {"text": reply})
+    await background_task_queue.add_task(learn.learn_from_turn, {"text": msg})
 
 @app.post("/chat")
 async def chat(request: ChatRequest):
     # Route all requests through the orchestrator
-    orchestration_result = await orchestrator.orchestrate_request(request.msg)
+    deadline = time.monotonic() + request.timeout if request.timeout else None
+    orchestration_result = await orchestrator.orchestrate_request(request.msg, deadline)
     
     if orchestration_result["error"]:
-        raise HTTPException(status_code=500, detail=orchestration_result["error"])
-
-    # Store user turn
-    await db.add_turn(role="user", text=request.msg, embedding=text_to_vector(request.msg))
+        status = {"deadline": 504, "breaker_open": 503}.get(orchestration_result["fallback"], 500)
+        raise HTTPException(status_code=status, detail=orchestration_result["error"])
 
-    # Store assistant turn from orchestrator
     reply = orchestration_result["response"]
-    await db.add_turn(role="assistant", text=reply)
-
-    # Reflect & learn in background
-    await background_task_queue.add_task(inner_voice.reflect, {"text": reply})
-    await background_task_queue.add_task(learn.learn_from_turn, {"text": request.msg})
+    await remember_exchange(request.msg, reply, orchestration_result["fallback"])
     
     return {"reply": reply}
 
-@app.on_event("startup")
-async def startup_event():
-    asyncio.create_task(monitor.start_monitoring())
+def sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """One Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """/chat as Server-Sent Events, forwarded as the upstream model generates.
+
+    Frames: `data: {"delta": ...}` per reply chunk, `event: reasoning` for
+    the reasoner's thinking, then `event: done` with the full reply (or
+    `event: error`). Turns are stored and reflect/learn queued once the
+    reply is complete; a client that disconnects early stores nothing."""
+    deadline = time.monotonic() + request.timeout if request.timeout else None
+    async def events():
+        async for event in orchestrator.orchestrate_stream(request.msg, deadline):
+            if "delta" in event:
+                yield sse({"delta": event["delta"]})
+            elif "reasoning" in event:
+                yield sse({"delta": event["reasoning"]}, "reasoning")
+            elif "done" in event:
+                log_entry = event["done"]
+                if log_entry["error"]:
+                    yield sse({"detail": log_entry["error"]}, "error")
+                    return
+                await remember_exchange(request.msg, log_entry["response"], log_entry["fallback"])
+                yield sse({"reply": log_entry["response"]}, "done")
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+_monitor_task = None
+
+async def start_background_services():
+    """Singletons that must run once per deployment, not once per worker."""
+    global _monitor_task
+    _monitor_task = asyncio.create_task(monitor.start_monitoring())
     await inter_manus_sync.start_sync_service()
+    await retention.start()
     await manifest.update_manifest()
 
+async def stop_background_services():
+    global _monitor_task
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        _monitor_task = None
+    await inter_manus_sync.stop_sync_service()
+    await retention.stop()
+
+@app.on_event("startup")
+async def startup_event():
+    if workers.MULTI_WORKER:
+        workers.leader.on_elected(start_background_services, stop_background_services)
+        await workers.leader.start()
+    else:
+        await start_background_services()
+    await ledger.start()
+    await workers.index_sync.start()
+    await vector_search.load()
+    await signature_index.load()
+    await response_cache.load()
+    await semantic_cache.ensure_loaded()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if workers.MULTI_WORKER:
+        await workers.leader.close()
+    await ledger.close()
+    await log_sink.close()
+    await semantic_cache.flush_hits()
+    await write_buffer.close()
+    await close_deepseek_session()
+    vector_search.save()
+    await db.close_db_pool()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -146,13 +423,13 @@ if __name__ == "__main__":
 async def get_sync_status():
     """Get current synchronization status"""
     try:
-        pool = await db.get_db_pool()
-        cursor = await pool.execute("SELECT * FROM sync_status WHERE id = 1")
-        status = await cursor.fetchone()
-        
-        # Get recent activity
-        cursor = await pool.execute("SELECT * FROM recent_sync_activity")
-        activity = await cursor.fetchall()
+        async with db.reader() as conn:
+            cursor = await conn.execute("SELECT * FROM sync_status WHERE id = 1")
+            status = await cursor.fetchone()
+            
+            # Get recent activity
+            cursor = await conn.execute("SELECT * FROM recent_sync_activity")
+            activity = await cursor.fetchall()
         
         return {
             "sync_enabled": bool(status["sync_enabled"]) if status else False,
@@ -174,22 +451,53 @@ async def trigger_sync():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def concept_dict(row) -> Dict[str, Any]:
+    concept = dict(row)
+    concept["embedding"] = db.unpack_embedding(concept["embedding"])
+    return concept
+
 @app.get("/sync/concepts")
-async def get_synced_concepts():
-    """Get concepts received from brother Manus"""
+async def get_synced_concepts(limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """Get concepts received from brother Manus, newest first.
+
+    Pages hold `limit` concepts (default 50) and end with a next_cursor for
+    the following page. With stream=true every remaining concept (or at
+    most `limit`) is sent as NDJSON while it is read from the database."""
+    sql = "SELECT * FROM concepts WHERE source LIKE 'sync_%'"
+    params: List[Any] = []
+    if cursor:
+        try:
+            after = decode_cursor(cursor, {"created_at": (int, float), "id": int})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        sql += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+        params += [after["created_at"], after["created_at"], after["id"]]
+    sql += " ORDER BY created_at DESC, id DESC"
+    if not stream:
+        limit = limit or 50
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    if stream:
+        async def concepts():
+            async for row in iter_rows(sql, params):
+                yield concept_dict(row)
+        return ndjson(concepts())
+
     try:
-        pool = await db.get_db_pool()
-        cursor = await pool.execute("""
-            SELECT * FROM concepts 
-            WHERE source LIKE 'sync_%' 
-            ORDER BY created_at DESC 
-            LIMIT 50
-        """)
-        concepts = await cursor.fetchall()
-        
+        async with db.reader() as conn:
+            cursor = await conn.execute(sql, params)
+            concepts = await cursor.fetchall()
+
+        next_cursor = None
+        if len(concepts) == limit:
+            last = concepts[-1]
+            next_cursor = encode_cursor({"created_at": last["created_at"], "id": last["id"]})
         return {
-            "concepts": [dict(row) for row in concepts],
-            "count": len(concepts)
+            "concepts": [concept_dict(row) for row in concepts],
+            "count": len(concepts),
+            "next_cursor": next_cursor
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -198,13 +506,13 @@ async def get_synced_concepts():
 async def get_brother_metrics():
     """Get performance metrics from brother Manus"""
     try:
-        pool = await db.get_db_pool()
-        cursor = await pool.execute("""
-            SELECT * FROM brother_metrics 
-            ORDER BY timestamp DESC 
-            LIMIT 10
-        """)
-        metrics = await cursor.fetchall()
+        async with db.reader() as conn:
+            cursor = await conn.execute("""
+                SELECT * FROM brother_metrics 
+                ORDER BY timestamp DESC 
+                LIMIT 10
+            """)
+            metrics = await cursor.fetchall()
         
         return {
             "metrics": [dict(row) for row in metrics],
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import os
+import sys
+import time
+import numpy as np
+from typing import List, Optional, Tuple
+
+from memory import db
+from memory.vector_index import VectorIndex, vector_index
+
+# Configuration
+ANN_INDEX_PATH = os.path.join(os.path.dirname(db._DB_PATH), "ann_index.npz")
+ANN_MIN_ROWS = 50_000  # below this an exact scan is already fast enough
+ANN_NLIST = 0  # number of IVF lists; 0 picks 4 * sqrt(rows)
+ANN_NPROBE = 64  # lists scanned per query; higher = better recall, slower
+ANN_TRAIN_SAMPLE = 65_536
+ANN_KMEANS_ITERS = 10
+ANN_RETRAIN_GROWTH = 4  # retrain once the index is 4x the size it was trained on
+ASSIGN_CHUNK_ROWS = 65_536
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the closest centroid (L2) for every row, computed in chunks."""
+    c_norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        chunk = vectors[start:start + ASSIGN_CHUNK_ROWS]
+        # ||x||^2 is constant per row, so it does not change the argmin
+        dists = c_norms - 2.0 * (chunk @ centroids.T)
+        labels[start:start + len(chunk)] = dists.argmin(axis=1)
+    return labels
+
+def _kmeans(sample: np.ndarray, nlist: int, iters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = _nearest_centroids(sample, centroids)
+        counts = np.bincount(labels, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty lists from random points so every list stays useful
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+class IVFIndex:
+    """Inverted-file ANN index over the rows of a VectorIndex.
+
+    A k-means coarse quantizer splits the embeddings into nlist lists; a
+    query only scores the rows of its nprobe closest lists. Vectors, list
+    assignments and centroids are persisted to ANN_INDEX_PATH so a restart
+    only has to catch up on turns added since the last save."""
+
+    def __init__(self, store: VectorIndex, path: str = ANN_INDEX_PATH):
+        self.store = store
+        self.path = path
+        self.centroids = None
+        self.trained_size = 0
+        self._training = False
+        self._reset_lists(0)
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _reset_lists(self, nlist: int):
+        self.lists = [np.empty(16, dtype=np.int64) for _ in range(nlist)]
+        self.list_sizes = np.zeros(nlist, dtype=np.int64)
+        self.assigned = 0  # store rows [0, assigned) are in a list
+
+    def _append_to_list(self, li: int, positions: np.ndarray):
+        size = self.list_sizes[li]
+        needed = size + len(positions)
+        if needed > len(self.lists[li]):
+            grown = np.empty(max(needed, 2 * len(self.lists[li])), dtype=np.int64)
+            grown[:size] = self.lists[li][:size]
+            self.lists[li] = grown
+        self.lists[li][size:needed] = positions
+        self.list_sizes[li] = needed
+
+    def _install(self, labels: np.ndarray, offset: int = 0):
+        """Add rows [offset, offset + len(labels)) to their lists."""
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=len(self.lists))
+        start = 0
+        for li in np.flatnonzero(counts):
+            end = start + counts[li]
+            self._append_to_list(li, order[start:end] + offset)
+            start = end
+        self.assigned = offset + len(labels)
+
+    def _assign_pending(self):
+        if not self.trained or self.assigned >= self.store.size:
+            return
+        vectors = self.store.vectors[self.assigned:self.store.size]
+        self._install(_nearest_centroids(vectors, self.centroids), self.assigned)
+
+    async def train(self, nlist: int = ANN_NLIST):
+        """Fit the coarse quantizer on a sample and rebuild every list.
+
+        The k-means and bulk assignment run in a worker thread so the event
+        loop keeps serving requests; rows added meanwhile are assigned after."""
+        n = self.store.size
+        if n == 0 or self._training:
+            return
+        self._training = True
+        try:
+            nlist = nlist or int(np.clip(4 * np.sqrt(n), 16, 4096))
+            nlist = min(nlist, n)
+            vectors = self.store.vectors[:n]
+
+            def fit():
+                rng = np.random.default_rng(0)
+                sample = vectors[rng.choice(n, min(n, ANN_TRAIN_SAMPLE), replace=False)]
+                centroids = _kmeans(sample, nlist, ANN_KMEANS_ITERS)
+                return centroids, _nearest_centroids(vectors, centroids)
+
+            loop = asyncio.get_event_loop()
+            centroids, labels = await loop.run_in_executor(None, fit)
+            self.centroids = centroids
+            self.trained_size = n
+            self._reset_lists(nlist)
+            self._install(labels)
+            self._assign_pending()
+            print(f"ANN index trained: {nlist} lists over {n} embeddings")
+        finally:
+            self._training = False
+
+    async def load(self):
+        """Restore the persisted index (if any), then catch up from SQLite."""
+        restored = self._restore()
+        await self.store.load(since_id=self.store.last_id() if restored else 0)
+        if self.trained:
+            self._assign_pending()
+        if self.store.size >= ANN_MIN_ROWS and (
+                not self.trained or self.store.size > ANN_RETRAIN_GROWTH * self.trained_size):
+            await self.train()
+            self.save()
+
+    async def ensure_loaded(self):
+        if not self.store.loaded:
+            await self.load()
+
+    async def rebuild(self):
+        """Reload every vector from SQLite after turns were removed (retention),
+        keeping the trained centroids, and persist the result."""
+        if not self.store.loaded:
+            self._restore()
+        self.store.loaded = False  # turns added meanwhile wait in _pending
+        await self.store.load()
+        self._reset_lists(len(self.lists))
+        self._assign_pending()
+        self.save()
+
+    def add(self, turn_id: int, embedding: List[float], kind: Optional[str] = None):
+        """Append a single embedding; called by db.add_turn after each insert."""
+        self.store.add(turn_id, embedding, kind)
+        self._assign_pending()
+
+    def search(self, query: List[float], top_k: int = 3, kind: Optional[str] = None,
+               metric: str = "l1", nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Approximate top-k; exact scan until the quantizer has been trained."""
+        if not self.trained:
+            return self.store.search(query, top_k, kind, metric)
+
+        self._assign_pending()
+        q = np.asarray(query, dtype=np.float32)
+        nprobe = min(nprobe or ANN_NPROBE, len(self.lists))
+        probe = _nearest_probe(q, self.centroids, nprobe)
+        rows = np.concatenate([self.lists[li][:self.list_sizes[li]] for li in probe])
+        return self.store.search(q, top_k, kind, metric, rows=rows)
+
+    def search_batch(self, queries: List[List[float]], top_ks: List[int], kinds: List[Optional[str]],
+                     metric: str = "l1", nprobes: Optional[List[Optional[int]]] = None) -> List[List[Tuple[int, float]]]:
+        """Batched search: one matrix-matrix pass when exact, per-query list probes otherwise."""
+        if not self.trained:
+            return self.store.search_batch(queries, top_ks, kinds, metric)
+        nprobes = nprobes or [None] * len(queries)
+        return [self.search(q, k, kind, metric, nprobe)
+                for q, k, kind, nprobe in zip(queries, top_ks, kinds, nprobes)]
+
+    def save(self):
+        """Write vectors, centroids and list assignments atomically."""
+        store = self.store
+        labels = np.full(store.size, -1, dtype=np.int32)
+        for li, positions in enumerate(self.lists):
+            labels[positions[:self.list_sizes[li]]] = li
+        kind_names = [None] * len(store.kind_codes)
+        for name, code in store.kind_codes.items():
+            kind_names[code] = name
+
+        # Per-process temp file: workers saving at once must not write into each other's
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=store.ids[:store.size],
+            kinds=store.kinds[:store.size],
+            vectors=store.vectors[:store.size],
+            kind_names=np.array(json.dumps(kind_names)),
+            centroids=self.centroids if self.trained else np.empty((0, store.dim), dtype=np.float32),
+            labels=labels,
+            trained_size=np.array(self.trained_size),
+        )
+        os.replace(tmp_path, self.path)
+        print(f"ANN index saved: {store.size} embeddings -> {self.path}")
+
+    def _restore(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            data = np.load(self.path)
+            vectors = data["vectors"]
+            if vectors.ndim != 2 or vectors.shape[1] != self.store.dim:
+                print(f"Ignoring ANN index with mismatched dimensions: {self.path}")
+                return False
+            store = self.store
+            store._reset()
+            kind_names = json.loads(str(data["kind_names"]))
+            store.kind_codes = {name: code for code, name in enumerate(kind_names)}
+            store._append_coded(data["ids"], data["kinds"], vectors)
+
+            centroids = data["centroids"]
+            self.centroids = centroids if len(centroids) else None
+            self.trained_size = int(data["trained_size"])
+            self._reset_lists(len(centroids))
+            labels = data["labels"]
+            if self.trained and len(labels) and labels.min() >= 0:
+                self._install(labels)
+            self._assign_pending()
+            print(f"ANN index restored: {store.size} embeddings from {self.path}")
+            return True
+        except Exception as e:
+            print(f"Error restoring ANN index, rebuilding from SQLite: {e}")
+            self.centroids = None
+            self._reset_lists(0)
+            return False
+
+def _nearest_probe(q: np.ndarray, centroids: np.ndarray, nprobe: int) -> np.ndarray:
+    dists = ((centroids - q) ** 2).sum(axis=1)
+    if nprobe >= len(dists):
+        return np.arange(len(dists))
+    return np.argpartition(dists, nprobe - 1)[:nprobe]
+
+def recall_report(index: "IVFIndex", k: int = 10, n_queries: int = 200,
+                  nprobes=(1, 2, 4, 8, 16, 32, 64), metric: str = "l1") -> List[dict]:
+    """Measure recall@k and per-query latency of IVF search against exact search.
+
+    Queries are stored embeddings with a little noise added, so each one
+    has genuine near neighbours in the index."""
+    store = index.store
+    rng = np.random.default_rng(1)
+    picks = rng.choice(store.size, min(n_queries, store.size), replace=False)
+    queries = store.vectors[picks] + rng.normal(0, 0.02, (len(picks), store.dim)).astype(np.float32)
+
+    start = time.perf_counter()
+    exact = [{i for i, _ in store.search(q, k, metric=metric)} for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = [{"nprobe": "exact", "recall": 1.0, "ms_per_query": exact_ms}]
+    for nprobe in nprobes:
+        if nprobe > len(index.lists):
+            break
+        start = time.perf_counter()
+        found = [{i for i, _ in index.search(q, k, metric=metric, nprobe=nprobe)} for q in queries]
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = sum(len(f & e) for f, e in zip(found, exact)) / sum(len(e) for e in exact)
+        report.append({"nprobe": nprobe, "recall": recall, "ms_per_query": ms})
+    return report
+
+async def _print_recall_report(synthetic_rows: int = 0):
+    if synthetic_rows:
+        # MD5 signatures are uniformly distributed bytes, so random bytes are representative
+        store = VectorIndex()
+        rows = np.random.default_rng(0).integers(0, 256, (synthetic_rows, store.dim)) / 255.0
+        store._append(np.arange(1, synthetic_rows + 1), [None] * synthetic_rows, rows.astype(np.float32))
+        store.loaded = True
+        index = IVFIndex(store, path=os.devnull)
+    else:
+        index = ann_index
+        await index.load()
+    if not index.trained:
+        await index.train()
+
+    print(f"recall@10 vs latency over {index.store.size} embeddings, {len(index.lists)} lists")
+    print(f"{'nprobe':>8} {'recall@10':>10} {'ms/query':>10}")
+    for row in recall_report(index):
+        print(f"{row['nprobe']:>8} {row['recall']:>10.3f} {row['ms_per_query']:>10.2f}")
+
+# Global instance
+ann_index = IVFIndex(vector_index)
+
+if __name__ == "__main__":
+    # python -m memory.ann_index [synthetic_rows]
+    asyncio.run(_print_recall_report(int(sys.argv[1]) if len(sys.argv) > 1 else 0))
@@ -2,14 +2,11 @@ DAILY_CAP = 300_000
 WARN_THRESHOLD = 0.15
 
 async def spend_with_plan(name: str, estimated: int) -> bool:
-    # This function needs to interact with a token balance system.
-    # For now, we'll use a placeholder that assumes a global token_balance function or similar.
-    # In a real scenario, this would check the actual remaining balance.
-    
-    # Placeholder for token_balance retrieval
-    # Assuming db.token_balance() exists and returns the current balance
-    from memory import db
-    left = db.token_balance()
+    # Check and debit happen atomically in the ledger, so concurrent callers
+    # can't both pass the balance check and overspend
+    from memory.ledger import ledger
+    await ledger.ensure_loaded()
+    left = ledger.balance()
 
     if estimated > left:
         print(f"🛑  {name} needs {estimated}, only {left} left.")
@@ -23,8 +20,8 @@ async def spend_with_plan(name: str, estimated: int) -> bool:
         #     return False
         pass # Auto-approve for non-interactive testing
             
-    await db.spend(estimated)
+    if not await ledger.try_spend(name, estimated):
+        print(f"🛑  {name} needs {estimated}, only {ledger.balance()} left.")
+        return False
     print(f"✅ {name} approved to spend {estimated} tokens.")
     return True
-
-
@@ -0,0 +1,241 @@
+import asyncio
+import base64
+import gzip
+import json
+import sys
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from memory import db
+from memory.pagination import iter_rows
+
+# Configuration
+BULK_TABLES = ("conv_turn", "concept", "concepts", "concept_link", "lessons")
+BULK_BATCH_ROWS = 10_000  # rows per executemany and writer transaction; other writers wait at most this long
+BULK_GZIP_LEVEL = 6
+BULK_CHUNK_BYTES = 64 * 1024  # uncompressed NDJSON gathered before each gzip write
+
+# File format: gzip NDJSON. A {"table": ..., "columns": [...]} header line
+# opens each table, followed by one JSON array per row in column order.
+# BLOB values (embeddings) are written as {"b64": "..."}.
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return {"b64": base64.b64encode(value).decode()}
+    return value
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict):
+        return base64.b64decode(value["b64"])
+    return value
+
+async def _existing_tables(tables: Sequence[str]) -> List[str]:
+    async with db.reader() as conn:
+        cursor = await conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        present = {r["name"] for r in await cursor.fetchall()}
+    return [t for t in tables if t in present]
+
+async def export_lines(tables: Sequence[str] = BULK_TABLES) -> AsyncIterator[str]:
+    """NDJSON lines for every row of the given tables, read in batches."""
+    for table in await _existing_tables(tables):
+        columns = None
+        async for row in iter_rows(f"SELECT * FROM {table} ORDER BY rowid"):
+            if columns is None:
+                columns = list(row.keys())
+                yield json.dumps({"table": table, "columns": columns}) + "\n"
+            yield json.dumps([_encode(v) for v in row]) + "\n"
+
+async def export_gzip(tables: Sequence[str] = BULK_TABLES) -> AsyncIterator[bytes]:
+    """export_lines() as a gzip byte stream (for the /bulk/export response)."""
+    compressor = zlib.compressobj(BULK_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    chunk: List[str] = []
+    size = 0
+    async for line in export_lines(tables):
+        chunk.append(line)
+        size += len(line)
+        if size >= BULK_CHUNK_BYTES:
+            data = compressor.compress("".join(chunk).encode())
+            chunk, size = [], 0
+            if data:
+                yield data
+    yield compressor.compress("".join(chunk).encode()) + compressor.flush()
+
+async def export_file(path: str, tables: Sequence[str] = BULK_TABLES) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    table = None
+    with gzip.open(path, "wt", compresslevel=BULK_GZIP_LEVEL, encoding="utf-8") as f:
+        async for line in export_lines(tables):
+            if line.startswith("{"):
+                table = json.loads(line)["table"]
+                counts[table] = 0
+            else:
+                counts[table] += 1
+            f.write(line)
+    return counts
+
+async def gunzip_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a gzip byte stream (e.g. a request body) into text lines."""
+    decompressor = zlib.decompressobj(31)
+    tail = b""
+    async for chunk in chunks:
+        lines = (tail + decompressor.decompress(chunk)).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line.decode()
+    tail += decompressor.flush()
+    if tail:
+        yield tail.decode()
+
+async def file_lines(path: str) -> AsyncIterator[str]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield line
+
+class _TableLoad:
+    """Loads one table: secondary indexes and triggers are dropped first and
+    recreated at the end, so each row costs one B-tree insert instead of one
+    per index (and no FTS update; the FTS mirror is rebuilt in one pass)."""
+
+    def __init__(self, table: str, columns: List[str], present: List[str]):
+        keep = [i for i, c in enumerate(columns) if c in present]
+        self.table = table
+        self.positions = keep
+        names = ",".join(columns[i] for i in keep)
+        self.sql = f"INSERT OR IGNORE INTO {table}({names}) VALUES ({','.join('?' * len(keep))})"
+        self.rows = 0  # attempted, including ids that already existed
+        self.inserted = 0
+        self.started = time.perf_counter()
+        self._schema: List[str] = []
+
+    async def drop_indexes(self, conn):
+        cursor = await conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            (self.table,))
+        for r in await cursor.fetchall():
+            self._schema.append(r["sql"])
+            await conn.execute(f"DROP {r['type'].upper()} {r['name']}")
+
+    async def rebuild_indexes(self, conn):
+        for sql in self._schema:
+            await conn.execute(sql)
+        cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f"{self.table}_fts",))
+        if self._schema and await cursor.fetchone():
+            await conn.execute(f"INSERT INTO {self.table}_fts({self.table}_fts) VALUES ('rebuild')")
+        self._schema = []
+
+    async def write(self, batch: List[list]):
+        """One executemany in its own writer transaction; counts the rows
+        INSERT OR IGNORE actually inserted."""
+        async with db.writer() as conn:
+            before = conn.total_changes
+            await conn.executemany(self.sql, batch)
+            self.inserted += conn.total_changes - before
+        self.rows += len(batch)
+
+    def report(self) -> Dict[str, Any]:
+        seconds = time.perf_counter() - self.started
+        return {"rows": self.inserted, "skipped": self.rows - self.inserted, "seconds": round(seconds, 3),
+                "rows_per_sec": round(self.inserted / seconds) if seconds else 0}
+
+async def import_lines(lines: AsyncIterator[str], tables: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """Load NDJSON produced by export_lines(); rows keep their ids and
+    existing ids are skipped, so re-running an import is harmless.
+
+    Lines are parsed without holding the writer (a request body may
+    arrive slowly); each BULK_BATCH_ROWS batch is then written by one
+    executemany in its own writer transaction, overlapping the parsing of
+    the next. Returns per-table inserted and skipped rows and rows/sec."""
+    started = time.perf_counter()
+    wanted = set(tables or BULK_TABLES)
+    present = await _existing_tables(list(wanted))
+    results: Dict[str, Any] = {}
+    load: Optional[_TableLoad] = None
+    batch: List[list] = []
+    inflight: Optional[asyncio.Task] = None
+
+    async def drain():
+        nonlocal inflight
+        if inflight is not None:
+            task, inflight = inflight, None
+            await task
+
+    async def write_batch():
+        nonlocal batch, inflight
+        if not batch:
+            return
+        # The next batch is parsed while aiosqlite's thread inserts this one
+        await drain()
+        inflight = asyncio.ensure_future(load.write(batch))
+        batch = []
+
+    async def finish_table():
+        nonlocal load
+        if load is None:
+            return
+        await write_batch()
+        await drain()
+        async with db.writer() as conn:
+            await load.rebuild_indexes(conn)
+        results[load.table] = load.report()
+        print(f"Imported {load.table}: {results[load.table]}")
+        load = None
+
+    try:
+        skip = False
+        async for line in lines:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, dict):
+                await finish_table()
+                skip = item["table"] not in present
+                if skip:
+                    continue
+                async with db.reader() as conn:
+                    cursor = await conn.execute(f"PRAGMA table_info({item['table']})")
+                    columns = [r["name"] for r in await cursor.fetchall()]
+                load = _TableLoad(item["table"], item["columns"], columns)
+                async with db.writer() as conn:
+                    await load.drop_indexes(conn)
+            elif not skip and load is not None:
+                batch.append([_decode(item[i]) for i in load.positions])
+                if len(batch) >= BULK_BATCH_ROWS:
+                    await write_batch()
+        await finish_table()
+    except BaseException:
+        if inflight is not None:
+            # db.writer() rolls back the batch being written
+            inflight.cancel()
+            await asyncio.gather(inflight, return_exceptions=True)
+        if load is not None:
+            # Never leave a table without its indexes
+            async with db.writer() as conn:
+                await load.rebuild_indexes(conn)
+        raise
+
+    total = sum(r["rows"] for r in results.values())
+    seconds = time.perf_counter() - started
+    summary = {"tables": results, "rows": total, "skipped": sum(r["skipped"] for r in results.values()),
+               "seconds": round(seconds, 3), "rows_per_sec": round(total / seconds) if seconds else 0}
+    if "conv_turn" in results:
+        # Imported turns bypassed db.add_turn and keep their own ids, so every
+        # worker's in-memory tiers rebuild from SQLite
+        from memory.workers import index_sync
+        await index_sync.request_rebuild("import")
+    return summary
+
+async def _main(args: List[str]):
+    try:
+        if len(args) >= 2 and args[0] == "export":
+            counts = await export_file(args[1], args[2:] or BULK_TABLES)
+            print(f"Exported to {args[1]}: {counts}")
+        elif len(args) >= 2 and args[0] == "import":
+            print(json.dumps(await import_lines(file_lines(args[1]), args[2:] or None), indent=2))
+        else:
+            print("usage: python -m memory.bulk export|import FILE.ndjson.gz [table ...]")
+    finally:
+        await db.close_db_pool()
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
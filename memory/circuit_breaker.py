@@ -0,0 +1,114 @@
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+# Configuration
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))  # failed share of recent calls that opens the breaker
+BREAKER_WINDOW = 60.0  # seconds of call outcomes the error rate covers
+BREAKER_WINDOW_CALLS = 100  # ... and at most this many of the latest calls
+BREAKER_MIN_CALLS = 10  # fewer calls than this in the window never open it
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))  # seconds open before a trial call is let through
+BREAKER_PROBES = 1  # concurrent trial calls while half-open
+BREAKER_TRANSITIONS_KEPT = 20
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """Stops calling an upstream that is mostly failing.
+
+    Closed: calls go through and their outcomes are counted over the last
+    BREAKER_WINDOW seconds (at most BREAKER_WINDOW_CALLS calls). When at least BREAKER_MIN_CALLS calls fail at
+    BREAKER_ERROR_RATE or worse it opens: allow() refuses every call for
+    BREAKER_COOLDOWN seconds, so callers fall back at once instead of
+    waiting on timeouts. Then it is half-open: BREAKER_PROBES trial calls
+    go through, and their outcome closes or re-opens it.
+
+    Each worker keeps its own breaker; they see the same upstream, so
+    they trip at about the same time."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._state = CLOSED
+        self.opened_at = 0.0
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=BREAKER_WINDOW_CALLS)
+        self.probes = 0
+        self.rejected = 0
+        self.transitions: Deque[Dict[str, Any]] = deque(maxlen=BREAKER_TRANSITIONS_KEPT)
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.time() - self.opened_at >= BREAKER_COOLDOWN:
+            self._move(HALF_OPEN, "cooldown over")
+        return self._state
+
+    def _move(self, state: str, reason: str):
+        print(f"Circuit {self.name}: {self._state} -> {state} ({reason})")
+        self.transitions.append({"timestamp": int(time.time()), "from": self._state, "to": state, "reason": reason})
+        self._state = state
+        if state == OPEN:
+            self.opened_at = time.time()
+        if state != HALF_OPEN:
+            self.probes = 0
+        if state == CLOSED:
+            self.outcomes.clear()
+
+    def _trim(self, now: float):
+        while self.outcomes and self.outcomes[0][0] < now - BREAKER_WINDOW:
+            self.outcomes.popleft()
+
+    def error_rate(self) -> float:
+        self._trim(time.time())
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. A True while half-open takes a probe
+        slot, so every allowed call must be followed by record()."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self.probes < BREAKER_PROBES:
+            self.probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok: bool):
+        now = time.time()
+        if self._state == HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+            if ok:
+                self._move(CLOSED, "trial call succeeded")
+            else:
+                self._move(OPEN, "trial call failed")
+            return
+        self.outcomes.append((now, ok))
+        self._trim(now)
+        if self._state == CLOSED and not ok and len(self.outcomes) >= BREAKER_MIN_CALLS:
+            rate = self.error_rate()
+            if rate >= BREAKER_ERROR_RATE:
+                self._move(OPEN, f"error rate {rate:.0%} over {len(self.outcomes)} calls")
+
+    def release(self):
+        """An allowed call ended without an outcome (cancelled, or its caller's deadline passed)."""
+        if self._state == HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+
+    def status(self) -> Dict[str, Any]:
+        state = self.state
+        calls = len(self.outcomes)
+        return {
+            "name": self.name,
+            "state": state,
+            "error_rate": round(self.error_rate(), 3),
+            "calls_in_window": calls,
+            "threshold": BREAKER_ERROR_RATE,
+            "retry_in": round(max(0.0, BREAKER_COOLDOWN - (time.time() - self.opened_at)), 1) if state == OPEN else None,
+            "rejected": self.rejected,
+            "transitions": list(self.transitions),
+        }
+
+# Global instance
+deepseek_breaker = CircuitBreaker("deepseek")
@@ -2,51 +2,215 @@ import aiosqlite
 import json
 import os
 import asyncio
+import struct
 import time
+from contextlib import asynccontextmanager
 
 _DB_PATH = "memory/db.sqlite"
 _POOL = None
 
-async def get_db_pool():
+# Connection pool configuration
+DB_READERS = 4  # read-only connections; each runs on its own aiosqlite thread
+DB_CACHE_KIB = 64 * 1024  # page cache per connection
+DB_MMAP_BYTES = 256 * 1024 * 1024
+DB_BUSY_TIMEOUT_MS = 5000
+
+def pack_embedding(embedding):
+    """Pack a float vector into a little-endian float32 BLOB."""
+    if embedding is None:
+        return None
+    return struct.pack(f"<{len(embedding)}f", *embedding)
+
+def unpack_embedding(blob):
+    """Unpack a float32 BLOB into a list of floats.
+
+    Rows that have not been migrated yet still hold a JSON array in TEXT,
+    so those are decoded as well."""
+    if blob is None:
+        return None
+    if isinstance(blob, str):
+        return json.loads(blob)
+    return list(struct.unpack(f"<{len(blob) // 4}f", blob))
+
+def l1_distance(a, b):
+    """L1 distance between two packed embeddings (registered as a SQL function)."""
+    if a is None or b is None:
+        return None
+    return sum(abs(x - y) for x, y in zip(unpack_embedding(a), unpack_embedding(b)))
+
+class ConnectionPool:
+    """One writer connection plus DB_READERS reader connections over a WAL database.
+
+    WAL lets the readers run concurrently with the writer, so /query and the
+    sync endpoints don't queue behind /chat inserts on a single thread.
+    Writes are serialised by holding the writer exclusively; readers are
+    handed out from a queue and opened query_only."""
+
+    def __init__(self, path: str = _DB_PATH, readers: int = DB_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._idle_readers: asyncio.Queue = asyncio.Queue()
+        self._connections = []
+
+    async def _connect(self, read_only: bool):
+        conn = await aiosqlite.connect(self.path)
+        conn.row_factory = aiosqlite.Row # To access columns by name
+        # executescript steps every pragma to completion; a pragma that returns a
+        # row and is left unfinished would keep its lock on the database
+        await conn.executescript(f"""
+            PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS};
+            PRAGMA synchronous = NORMAL; -- durable at checkpoints; safe with WAL
+            PRAGMA cache_size = -{DB_CACHE_KIB};
+            PRAGMA mmap_size = {DB_MMAP_BYTES};
+            PRAGMA temp_store = MEMORY;
+            PRAGMA query_only = {"ON" if read_only else "OFF"};
+        """)
+        await conn.create_function("l1_distance", 2, l1_distance, deterministic=True)
+        self._connections.append(conn)
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect(read_only=False)
+        await self._writer.executescript("PRAGMA journal_mode = WAL;")
+        for _ in range(self.readers):
+            self._idle_readers.put_nowait(await self._connect(read_only=True))
+
+    async def acquire(self, write: bool = False):
+        """Take the writer (exclusively) or an idle reader; pair with release()."""
+        if write:
+            await self._write_lock.acquire()
+            return self._writer
+        return await self._idle_readers.get()
+
+    def release(self, conn):
+        if conn is self._writer:
+            self._write_lock.release()
+        else:
+            self._idle_readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Exclusive writer; commits on exit, rolls back if the block raises."""
+        conn = await self.acquire(write=True)
+        try:
+            yield conn
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    async def close(self):
+        global _POOL
+        for conn in self._connections:
+            await conn.close()
+        self._connections = []
+        if _POOL is self:
+            _POOL = None
+
+async def get_db_pool() -> ConnectionPool:
     global _POOL
     if _POOL is None:
-        _POOL = await aiosqlite.connect(_DB_PATH)
-        _POOL.row_factory = aiosqlite.Row # To access columns by name
+        pool = ConnectionPool()
+        await pool.open()
+        _POOL = pool
     return _POOL
 
-async def add(txt):
+async def close_db_pool():
+    if _POOL is not None:
+        await _POOL.close()
+
+@asynccontextmanager
+async def reader():
+    """`async with db.reader() as conn:` for SELECTs."""
     pool = await get_db_pool()
-    await pool.execute("INSERT INTO lessons(txt,ts) VALUES(?,?)",(txt,int(time.time())))
-    await pool.commit()
+    async with pool.reader() as conn:
+        yield conn
 
-async def fetch(n=5):
+@asynccontextmanager
+async def writer():
+    """`async with db.writer() as conn:` for INSERT/UPDATE/DELETE; commits on exit."""
     pool = await get_db_pool()
-    cursor = await pool.execute("SELECT txt FROM lessons ORDER BY ts DESC LIMIT ?", (n,))
-    rows = await cursor.fetchall()
+    async with pool.writer() as conn:
+        yield conn
+
+async def add(txt):
+    async with writer() as conn:
+        await conn.execute("INSERT INTO lessons(txt,ts) VALUES(?,?)",(txt,int(time.time())))
+
+async def fetch(n=5):
+    async with reader() as conn:
+        cursor = await conn.execute("SELECT txt FROM lessons ORDER BY ts DESC LIMIT ?", (n,))
+        rows = await cursor.fetchall()
     return [r["txt"] for r in rows]
 
 async def token_balance():
-    balance_file = "token_balance.txt"
-    if os.path.exists(balance_file):
-        with open(balance_file, 'r') as f:
-            return int(f.read().strip())
-    return 300000 # Default daily limit if file not found
+    """Tokens left today (see memory/ledger.py)."""
+    from memory.ledger import ledger
+    await ledger.refresh()
+    return ledger.balance()
 
-async def add_turn(role, text, meta=None, embedding=None):
-    pool = await get_db_pool()
-    await pool.execute("INSERT INTO conv_turn(role,text,meta,embedding,ts) VALUES (?,?,?,?,?)",
-                (role, text, json.dumps(meta) if meta else None, json.dumps(embedding) if embedding else None, int(time.time())))
-    await pool.commit()
-
-async def spend(tokens: int):
-    balance_file = "token_balance.txt"
-    current_balance = 300000 # Default if file not found
-    if os.path.exists(balance_file):
-        with open(balance_file, 'r') as f:
-            current_balance = int(f.read().strip())
-    new_balance = current_balance - tokens
-    with open(balance_file, 'w') as f:
-        f.write(str(new_balance))
-    print(f"Spent {tokens} tokens. New balance: {new_balance}")
+async def add_turn(role, text, meta=None, embedding=None, durable=True):
+    """Insert a conversation turn through the group-commit write buffer.
+
+    durable=True waits for the commit and returns the turn id; durable=False
+    returns as soon as the row is queued (it commits with the next flush,
+    within a few milliseconds). Search indexes are updated once committed."""
+    from memory.write_buffer import write_buffer
+    future = write_buffer.submit("INSERT INTO conv_turn(role,text,meta,embedding,ts) VALUES (?,?,?,?,?)",
+                (role, text, json.dumps(meta) if meta else None, pack_embedding(embedding) if embedding else None, int(time.time())), durable)
+    if embedding:
+        future.add_done_callback(lambda f: _index_turn(f, text, embedding))
+    if durable:
+        return await future
+
+def _index_turn(future, text, embedding):
+    from memory import vector_search
+    from memory.signature_index import signature_index
+    from memory.query_cache import query_cache
+    from memory.workers import MULTI_WORKER
+    if future.cancelled() or future.exception() is not None:
+        return
+    if MULTI_WORKER:
+        return # workers.index_sync.catch_up() indexes turns from every worker
+    vector_search.add(future.result(), embedding)
+    signature_index.add(future.result(), text)
+    query_cache.invalidate()
+
+async def spend(tokens: int, category: str = "uncategorized"):
+    from memory.ledger import ledger
+    await ledger.spend(category, tokens)
+    print(f"Spent {tokens} tokens. New balance: {ledger.balance()}")
+
+async def migrate_embeddings_to_blob():
+    """Convert JSON-encoded embeddings in conv_turn and concepts to float32 BLOBs."""
+    converted = {}
+    async with writer() as conn:
+        for table in ("conv_turn", "concepts"):
+            cursor = await conn.execute(
+                f"SELECT id, embedding FROM {table} WHERE typeof(embedding) = 'text'")
+            rows = await cursor.fetchall()
+            await conn.executemany(
+                f"UPDATE {table} SET embedding = ? WHERE id = ?",
+                [(pack_embedding(json.loads(r["embedding"])), r["id"]) for r in rows])
+            converted[table] = len(rows)
+    print(f"Migrated embeddings to float32 BLOBs: {converted}")
+    return converted
 
+async def _migrate_and_close():
+    await migrate_embeddings_to_blob()
+    await close_db_pool()
 
+if __name__ == "__main__":
+    asyncio.run(_migrate_and_close())
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import requests
+
+from memory import deepseek_utils
+
+# Load test for the DeepSeek client. Run it against the local stub, not the
+# real API:
+#   STUB_CHUNK_DELAY=0.005 python -m memory.deepseek_stub 8001
+#   DEEPSEEK_API_URL=http://127.0.0.1:8001/v1/chat/completions DEEPSEEK_API_KEY=stub \
+#       python -m memory.deepseek_bench [requests] [concurrency]
+
+# Configuration
+BENCH_REQUESTS = 500
+BENCH_CONCURRENCY = 64
+
+MESSAGES = [{"role": "user", "content": "benchmark"}]
+
+async def legacy_completion(messages: list, model: str = "deepseek-reasoner"):
+    """The previous client: blocking requests.post on the default executor,
+    a fresh connection per call and no timeout. Kept as the baseline."""
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {deepseek_utils.DEEPSEEK_API_KEY}"
+    }
+    payload = {"model": model, "messages": messages, "stream": False}
+    loop = asyncio.get_event_loop()
+    response = await loop.run_in_executor(None, lambda: requests.post(
+        deepseek_utils.DEEPSEEK_API_URL, headers=headers, data=json.dumps(payload)))
+    response.raise_for_status()
+    return response.json()
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def run(call: Callable[[list], Awaitable[Any]], requests_total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    failures = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal failures
+        async with gate:
+            started = time.perf_counter()
+            try:
+                if await call(MESSAGES) is None:
+                    failures += 1
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests_total)))
+    seconds = time.perf_counter() - started
+    return {
+        "requests": requests_total,
+        "concurrency": concurrency,
+        "failures": failures,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "rps": round(requests_total / seconds, 1),
+    }
+
+async def _main(args: List[str]):
+    requests_total = int(args[0]) if args else BENCH_REQUESTS
+    concurrency = int(args[1]) if len(args) > 1 else BENCH_CONCURRENCY
+    try:
+        await run(deepseek_utils.deepseek_chat_completion, 10, 10)  # warm both pools
+        await run(legacy_completion, 10, 10)
+        results = {
+            "requests_executor": await run(legacy_completion, requests_total, concurrency),
+            "aiohttp_pooled": await run(deepseek_utils.deepseek_chat_completion, requests_total, concurrency),
+        }
+        print(json.dumps(results, indent=2))
+    finally:
+        await deepseek_utils.close_session()
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
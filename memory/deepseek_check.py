@@ -0,0 +1,165 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import aiohttp
+
+from memory import circuit_breaker, deepseek_utils
+from memory.circuit_breaker import CLOSED, HALF_OPEN, OPEN, deepseek_breaker
+from memory.deepseek_stub import STUB_REASONING_CHUNKS, stub_reply
+
+# Regression checks for the DeepSeek client against the local stub, with
+# faults injected through /stub/faults. Starts its own stub; exits 1 if a
+# check fails:
+#   python -m memory.deepseek_check [port]
+
+# Configuration
+CHECK_PORT = 8011
+CHECK_CHUNK_DELAY = "0.002"  # STUB_CHUNK_DELAY for the stub this starts
+CHECK_COOLDOWN = 1.0  # BREAKER_COOLDOWN while checking, so half-open comes quickly
+CHECK_STARTUP_TIMEOUT = 15.0
+
+MESSAGES = [{"role": "user", "content": "regression check"}]
+
+class CheckFailed(AssertionError):
+    pass
+
+def expect(condition: bool, message: str):
+    if not condition:
+        raise CheckFailed(message)
+
+async def stub_faults(url: str, **faults: float) -> Dict[str, Any]:
+    """Set faults (none: just read them); returns {"faults", "counters"}."""
+    async with aiohttp.ClientSession() as session:
+        if faults:
+            response = await session.post(f"{url}/stub/faults", json=faults)
+        else:
+            response = await session.get(f"{url}/stub/faults")
+        async with response:
+            return await response.json()
+
+async def check_breaker(url: str):
+    """Failing calls open the breaker; after the cooldown it goes half-open
+    and one successful trial call closes it."""
+    deepseek_breaker._move(CLOSED, "check start")
+    await stub_faults(url, error_rate=1)
+    results = await asyncio.gather(*(deepseek_utils.deepseek_chat_completion(MESSAGES, model="deepseek-chat")
+                                     for _ in range(circuit_breaker.BREAKER_MIN_CALLS + 2)))
+    expect(all(r is None for r in results), "calls to a failing upstream should return None")
+    expect(deepseek_breaker.state == OPEN, f"breaker should be open, is {deepseek_breaker.state}")
+
+    before = (await stub_faults(url))["counters"]["requests"]
+    expect(await deepseek_utils.deepseek_chat_completion(MESSAGES, model="deepseek-chat") is None,
+           "an open breaker should refuse the call")
+    expect((await stub_faults(url))["counters"]["requests"] == before, "an open breaker should not reach the upstream")
+
+    await stub_faults(url, error_rate=0)
+    await asyncio.sleep(CHECK_COOLDOWN + 0.1)
+    expect(deepseek_breaker.state == HALF_OPEN, f"breaker should be half-open, is {deepseek_breaker.state}")
+    expect(await deepseek_utils.deepseek_chat_completion(MESSAGES, model="deepseek-chat") is not None,
+           "the trial call should succeed")
+    expect(deepseek_breaker.state == CLOSED, f"breaker should be closed, is {deepseek_breaker.state}")
+    moves = [(t["from"], t["to"]) for t in deepseek_breaker.transitions][-3:]
+    expect(moves == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)], f"unexpected transitions {moves}")
+
+async def check_hedge(url: str):
+    """A stalled call is hedged after the model's p95; the hedge's answer is
+    returned and the stalled attempt is cancelled (the stub sees it go)."""
+    for _ in range(deepseek_utils.HEDGE_MIN_SAMPLES):
+        await deepseek_utils.deepseek_chat_completion(MESSAGES, model="deepseek-chat")
+    delay = deepseek_utils.hedge_delay("deepseek-chat")
+    expect(delay is not None, "hedge delay should be known after HEDGE_MIN_SAMPLES calls")
+    before = dict(deepseek_utils.hedge_stats)
+    abandoned = (await stub_faults(url, slow_next=1, slow_seconds=10))["counters"]["abandoned"]
+
+    started = time.monotonic()
+    result = await deepseek_utils.deepseek_chat_completion(MESSAGES, model="deepseek-chat", hedge=True)
+    seconds = time.monotonic() - started
+    expect(result is not None, "the hedged call should succeed")
+    expect(seconds < 2.0, f"the hedge should answer well before the 10 s stall, took {seconds:.2f}s")
+    expect(deepseek_utils.hedge_stats["hedged"] == before["hedged"] + 1, "one hedge should have gone out")
+    expect(deepseek_utils.hedge_stats["hedge_won"] == before["hedge_won"] + 1, "the hedge should have won")
+    await asyncio.sleep(0.3)  # the stub polls for disconnects every 50 ms
+    expect((await stub_faults(url))["counters"]["abandoned"] == abandoned + 1,
+           "the stalled attempt should have been cancelled")
+
+async def check_deadline(url: str):
+    """A call past its deadline returns None on time, releases the upstream
+    request and isn't counted as an upstream failure by the breaker."""
+    abandoned = (await stub_faults(url, slow_next=1, slow_seconds=10))["counters"]["abandoned"]
+    outcomes = len(deepseek_breaker.outcomes)
+    started = time.monotonic()
+    result = await deepseek_utils.deepseek_chat_completion(MESSAGES, model="deepseek-chat", hedge=False,
+                                                           deadline=time.monotonic() + 0.5)
+    seconds = time.monotonic() - started
+    expect(result is None, "a call past its deadline should return None")
+    expect(seconds < 1.0, f"the deadline should cut the call at 0.5 s, took {seconds:.2f}s")
+    expect(len(deepseek_breaker.outcomes) == outcomes, "a missed deadline should not count as a breaker outcome")
+    await asyncio.sleep(0.3)
+    expect((await stub_faults(url))["counters"]["abandoned"] == abandoned + 1,
+           "the timed-out request should have been closed")
+
+async def check_sse(url: str):
+    """Events split mid-JSON across writes are reassembled: every reasoning
+    chunk, the full reply text and the final usage."""
+    await stub_faults(url, split_events=1)
+    try:
+        reasoning, parts, usage = 0, [], None
+        async for delta in deepseek_utils.deepseek_chat_stream(MESSAGES, model="deepseek-reasoner"):
+            reasoning += bool(delta.get("reasoning_content"))
+            parts.append(delta.get("content") or "")
+            usage = delta.get("usage") or usage
+    finally:
+        await stub_faults(url, split_events=0)
+    expect(reasoning == STUB_REASONING_CHUNKS, f"expected {STUB_REASONING_CHUNKS} reasoning chunks, got {reasoning}")
+    text = "".join(parts).strip()
+    expect(text == stub_reply(MESSAGES), f"reassembled reply differs: {text!r}")
+    expect(usage is not None and usage.get("total_tokens"), "the last chunk's usage should be passed on")
+
+CHECKS: List[Callable[[str], Awaitable[None]]] = [check_breaker, check_hedge, check_deadline, check_sse]
+
+async def wait_for_stub(url: str):
+    deadline = time.monotonic() + CHECK_STARTUP_TIMEOUT
+    while True:
+        try:
+            await stub_faults(url)
+            return
+        except aiohttp.ClientError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+async def run(url: str) -> int:
+    failures = 0
+    for check in CHECKS:
+        try:
+            await check(url)
+            print(f"PASS {check.__name__}")
+        except CheckFailed as e:
+            failures += 1
+            print(f"FAIL {check.__name__}: {e}")
+    return failures
+
+async def _main(args: List[str]) -> int:
+    port = int(args[0]) if args else CHECK_PORT
+    url = f"http://127.0.0.1:{port}"
+    deepseek_utils.DEEPSEEK_API_URL = f"{url}/v1/chat/completions"
+    deepseek_utils.DEEPSEEK_API_KEY = "stub"
+    deepseek_utils.DEEPSEEK_BACKOFF_BASE = 0.01  # retries against the stub needn't wait
+    circuit_breaker.BREAKER_COOLDOWN = CHECK_COOLDOWN
+    stub = subprocess.Popen([sys.executable, "-m", "memory.deepseek_stub", str(port)],
+                            env={**os.environ, "STUB_CHUNK_DELAY": CHECK_CHUNK_DELAY},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_for_stub(url)
+        return await run(url)
+    finally:
+        await deepseek_utils.close_session()
+        stub.terminate()
+        stub.wait()
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(_main(sys.argv[1:])) else 0)
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Local stand-in for the DeepSeek chat completions API, for development
+# and load tests without a key or budget. Point the app at it with
+#   DEEPSEEK_API_URL=http://127.0.0.1:8001/v1/chat/completions DEEPSEEK_API_KEY=stub
+# and run: python -m memory.deepseek_stub [port]
+# Faults can be injected at start-up (STUB_ERROR_RATE etc.) or at runtime:
+#   curl -X POST localhost:8001/stub/faults -d '{"error_rate": 0.8, "slow_rate": 0.05}'
+# python -m memory.deepseek_check starts it and runs the client's regression checks.
+
+# Configuration
+STUB_CHUNK_DELAY = float(os.getenv("STUB_CHUNK_DELAY", "0.05"))  # seconds between streamed chunks
+STUB_REASONING_CHUNKS = 20  # reasoning_content chunks deepseek-reasoner sends before the answer
+
+# Fault injection
+faults = {
+    "error_rate": float(os.getenv("STUB_ERROR_RATE", "0")),  # share of requests answered 503
+    "slow_rate": float(os.getenv("STUB_SLOW_RATE", "0")),  # share of requests stalled before answering
+    "slow_seconds": float(os.getenv("STUB_SLOW_SECONDS", "5")),
+    "slow_next": 0.0,  # the next N requests are stalled regardless of slow_rate
+    "split_events": 0.0,  # 1: each SSE event is written in two halves, split mid-JSON
+}
+counters = {"requests": 0, "errors": 0, "slow": 0, "abandoned": 0}
+
+app = FastAPI()
+
+def stub_reply(messages: list) -> str:
+    question = messages[-1]["content"] if messages else ""
+    return f"Stub answer to: {question}. This reply arrives word by word to exercise streaming."
+
+def chunk(model: str, delta: dict, finish_reason=None, usage=None) -> str:
+    body = {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage:
+        body["usage"] = usage
+    return f"data: {json.dumps(body)}\n\n"
+
+async def stall(request: Request, seconds: float) -> bool:
+    """Sleep like a slow upstream; False (and counted) if the client hung up meanwhile."""
+    until = time.monotonic() + seconds
+    while time.monotonic() < until:
+        if await request.is_disconnected():
+            counters["abandoned"] += 1
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+async def split(events):
+    """Write each event in two parts, so clients must reassemble lines across reads."""
+    async for event in events:
+        if not faults["split_events"]:
+            yield event
+            continue
+        half = len(event) // 2
+        yield event[:half]
+        await asyncio.sleep(STUB_CHUNK_DELAY)
+        yield event[half:]
+
+@app.post("/stub/faults")
+async def set_faults(request: Request):
+    faults.update({k: float(v) for k, v in (await request.json()).items() if k in faults})
+    return {"faults": faults, "counters": counters}
+
+@app.get("/stub/faults")
+async def get_faults():
+    return {"faults": faults, "counters": counters}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    counters["requests"] += 1
+    if random.random() < faults["error_rate"]:
+        counters["errors"] += 1
+        return JSONResponse({"error": {"message": "Injected fault", "type": "server_error"}}, status_code=503)
+    if faults["slow_next"] > 0 or random.random() < faults["slow_rate"]:
+        faults["slow_next"] = max(0.0, faults["slow_next"] - 1)
+        counters["slow"] += 1
+        if not await stall(request, faults["slow_seconds"]):
+            return JSONResponse({"error": {"message": "Client went away"}}, status_code=499)
+    model = payload.get("model", "deepseek-reasoner")
+    reply = stub_reply(payload.get("messages", []))
+    if payload.get("max_tokens"):
+        reply = " ".join(reply.split(" ")[:payload["max_tokens"]])
+    # Only the reasoner thinks first, which is what makes it the slow model
+    thinking = STUB_REASONING_CHUNKS if model == "deepseek-reasoner" else 0
+
+    usage = {"prompt_tokens": 10, "completion_tokens": thinking + len(reply.split()),
+             "total_tokens": 10 + thinking + len(reply.split())}
+
+    if not payload.get("stream"):
+        await asyncio.sleep(STUB_CHUNK_DELAY * (thinking + len(reply.split())))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def events():
+        yield chunk(model, {"role": "assistant", "content": ""})
+        for i in range(thinking):
+            await asyncio.sleep(STUB_CHUNK_DELAY)
+            yield chunk(model, {"reasoning_content": f"thinking step {i + 1}. "})
+        for word in reply.split(" "):
+            await asyncio.sleep(STUB_CHUNK_DELAY)
+            yield chunk(model, {"content": word + " "})
+        yield chunk(model, {}, "stop", usage)  # like DeepSeek, usage rides on the last chunk
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(split(events()), media_type="text/event-stream")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]) if len(sys.argv) > 1 else 8001)
@@ -1,35 +1,279 @@
 import os
-import requests
+import asyncio
 import json
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+import aiohttp
+
+from memory.circuit_breaker import OPEN, deepseek_breaker
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 
-async def deepseek_chat_completion(messages: list, model: str = "deepseek-reasoner", stream: bool = False):
-    if not DEEPSEEK_API_KEY:
-        print("DeepSeek API key not set. Cannot make API call.")
-        return None
+# Client configuration
+DEEPSEEK_MAX_CONCURRENCY = int(os.getenv("DEEPSEEK_MAX_CONCURRENCY", "32"))  # in-flight calls per worker; also the pool size
+DEEPSEEK_CONNECT_TIMEOUT = 10.0  # seconds to open a connection
+DEEPSEEK_READ_TIMEOUT = 300.0  # seconds between bytes; the reasoner can think for minutes
+DEEPSEEK_KEEPALIVE = 60.0  # seconds an idle pooled connection is kept
+DEEPSEEK_RETRIES = 3  # extra attempts after a 429/5xx or connection error
+DEEPSEEK_BACKOFF_BASE = 0.5  # seconds; doubles per attempt, full jitter
+DEEPSEEK_BACKOFF_MAX = 8.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Hedging: a second identical attempt once the first is slower than usual
+DEEPSEEK_HEDGE = os.getenv("DEEPSEEK_HEDGE", "0") == "1"  # default for deepseek_chat_completion(hedge=None)
+HEDGE_PERCENTILE = 95  # the hedge goes out when the first attempt passes this latency percentile
+HEDGE_MIN_SAMPLES = 20  # completed calls per model before its percentile is trusted
+HEDGE_MIN_DELAY = 0.2  # seconds
+LATENCY_SAMPLES = 200  # recent call latencies kept per model
 
-    headers = {
+_session: Optional[aiohttp.ClientSession] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+_latencies: Dict[str, Deque[float]] = {}
+hedge_stats = {"hedged": 0, "hedge_won": 0}
+
+def get_session() -> aiohttp.ClientSession:
+    """The shared keep-alive session, created on first use in the running loop."""
+    global _session, _semaphore, _session_loop
+    loop = asyncio.get_running_loop()
+    # CLI scripts run several loops in one process; a session cannot outlive its loop
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=DEEPSEEK_MAX_CONCURRENCY,
+                                         keepalive_timeout=DEEPSEEK_KEEPALIVE,
+                                         ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+        _semaphore = asyncio.Semaphore(DEEPSEEK_MAX_CONCURRENCY)
+        _session_loop = loop
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def _headers(accept: str = "application/json") -> Dict[str, str]:
+    return {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
+        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+        "Accept": accept
     }
 
+def _timeout(connect_timeout: Optional[float], read_timeout: Optional[float]) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(total=None,
+                                 sock_connect=connect_timeout or DEEPSEEK_CONNECT_TIMEOUT,
+                                 sock_read=read_timeout or DEEPSEEK_READ_TIMEOUT)
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after:
+        try:
+            return min(float(retry_after), DEEPSEEK_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(DEEPSEEK_BACKOFF_MAX, DEEPSEEK_BACKOFF_BASE * 2 ** attempt))
+
+async def _post(payload: dict, accept: str, timeout: aiohttp.ClientTimeout) -> aiohttp.ClientResponse:
+    """POST with retries on 429/5xx and connection errors; returns the open 2xx response.
+    The caller must release it. Raises aiohttp.ClientError once retries run out."""
+    session = get_session()
+    body = json.dumps(payload)
+    for attempt in range(DEEPSEEK_RETRIES + 1):
+        retry_after = None
+        try:
+            response = await session.post(DEEPSEEK_API_URL, headers=_headers(accept), data=body, timeout=timeout)
+            final = attempt == DEEPSEEK_RETRIES or deepseek_breaker.state == OPEN
+            if response.status not in RETRY_STATUSES or final:
+                if response.status >= 400:
+                    response.release()
+                response.raise_for_status()
+                return response
+            retry_after = response.headers.get("Retry-After")
+            print(f"DeepSeek API returned {response.status}, retrying (attempt {attempt + 1})")
+            response.release()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == DEEPSEEK_RETRIES or deepseek_breaker.state == OPEN:
+                raise aiohttp.ClientConnectionError(str(e) or type(e).__name__) from e
+            print(f"DeepSeek API connection error ({str(e) or type(e).__name__}), retrying (attempt {attempt + 1})")
+        await asyncio.sleep(_backoff(attempt, retry_after))
+
+def latency_percentile(model: str, pct: float) -> Optional[float]:
+    samples = _latencies.get(model)
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+def hedge_delay(model: str) -> Optional[float]:
+    """Seconds to wait before hedging a call to this model; None until enough calls were seen."""
+    samples = _latencies.get(model)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY, latency_percentile(model, HEDGE_PERCENTILE))
+
+def _upstream_ok(error: Exception) -> bool:
+    """Whether a failed call still says the upstream is healthy (it rejected our request)."""
+    return isinstance(error, aiohttp.ClientResponseError) and error.status < 500 and error.status not in (408, 429)
+
+async def _complete_once(payload: dict, timeout: aiohttp.ClientTimeout) -> dict:
+    async with _semaphore:
+        started = time.monotonic()
+        response = await _post(payload, "application/json", timeout)
+        async with response:
+            result = await response.json(content_type=None)
+    _latencies.setdefault(payload["model"], deque(maxlen=LATENCY_SAMPLES)).append(time.monotonic() - started)
+    return result
+
+async def _hedged(payload: dict, timeout: aiohttp.ClientTimeout) -> dict:
+    """The first successful result of the call and, if that is slower than
+    the model's usual latency, a second identical attempt. The loser is
+    cancelled; if both fail the first attempt's error is raised."""
+    delay = hedge_delay(payload["model"])
+    first = asyncio.ensure_future(_complete_once(payload, timeout))
+    attempts = [first]
+    try:
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if not done:
+            hedge_stats["hedged"] += 1
+            attempts.append(asyncio.ensure_future(_complete_once(payload, timeout)))
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        hedge_stats["hedge_won"] += 1
+                    return task.result()
+        return first.result()
+    finally:
+        for task in attempts:
+            task.cancel()
+
+async def deepseek_chat_completion(messages: list, model: str = "deepseek-reasoner", stream: bool = False,
+                                   connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                                   max_tokens: Optional[int] = None, deadline: Optional[float] = None,
+                                   hedge: Optional[bool] = None):
+    """The parsed completion, or None on any failure.
+
+    deadline is a time.monotonic() instant: the call, retries and hedge
+    included, is abandoned when it passes. hedge=None uses DEEPSEEK_HEDGE.
+    While the circuit breaker is open this returns None without calling."""
+    if not DEEPSEEK_API_KEY:
+        print("DeepSeek API key not set. Cannot make API call.")
+        return None
+
     payload = {
         "model": model,
         "messages": messages,
         "stream": stream
     }
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
 
+    get_session()
+    if not deepseek_breaker.allow():
+        print("DeepSeek circuit open. Skipping API call.")
+        return None
+    timeout = _timeout(connect_timeout, read_timeout)
+    call = _hedged(payload, timeout) if (DEEPSEEK_HEDGE if hedge is None else hedge) else _complete_once(payload, timeout)
     try:
-        # Using requests.post for synchronous call, will need to be wrapped in run_in_executor for async FastAPI
-        # For now, this is a placeholder for direct usage in async functions.
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.post(DEEPSEEK_API_URL, headers=headers, data=json.dumps(payload)))
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling DeepSeek API: {e}")
+        if deadline is not None:
+            result = await asyncio.wait_for(call, deadline - time.monotonic())
+        else:
+            result = await call
+    except asyncio.TimeoutError as e:
+        if isinstance(e, aiohttp.ClientError) or deadline is None or time.monotonic() < deadline:
+            deepseek_breaker.record(False)  # a socket timeout: the upstream stalled
+        else:
+            # The caller's own deadline passed; that says nothing about the upstream's health
+            deepseek_breaker.release()
+        print(f"Error calling DeepSeek API: {str(e) or type(e).__name__}")
+        return None
+    except (aiohttp.ClientError, ValueError) as e:
+        deepseek_breaker.record(_upstream_ok(e))
+        print(f"Error calling DeepSeek API: {str(e) or type(e).__name__}")
         return None
+    except asyncio.CancelledError:
+        deepseek_breaker.release()
+        raise
+    deepseek_breaker.record(True)
+    return result
 
+def parse_sse_line(line: str):
+    """The JSON payload of one SSE `data:` line; None for blank/comment lines, "[DONE]" at the end."""
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return data
+    return json.loads(data)
 
+async def deepseek_chat_stream(messages: list, model: str = "deepseek-reasoner",
+                               connect_timeout: Optional[float] = None,
+                               read_timeout: Optional[float] = None,
+                               max_tokens: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Yield the `delta` of every streamed chunk (content and, for the reasoner, reasoning_content),
+    then {"usage": ...} when the last chunk reports token usage.
+
+    Only opening the stream is retried; once chunks have been yielded a
+    failure is final. Closing the iterator early (client gone) releases
+    the connection. Raises RuntimeError if the key is missing, the
+    circuit breaker is open or the request fails."""
+    if not DEEPSEEK_API_KEY:
+        raise RuntimeError("DeepSeek API key not set. Cannot make API call.")
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True}
+    }
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+
+    get_session()
+    if not deepseek_breaker.allow():
+        raise RuntimeError("DeepSeek circuit open. Skipping API call.")
+    ok = None
+    try:
+        async with _semaphore:
+            try:
+                response = await _post(payload, "text/event-stream", _timeout(connect_timeout, read_timeout))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                ok = _upstream_ok(e)
+                raise RuntimeError(f"Error calling DeepSeek API: {str(e) or type(e).__name__}") from e
+            async with response:
+                try:
+                    async for raw in response.content:
+                        chunk = parse_sse_line(raw.decode().strip())
+                        if chunk == "[DONE]":
+                            break
+                        if chunk and chunk.get("choices"):
+                            yield chunk["choices"][0].get("delta") or {}
+                        if chunk and chunk.get("usage"):
+                            yield {"usage": chunk["usage"]}
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    ok = False
+                    raise RuntimeError(f"Error calling DeepSeek API: {str(e) or type(e).__name__}") from e
+            ok = True
+    finally:
+        # A stream closed early (client gone) says nothing about the upstream
+        if ok is None:
+            deepseek_breaker.release()
+        else:
+            deepseek_breaker.record(ok)
+
+def upstream_stats() -> Dict[str, Any]:
+    """Circuit breaker state, per-model latency percentiles and hedging counters (this worker)."""
+    return {
+        "breaker": deepseek_breaker.status(),
+        "latency": {model: {"samples": len(samples),
+                            **{f"p{pct}": round(latency_percentile(model, pct), 3) for pct in (50, 95, 99)}}
+                    for model, samples in _latencies.items()},
+        "hedging": {"enabled": DEEPSEEK_HEDGE, **hedge_stats,
+                    "delay": {model: hedge_delay(model) for model in _latencies}},
+    }
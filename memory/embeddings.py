@@ -0,0 +1,123 @@
+import hashlib
+import os
+import re
+import zlib
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+# Configuration
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "md5")  # "md5" or "ngram"
+EMBEDDING_CACHE_SIZE = 10_000  # memoized texts
+NGRAM_DIM = 256
+NGRAM_SIZES = (3, 4, 5)
+
+class MD5Embedder:
+    """Deterministic 24-float signature: the MD5 digest bytes scaled to [0, 1].
+
+    Identical texts map to identical vectors, but there is no notion of
+    similarity between different texts."""
+    name = "md5"
+    dim = 24
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # Extend to 192 bits by repeating the 16-byte digest
+        digests = b"".join((hashlib.md5(t.encode()).digest() * 2)[:self.dim] for t in texts)
+        return np.frombuffer(digests, dtype=np.uint8).reshape(len(texts), self.dim) / 255.0
+
+class HashingNgramEmbedder:
+    """Local feature-hashing embedder over words and character n-grams.
+
+    Each word and each character n-gram of a word is hashed (CRC32, stable
+    across processes) into one of `dim` signed buckets; the counts are
+    L2-normalised. Texts sharing words or spelling fragments get nearby
+    vectors, with no model download or network call."""
+    name = "ngram"
+
+    def __init__(self, dim: int = NGRAM_DIM, ngram_sizes=NGRAM_SIZES):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for word in re.findall(r"\w+", text.lower()):
+            features.append(word)
+            padded = f"<{word}>"
+            for n in self.ngram_sizes:
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode())
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+BACKENDS = {
+    "md5": MD5Embedder,
+    "ngram": HashingNgramEmbedder,
+}
+
+class EmbeddingService:
+    """Single entry point for turning text into vectors.
+
+    Wraps a pluggable backend with an LRU memo keyed on the text's hash, so
+    a text seen by /chat, /query, reflect or sync is only embedded once."""
+
+    def __init__(self, backend: str = EMBEDDING_BACKEND, cache_size: int = EMBEDDING_CACHE_SIZE):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        self.backend = BACKENDS[backend]()
+        self.dim = self.backend.dim
+        self.cache_size = cache_size
+        self._memo: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch; only texts not in the memo reach the backend, in one call."""
+        keys = [hashlib.sha1(t.encode()).digest() for t in texts]
+        vectors: List[Any] = [None] * len(texts)
+        missing: Dict[bytes, List[int]] = {}
+        for i, key in enumerate(keys):
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                vectors[i] = cached
+                self.hits += 1
+            else:
+                missing.setdefault(key, []).append(i)
+        if missing:
+            self.misses += len(missing)
+            # Memoised as float32 rows: a Python list of floats would cost ~8x the memory
+            encoded = self.backend.encode([texts[positions[0]] for positions in missing.values()])
+            encoded = encoded.astype(np.float32)
+            for (key, positions), vector in zip(missing.items(), encoded):
+                vector = vector.copy()  # don't let one memo entry pin the whole batch
+                for i in positions:
+                    vectors[i] = vector
+                self._memo[key] = vector
+            while len(self._memo) > self.cache_size:
+                self._memo.popitem(last=False)
+        return [vector.tolist() for vector in vectors]
+
+    def embed(self, text: str) -> List[float]:
+        return self.encode([text])[0]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "dim": self.dim,
+            "memo_size": len(self._memo),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+# Global instance
+embedder = EmbeddingService()
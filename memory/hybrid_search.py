@@ -0,0 +1,87 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from memory import db
+from memory.embeddings import embedder
+from memory import vector_search
+
+# Configuration
+LEXICAL_CANDIDATES = 200  # BM25 hits handed to the vector scorer
+RRF_K = 60  # reciprocal rank fusion damping; larger flattens rank differences
+LEXICAL_WEIGHT = 1.0
+VECTOR_WEIGHT = 1.0
+
+def fts_query(text: str) -> Optional[str]:
+    """Turn free text into a safe FTS5 MATCH expression (any term may match)."""
+    terms = re.findall(r"\w+", text.lower())
+    if not terms:
+        return None
+    return " OR ".join(f'"{t}"' for t in dict.fromkeys(terms))
+
+async def lexical_search(text: str, limit: int = LEXICAL_CANDIDATES, kind: Optional[str] = None,
+                         table: str = "conv_turn") -> List[Tuple[int, float]]:
+    """(id, bm25) pairs from the FTS5 mirror of conv_turn, concepts or lessons
+    (id is the rowid there), best first.
+
+    bm25() is negative in SQLite, more negative meaning more relevant."""
+    match = fts_query(text)
+    if match is None:
+        return []
+    if table == "conv_turn":
+        sql = """
+            SELECT f.rowid AS id, bm25(conv_turn_fts) AS score
+            FROM conv_turn_fts f JOIN conv_turn c ON c.id = f.rowid
+            WHERE conv_turn_fts MATCH ? AND c.embedding IS NOT NULL"""
+    elif table == "concepts":
+        sql = """
+            SELECT f.rowid AS id, bm25(concepts_fts) AS score
+            FROM concepts_fts f JOIN concepts c ON c.id = f.rowid
+            WHERE concepts_fts MATCH ?"""
+    elif table == "lessons":
+        sql = """
+            SELECT f.rowid AS id, bm25(lessons_fts) AS score
+            FROM lessons_fts f
+            WHERE lessons_fts MATCH ?"""
+    else:
+        raise ValueError(f"No full-text index for table: {table}")
+    params = [match]
+    if kind:
+        sql += " AND c.kind = ?"
+        params.append(kind)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+
+    async with db.reader() as conn:
+        cursor = await conn.execute(sql, params)
+        return [(row["id"], row["score"]) for row in await cursor.fetchall()]
+
+def reciprocal_rank_fusion(*rankings: Tuple[float, List[int]]) -> Dict[int, float]:
+    """Fuse (weight, ids best-first) rankings: sum of weight / (RRF_K + rank)."""
+    fused: Dict[int, float] = {}
+    for weight, ids in rankings:
+        for rank, turn_id in enumerate(ids, start=1):
+            fused[turn_id] = fused.get(turn_id, 0.0) + weight / (RRF_K + rank)
+    return fused
+
+async def hybrid_search(text: str, top_k: int = 3, kind: Optional[str] = None,
+                        metric: str = "l1") -> List[Tuple[int, float]]:
+    """BM25 candidates re-ranked together with their vector distance.
+
+    Only the lexical candidates are vector-scored, so the scorer touches a
+    few hundred rows instead of the whole index. Returns (turn_id, fused
+    score) pairs, highest first; with no lexical match it falls back to a
+    plain vector search, scored with the same fusion formula."""
+    lexical = await lexical_search(text, kind=kind)
+    query_vector = embedder.embed(text)
+    if not lexical:
+        vector_hits = await vector_search.search(query_vector, top_k, kind, metric)
+        fused = reciprocal_rank_fusion((VECTOR_WEIGHT, [turn_id for turn_id, _ in vector_hits]))
+        return list(fused.items())
+
+    vector_hits = await vector_search.score_ids(query_vector, [turn_id for turn_id, _ in lexical], kind, metric)
+    fused = reciprocal_rank_fusion(
+        (LEXICAL_WEIGHT, [turn_id for turn_id, _ in lexical]),
+        (VECTOR_WEIGHT, [turn_id for turn_id, _ in vector_hits]),
+    )
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:top_k]
@@ -9,12 +9,15 @@ import aiohttp
 import logging
 
 from memory import db
+from memory.embeddings import embedder
+from memory.pagination import iter_rows
 
 # Configuration
 BROTHER_MANUS_URL = "https://github.com/starsh00ter/manus_ai_smart_layer"  # Placeholder - would be actual API endpoint
 SYNC_INTERVAL = 3600  # 1 hour in seconds
 MAX_RETRY_ATTEMPTS = 3
 RETRY_DELAY = 5  # seconds
+SYNC_BATCH_SIZE = 500  # concepts per queued concept_sync message
 
 # Shared secret for message authentication (in production, this would be securely configured)
 SHARED_SECRET = "manus_inter_communication_secret_key"
@@ -25,6 +28,7 @@ class InterManusSync:
         self.last_sync_timestamp = 0
         self.sync_queue = asyncio.Queue()
         self.is_running = False
+        self._tasks = []
         
     async def start_sync_service(self):
         """Start the background synchronization service"""
@@ -35,12 +39,17 @@ class InterManusSync:
         self.logger.info("Starting Inter-Manus synchronization service")
         
         # Start background tasks
-        asyncio.create_task(self.sync_loop())
-        asyncio.create_task(self.process_sync_queue())
+        self._tasks = [
+            asyncio.create_task(self.sync_loop()),
+            asyncio.create_task(self.process_sync_queue()),
+        ]
         
     async def stop_sync_service(self):
         """Stop the synchronization service"""
         self.is_running = False
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
         self.logger.info("Stopping Inter-Manus synchronization service")
         
     async def sync_loop(self):
@@ -74,44 +83,45 @@ class InterManusSync:
         except Exception as e:
             self.logger.error(f"Error during synchronization: {e}")
             
+    async def queue_concept_batch(self, concepts: List[Dict[str, Any]]):
+        """Package concepts for transmission and queue them"""
+        await self.sync_queue.put({
+            "type": "concept_sync",
+            "timestamp": int(time.time()),
+            "source": "manus_origin_v1.1",
+            "concepts": concepts
+        })
+
     async def sync_concepts(self):
         """Synchronize learned concepts with brother Manus"""
         try:
-            # Get concepts learned since last sync
-            pool = await db.get_db_pool()
-            cursor = await pool.execute("""
+            # Stream concepts learned since last sync, queueing one package per batch
+            batch = []
+            queued = 0
+            async for concept in iter_rows("""
                 SELECT id, text, kind, meta, embedding, created_at 
                 FROM concepts 
                 WHERE created_at > ? 
                 ORDER BY created_at DESC
-            """, (self.last_sync_timestamp,))
-            
-            new_concepts = await cursor.fetchall()
-            
-            if new_concepts:
-                # Package concepts for transmission
-                concept_package = {
-                    "type": "concept_sync",
-                    "timestamp": int(time.time()),
-                    "source": "manus_origin_v1.1",
-                    "concepts": []
-                }
-                
-                for concept in new_concepts:
-                    concept_data = {
-                        "id": concept["id"],
-                        "text": concept["text"],
-                        "kind": concept["kind"],
-                        "meta": json.loads(concept["meta"]) if concept["meta"] else None,
-                        "embedding": json.loads(concept["embedding"]) if concept["embedding"] else None,
-                        "created_at": concept["created_at"],
-                        "confidence": self.calculate_concept_confidence(concept)
-                    }
-                    concept_package["concepts"].append(concept_data)
-                
-                # Queue for transmission
-                await self.sync_queue.put(concept_package)
-                self.logger.info(f"Queued {len(new_concepts)} concepts for sync")
+            """, (self.last_sync_timestamp,)):
+                batch.append({
+                    "id": concept["id"],
+                    "text": concept["text"],
+                    "kind": concept["kind"],
+                    "meta": json.loads(concept["meta"]) if concept["meta"] else None,
+                    "embedding": db.unpack_embedding(concept["embedding"]),
+                    "created_at": concept["created_at"],
+                    "confidence": await self.calculate_concept_confidence(concept)
+                })
+                if len(batch) == SYNC_BATCH_SIZE:
+                    await self.queue_concept_batch(batch)
+                    queued += len(batch)
+                    batch = []
+            if batch:
+                await self.queue_concept_batch(batch)
+                queued += len(batch)
+            if queued:
+                self.logger.info(f"Queued {queued} concepts for sync")
                 
         except Exception as e:
             self.logger.error(f"Error syncing concepts: {e}")
@@ -210,14 +220,14 @@ class InterManusSync:
             # For now, we'll simulate processing any stored incoming messages
             
             # Check for simulated incoming messages in sync log
-            pool = await db.get_db_pool()
-            cursor = await pool.execute("""
-                SELECT * FROM sync_log 
-                WHERE direction = 'incoming' AND processed = 0
-                ORDER BY timestamp ASC
-            """)
-            
-            incoming_messages = await cursor.fetchall()
+            async with db.reader() as conn:
+                cursor = await conn.execute("""
+                    SELECT * FROM sync_log 
+                    WHERE direction = 'incoming' AND processed = 0
+                    ORDER BY timestamp ASC
+                """)
+                
+                incoming_messages = await cursor.fetchall()
             
             for message_row in incoming_messages:
                 try:
@@ -225,9 +235,10 @@ class InterManusSync:
                     await self.handle_incoming_message(message)
                     
                     # Mark as processed
-                    await pool.execute("""
-                        UPDATE sync_log SET processed = 1 WHERE id = ?
-                    """, (message_row["id"],))
+                    async with db.writer() as conn:
+                        await conn.execute("""
+                            UPDATE sync_log SET processed = 1 WHERE id = ?
+                        """, (message_row["id"],))
                     
                 except Exception as e:
                     self.logger.error(f"Error processing incoming message {message_row['id']}: {e}")
@@ -262,7 +273,12 @@ class InterManusSync:
         try:
             concepts = message.get("concepts", [])
             
-            for concept in concepts:
+            # Re-embed locally so synced concepts share our vector space,
+            # whatever embedder the sender used
+            embeddings = embedder.encode([concept["text"] for concept in concepts])
+            
+            for concept, embedding in zip(concepts, embeddings):
+                concept = {**concept, "embedding": embedding}
                 # Check if concept already exists
                 existing = await self.check_concept_exists(concept["text"])
                 
@@ -398,11 +414,11 @@ class InterManusSync:
     async def store_sync_log(self, direction: str, message: Dict[str, Any]):
         """Store synchronization log entry"""
         try:
-            pool = await db.get_db_pool()
-            await pool.execute("""
-                INSERT INTO sync_log (direction, message, timestamp, processed)
-                VALUES (?, ?, ?, ?)
-            """, (direction, json.dumps(message), int(time.time()), 0))
+            async with db.writer() as conn:
+                await conn.execute("""
+                    INSERT INTO sync_log (direction, message, timestamp, processed)
+                    VALUES (?, ?, ?, ?)
+                """, (direction, json.dumps(message), int(time.time()), 0))
             
         except Exception as e:
             self.logger.error(f"Error storing sync log: {e}")
@@ -410,12 +426,12 @@ class InterManusSync:
     async def check_concept_exists(self, text: str) -> Optional[Dict[str, Any]]:
         """Check if a concept already exists"""
         try:
-            pool = await db.get_db_pool()
-            cursor = await pool.execute("""
-                SELECT * FROM concepts WHERE text = ?
-            """, (text,))
-            
-            result = await cursor.fetchone()
+            async with db.reader() as conn:
+                cursor = await conn.execute("""
+                    SELECT * FROM concepts WHERE text = ?
+                """, (text,))
+                
+                result = await cursor.fetchone()
             return dict(result) if result else None
             
         except Exception as e:
@@ -425,18 +441,18 @@ class InterManusSync:
     async def add_synced_concept(self, concept: Dict[str, Any], source: str):
         """Add a concept received from synchronization"""
         try:
-            pool = await db.get_db_pool()
-            await pool.execute("""
-                INSERT INTO concepts (text, kind, meta, embedding, created_at, source)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                concept["text"],
-                concept.get("kind"),
-                json.dumps(concept.get("meta")),
-                json.dumps(concept.get("embedding")),
-                concept.get("created_at", int(time.time())),
-                f"sync_{source}"
-            ))
+            async with db.writer() as conn:
+                await conn.execute("""
+                    INSERT INTO concepts (text, kind, meta, embedding, created_at, source)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (
+                    concept["text"],
+                    concept.get("kind"),
+                    json.dumps(concept.get("meta")),
+                    db.pack_embedding(concept.get("embedding")),
+                    concept.get("created_at", int(time.time())),
+                    f"sync_{source}"
+                ))
             
         except Exception as e:
             self.logger.error(f"Error adding synced concept: {e}")
@@ -444,17 +460,17 @@ class InterManusSync:
     async def update_synced_concept(self, concept: Dict[str, Any], source: str):
         """Update an existing concept with synced data"""
         try:
-            pool = await db.get_db_pool()
-            await pool.execute("""
-                UPDATE concepts 
-                SET meta = ?, embedding = ?, source = ?
-                WHERE text = ?
-            """, (
-                json.dumps(concept.get("meta")),
-                json.dumps(concept.get("embedding")),
-                f"sync_{source}",
-                concept["text"]
-            ))
+            async with db.writer() as conn:
+                await conn.execute("""
+                    UPDATE concepts 
+                    SET meta = ?, embedding = ?, source = ?
+                    WHERE text = ?
+                """, (
+                    json.dumps(concept.get("meta")),
+                    db.pack_embedding(concept.get("embedding")),
+                    f"sync_{source}",
+                    concept["text"]
+                ))
             
         except Exception as e:
             self.logger.error(f"Error updating synced concept: {e}")
@@ -462,11 +478,11 @@ class InterManusSync:
     async def store_brother_metrics(self, metrics: Dict[str, Any], source: str):
         """Store performance metrics from brother Manus"""
         try:
-            pool = await db.get_db_pool()
-            await pool.execute("""
-                INSERT INTO brother_metrics (source, metrics, timestamp)
-                VALUES (?, ?, ?)
-            """, (source, json.dumps(metrics), int(time.time())))
+            async with db.writer() as conn:
+                await conn.execute("""
+                    INSERT INTO brother_metrics (source, metrics, timestamp)
+                    VALUES (?, ?, ?)
+                """, (source, json.dumps(metrics), int(time.time())))
             
         except Exception as e:
             self.logger.error(f"Error storing brother metrics: {e}")
@@ -474,11 +490,11 @@ class InterManusSync:
     async def store_brother_status(self, status: Dict[str, Any], source: str):
         """Store system status from brother Manus"""
         try:
-            pool = await db.get_db_pool()
-            await pool.execute("""
-                INSERT INTO brother_status (source, status, timestamp)
-                VALUES (?, ?, ?)
-            """, (source, json.dumps(status), int(time.time())))
+            async with db.writer() as conn:
+                await conn.execute("""
+                    INSERT INTO brother_status (source, status, timestamp)
+                    VALUES (?, ?, ?)
+                """, (source, json.dumps(status), int(time.time())))
             
         except Exception as e:
             self.logger.error(f"Error storing brother status: {e}")
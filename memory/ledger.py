@@ -0,0 +1,204 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from memory import db, budget
+from memory.write_buffer import write_buffer
+from memory.workers import MULTI_WORKER
+
+# Configuration
+LEDGER_CHECKPOINT_INTERVAL = 60  # seconds between token_checkpoint snapshots
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+class TokenLedger:
+    """Daily token budget held in memory, persisted to SQLite.
+
+    Every debit is appended to token_spend (through the group-commit write
+    buffer) and applied to in-memory counters under an asyncio lock, so
+    concurrent /spend and /chat calls can't lose updates and balance reads
+    are a subtraction. token_checkpoint snapshots the day's totals so a
+    restart replays only the spends after the last checkpoint. Counters
+    reset when the UTC date changes; the cap is budget.DAILY_CAP."""
+
+    def __init__(self):
+        self.day = _today()
+        self.spent = 0
+        self.by_category: Dict[str, int] = {}
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def _roll_day(self):
+        today = _today()
+        if today != self.day:
+            self.day = today
+            self.spent = 0
+            self.by_category = {}
+
+    async def load(self):
+        async with self._lock:
+            await self._load()
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self._load()
+
+    async def _load(self):
+        """Rebuild today's counters from the last checkpoint plus later spends."""
+        self.day = _today()
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT spent, by_category, last_spend_id FROM token_checkpoint WHERE day = ?", (self.day,))
+            checkpoint = await cursor.fetchone()
+            self.spent = checkpoint["spent"] if checkpoint else 0
+            self.by_category = json.loads(checkpoint["by_category"]) if checkpoint else {}
+            cursor = await conn.execute(
+                "SELECT category, SUM(tokens) AS tokens FROM token_spend WHERE day = ? AND id > ? GROUP BY category",
+                (self.day, checkpoint["last_spend_id"] if checkpoint else 0))
+            for row in await cursor.fetchall():
+                self.spent += row["tokens"]
+                self.by_category[row["category"]] = self.by_category.get(row["category"], 0) + row["tokens"]
+        self.loaded = True
+
+    def balance(self) -> int:
+        """Tokens left today; a memory lookup, no I/O."""
+        self._roll_day()
+        return budget.DAILY_CAP - self.spent
+
+    def _debit(self, category: str, tokens: int):
+        self.spent += tokens
+        self.by_category[category] = self.by_category.get(category, 0) + tokens
+        write_buffer.submit("INSERT INTO token_spend(day,category,tokens,ts) VALUES (?,?,?,?)",
+                            (self.day, category, tokens, int(time.time())), durable=False)
+
+    async def try_spend(self, category: str, tokens: int) -> bool:
+        """Debit only if today's balance covers it; check and debit are atomic."""
+        await self.ensure_loaded()
+        async with self._lock:
+            if tokens > self.balance():
+                return False
+            self._debit(category, tokens)
+            return True
+
+    async def spend(self, category: str, tokens: int):
+        """Debit unconditionally (for costs already incurred)."""
+        await self.ensure_loaded()
+        async with self._lock:
+            self._roll_day()
+            self._debit(category, tokens)
+
+    async def checkpoint(self):
+        async with self._lock:
+            self._roll_day()
+            # Spends queued so far must be committed for last_spend_id to cover them
+            await write_buffer.flush()
+            async with db.writer() as conn:
+                cursor = await conn.execute("SELECT COALESCE(MAX(id), 0) FROM token_spend WHERE day = ?", (self.day,))
+                last_spend_id = (await cursor.fetchone())[0]
+                await conn.execute(
+                    "INSERT OR REPLACE INTO token_checkpoint(day,spent,by_category,last_spend_id,ts) VALUES (?,?,?,?,?)",
+                    (self.day, self.spent, json.dumps(self.by_category), last_spend_id, int(time.time())))
+
+    async def refresh(self):
+        """Bring the counters up to date before reporting them (a no-op in one process)."""
+        await self.ensure_loaded()
+
+    def totals(self) -> Dict[str, Any]:
+        balance = self.balance()
+        return {
+            "day": self.day,
+            "daily_cap": budget.DAILY_CAP,
+            "spent": self.spent,
+            "balance": balance,
+            "by_category": dict(self.by_category),
+        }
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(LEDGER_CHECKPOINT_INTERVAL)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                print(f"Ledger checkpoint failed: {e}")
+
+    async def start(self):
+        await self.ensure_loaded()
+        self._task = asyncio.create_task(self._checkpoint_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.loaded:
+            await self.checkpoint()
+
+class SharedTokenLedger(TokenLedger):
+    """Token ledger shared by several worker processes through SQLite.
+
+    The day's total lives in token_budget and is debited with a single
+    conditional UPDATE ... RETURNING, so two workers can never both pass
+    the balance check. Local counters only mirror the last value read;
+    refresh() re-reads them for reporting."""
+
+    async def _load(self):
+        await super()._load()
+        await self._read_totals()
+
+    async def _read_totals(self):
+        async with db.reader() as conn:
+            cursor = await conn.execute("SELECT spent FROM token_budget WHERE day = ?", (self.day,))
+            row = await cursor.fetchone()
+            cursor = await conn.execute(
+                "SELECT category, SUM(tokens) AS tokens FROM token_spend WHERE day = ? GROUP BY category", (self.day,))
+            self.by_category = {r["category"]: r["tokens"] for r in await cursor.fetchall()}
+        self.spent = row["spent"] if row else sum(self.by_category.values())
+
+    async def _shared_debit(self, category: str, tokens: int, limit: bool) -> bool:
+        self._roll_day()
+        async with db.writer() as conn:
+            # Seed today's row from the spend log the first time any worker debits
+            await conn.execute("""
+                INSERT OR IGNORE INTO token_budget(day, spent)
+                SELECT ?, COALESCE(SUM(tokens), 0) FROM token_spend WHERE day = ?
+            """, (self.day, self.day))
+            sql = "UPDATE token_budget SET spent = spent + ? WHERE day = ?"
+            params = [tokens, self.day]
+            if limit:
+                sql += " AND spent + ? <= ?"
+                params += [tokens, budget.DAILY_CAP]
+            cursor = await conn.execute(sql + " RETURNING spent", params)
+            row = await cursor.fetchone()
+            if row is None:
+                return False
+            await conn.execute("INSERT INTO token_spend(day,category,tokens,ts) VALUES (?,?,?,?)",
+                               (self.day, category, tokens, int(time.time())), durable=False)
+        self.spent = row["spent"]
+        self.by_category[category] = self.by_category.get(category, 0) + tokens
+        return True
+
+    async def try_spend(self, category: str, tokens: int) -> bool:
+        await self.ensure_loaded()
+        return await self._shared_debit(category, tokens, limit=True)
+
+    async def spend(self, category: str, tokens: int):
+        await self.ensure_loaded()
+        await self._shared_debit(category, tokens, limit=False)
+
+    async def checkpoint(self):
+        # token_budget is always current; nothing to snapshot
+        pass
+
+    async def refresh(self):
+        await self.ensure_loaded()
+        self._roll_day()
+        await self._read_totals()
+
+# Global instance
+ledger = SharedTokenLedger() if MULTI_WORKER else TokenLedger()
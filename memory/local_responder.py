@@ -0,0 +1,251 @@
+import asyncio
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from memory import db, vector_search
+from memory.embeddings import embedder
+from memory.hybrid_search import lexical_search
+
+# Configuration
+LOCAL_RESPONDER_ENABLED = os.getenv("LOCAL_RESPONDER", "1") != "0"
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_CONFIDENCE_THRESHOLD", "0.9"))  # below this, escalate to DeepSeek
+LOCAL_TURN_CANDIDATES = 5  # nearest past questions checked for a stored answer
+LOCAL_PAST_ANSWER_MAX_AGE = int(os.getenv("LOCAL_PAST_ANSWER_MAX_AGE", str(7 * 86400)))  # seconds; older answers may be stale
+LOCAL_LESSONS_LISTED = 5
+LOCAL_FACT_MIN_TERMS = 2  # a subject this short matches too much of the knowledge base
+LOCAL_LESSON_CONFIDENCE = 0.85  # a lesson containing every term of the subject; below the threshold, as
+                                # a lesson is a remark, not a definition (served only at a lowered threshold)
+
+# A handler takes the user message and returns (reply, confidence in 0..1)
+# or None. Handlers run in registration order; the first reply at or above
+# LOCAL_CONFIDENCE_THRESHOLD answers the request, otherwise it escalates.
+Handler = Callable[[str], Awaitable[Optional[Tuple[str, float]]]]
+Template = Union[str, Callable[[re.Match], Awaitable[str]]]
+
+# Words that say nothing about a "what is X" subject
+_STOPWORDS = {"a", "an", "the", "of", "in", "on", "at", "to", "for", "and", "or", "with", "by", "from",
+              "is", "are", "was", "be", "it", "its", "this", "that", "these", "those", "about", "do", "does",
+              "you", "your", "my", "me", "i", "we", "our"}
+
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize(message: str) -> str:
+    """Lowercased words only, so rules match regardless of punctuation."""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", message.lower())).strip()
+
+async def _token_balance(match: re.Match) -> str:
+    return f"You have {await db.token_balance()} tokens left in today's budget."
+
+async def _recent_lessons(match: re.Match) -> str:
+    lessons = await db.fetch(LOCAL_LESSONS_LISTED)
+    if not lessons:
+        return "I haven't recorded any lessons yet."
+    return "Most recent lessons:\n" + "\n".join(f"- {lesson}" for lesson in lessons)
+
+# (pattern over the whole normalized message, template, confidence).
+# str templates may use {time} and {date} (UTC).
+RULES: List[Tuple[str, Template, float]] = [
+    (r"(hi|hello|hey|good (morning|afternoon|evening))( there)?( manus)?", "Hello! How can I help you today?", 0.99),
+    (r"(thanks|thank you|thx|cheers)( a lot| so much| very much)?( manus)?", "You're welcome!", 0.99),
+    (r"(bye|goodbye|see you|good night)( later| soon)?( manus)?", "Goodbye! Talk to you soon.", 0.99),
+    (r"(what time is it|what's the time|what is the time)( now)?", "It's {time} UTC.", 0.95),
+    (r"(what's|what is) (the date|today's date)( today)?|what day is (it|today)", "Today is {date}.", 0.95),
+    (r"how many tokens (do i have |are )?left|what's my (token )?budget|what is my (token )?budget", _token_balance, 0.95),
+    (r"what have you learned( recently| lately| today)?", _recent_lessons, 0.95),
+]
+
+_FACT_QUESTION = re.compile(r"(what is|what are|what's|who is|who's|define|tell me about|what do you know about) (?P<subject>.+)")
+
+class LocalResponder:
+    """Answers cheap requests in-process before the orchestrator pays for a
+    DeepSeek call: canned replies for greetings and status questions,
+    stored answers to questions asked before, and facts from the shared
+    knowledge base. Each candidate carries a confidence; anything below
+    LOCAL_CONFIDENCE_THRESHOLD escalates."""
+
+    def __init__(self, threshold: float = LOCAL_CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        self.rules = [(re.compile(pattern), template, confidence) for pattern, template, confidence in RULES]
+        self.handlers: List[Tuple[str, Handler]] = []
+        self.answered: Dict[str, int] = {}
+        self.escalated = 0
+        self.register("rules", self.match_rules)
+        self.register("past_answer", self.past_answer)
+        self.register("knowledge", self.knowledge)
+
+    def register(self, name: str, handler: Handler, first: bool = False):
+        """Add a handler (e.g. an on-box model); first=True runs it before the built-in ones."""
+        if first:
+            self.handlers.insert(0, (name, handler))
+        else:
+            self.handlers.append((name, handler))
+
+    async def respond(self, message: str, threshold: Optional[float] = None
+                      ) -> Tuple[Optional[str], Optional[float], Optional[str]]:
+        """(reply, confidence, handler name). reply is None when the request
+        should escalate; confidence and name then describe the best near miss.
+        A lower threshold serves weaker answers (e.g. while DeepSeek is down)."""
+        threshold = self.threshold if threshold is None else threshold
+        best: Tuple[Optional[float], Optional[str]] = (None, None)
+        if not LOCAL_RESPONDER_ENABLED:
+            return None, None, None
+        for name, handler in self.handlers:
+            try:
+                candidate = await handler(message)
+            except Exception as e:
+                print(f"Local responder handler {name} failed: {e}")
+                continue
+            if candidate is None:
+                continue
+            reply, confidence = candidate
+            if confidence >= threshold:
+                self.answered[name] = self.answered.get(name, 0) + 1
+                return reply, confidence, name
+            if best[0] is None or confidence > best[0]:
+                best = (confidence, name)
+        self.escalated += 1
+        return None, best[0], best[1]
+
+    async def match_rules(self, message: str) -> Optional[Tuple[str, float]]:
+        text = normalize(message)
+        for pattern, template, confidence in self.rules:
+            match = pattern.fullmatch(text)
+            if match is None:
+                continue
+            if callable(template):
+                return await template(match), confidence
+            now = datetime.now(timezone.utc)
+            return template.format(time=now.strftime("%H:%M"), date=now.strftime("%A, %d %B %Y")), confidence
+        return None
+
+    async def past_answer(self, message: str) -> Optional[Tuple[str, float]]:
+        """The stored reply to the most similar question asked before.
+
+        Covers answers the response caches no longer hold (expired, evicted,
+        or from before a restart). remember_exchange() queues the user turn
+        and its reply back to back, so the reply is the next turn id. Stand-in
+        replies given while DeepSeek was down are never reused, nor answers
+        older than LOCAL_PAST_ANSWER_MAX_AGE (what was true then may not be)."""
+        hits = await vector_search.search(embedder.embed(message), LOCAL_TURN_CANDIDATES, metric="cosine")
+        if not hits:
+            return None
+        similarity = {turn_id: 1.0 - distance for turn_id, distance in hits}
+        ids = list(similarity)
+        marks = ",".join("?" * len(ids))
+        async with db.reader() as conn:
+            cursor = await conn.execute(f"""
+                SELECT q.id, a.text FROM conv_turn q JOIN conv_turn a ON a.id = q.id + 1
+                WHERE q.id IN ({marks}) AND q.role = 'user' AND a.role = 'assistant'
+                  AND a.ts >= ? AND (a.meta IS NULL OR json_extract(a.meta, '$.fallback') IS NULL)
+            """, ids + [int(time.time()) - LOCAL_PAST_ANSWER_MAX_AGE])
+            rows = await cursor.fetchall()
+        if not rows:
+            return None
+        best = max(rows, key=lambda r: similarity[r["id"]])
+        return best["text"], similarity[best["id"]]
+
+    async def knowledge(self, message: str) -> Optional[Tuple[str, float]]:
+        """A "what is X" question answered from lessons or the concepts knowledge base.
+
+        The best BM25 match in each scores by how many of the subject's
+        terms (stopwords aside) it contains: a concept times its stored
+        confidence, a lesson times LOCAL_LESSON_CONFIDENCE."""
+        match = _FACT_QUESTION.fullmatch(normalize(message))
+        if match is None:
+            return None
+        terms = set(re.findall(r"\w+", match.group("subject"))) - _STOPWORDS
+        if len(terms) < LOCAL_FACT_MIN_TERMS:
+            return None
+        subject = " ".join(sorted(terms))
+        lessons = await lexical_search(subject, limit=1, table="lessons")
+        concepts = await lexical_search(subject, limit=1, table="concepts")
+        candidates = []
+        async with db.reader() as conn:
+            if lessons:
+                cursor = await conn.execute("SELECT txt FROM lessons WHERE rowid = ?", (lessons[0][0],))
+                row = await cursor.fetchone()
+                if row is not None:
+                    candidates.append((row["txt"], LOCAL_LESSON_CONFIDENCE))
+            if concepts:
+                cursor = await conn.execute("SELECT text, confidence FROM concepts WHERE id = ?", (concepts[0][0],))
+                row = await cursor.fetchone()
+                if row is not None:
+                    candidates.append((row["text"], row["confidence"] or 0.0))
+        best = None
+        for text, confidence in candidates:
+            words = set(re.findall(r"\w+", text.lower()))
+            coverage = sum(any(w.startswith(t) for w in words) for t in terms) / len(terms)  # "clock" covers "clocks"
+            if best is None or confidence * coverage > best[1]:
+                best = (text, confidence * coverage)
+        return best
+
+    def stats(self) -> Dict[str, Any]:
+        answered = sum(self.answered.values())
+        total = answered + self.escalated
+        return {
+            "enabled": LOCAL_RESPONDER_ENABLED,
+            "threshold": self.threshold,
+            "answered": answered,
+            "escalated": self.escalated,
+            "by_handler": dict(self.answered),
+            "answer_rate": answered / total if total else 0.0,
+        }
+
+async def savings_report(days: int = 7) -> Dict[str, Any]:
+    """Requests answered locally vs by DeepSeek from orchestrator_logs, with
+    their mean latency and the budget the local answers did not spend."""
+    from memory.router import DEFAULT_ROUTE, ROUTES
+    async with db.reader() as conn:
+        # Requests the log sink only counted are in orchestrator_log_rollup
+        since = int(time.time()) - days * 86400
+        cursor = await conn.execute("""
+            SELECT tier, SUM(requests) AS requests, SUM(latency) / SUM(requests) AS latency, SUM(cost) AS cost
+            FROM (
+                SELECT CASE WHEN cache_hit THEN 'cache' WHEN local_model_used THEN 'local'
+                            WHEN deepseek_used THEN 'deepseek' ELSE 'other' END AS tier,
+                       COUNT(*) AS requests, SUM(latency) AS latency, SUM(cost) AS cost
+                FROM orchestrator_logs WHERE timestamp >= ? GROUP BY tier
+                UNION ALL
+                SELECT tier, requests, latency, cost FROM orchestrator_log_rollup WHERE minute >= ?
+            )
+            GROUP BY tier
+        """, (since, since // 60 * 60))
+        tiers = {r["tier"]: {"requests": r["requests"], "avg_latency": round(r["latency"], 4), "cost": r["cost"]}
+                 for r in await cursor.fetchall()}
+        cursor = await conn.execute("""
+            SELECT local_source, COUNT(*) AS requests FROM orchestrator_logs
+            WHERE local_model_used AND timestamp >= ? GROUP BY local_source
+        """, (since,))
+        by_source = {r["local_source"]: r["requests"] for r in await cursor.fetchall()}
+    local = tiers.get("local", {"requests": 0, "avg_latency": 0.0})
+    deepseek = tiers.get("deepseek")
+    # What a DeepSeek call has cost on average, or the default route's prior
+    call_cost = deepseek["cost"] / deepseek["requests"] if deepseek else ROUTES[DEFAULT_ROUTE]["cost"]
+    return {
+        "days": days,
+        "tiers": tiers,
+        "local_by_handler": by_source,
+        "budget_saved": round(local["requests"] * call_cost),
+        "latency_saved": round(local["requests"] * (deepseek["avg_latency"] - local["avg_latency"]), 2) if deepseek else None,
+    }
+
+# Global instance
+local_responder = LocalResponder()
+
+async def _main(args: List[str]):
+    try:
+        if args and args[0] == "ask":
+            print(await local_responder.respond(" ".join(args[1:])))
+        else:
+            print(await savings_report(int(args[0]) if args else 7))
+    finally:
+        await db.close_db_pool()
+
+if __name__ == "__main__":
+    # python -m memory.local_responder [days] | ask MESSAGE
+    asyncio.run(_main(sys.argv[1:]))
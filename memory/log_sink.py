@@ -0,0 +1,173 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from memory import db
+
+# Configuration
+LOG_SINK_CAPACITY = 10_000  # rows held in memory; past this, entries are only counted in the rollup
+LOG_SINK_HIGH_WATER = 0.8  # fill above which routine entries (cache and local hits) are only counted
+LOG_SINK_BATCH_ROWS = 1000  # rows per flush transaction
+LOG_SINK_FLUSH_INTERVAL = 0.25  # seconds between flushes while the buffer is below the batch size
+LOG_SINK_TEXT_CHARS = int(os.getenv("LOG_SINK_TEXT_CHARS", "2000"))  # user_message/response characters kept per row
+LOG_SINK_RESPONSE_SAMPLE = float(os.getenv("LOG_SINK_RESPONSE_SAMPLE", "1.0"))  # share of rows that keep their response text
+LOG_SINK_VERBOSE = os.getenv("LOG_SINK_VERBOSE", "0") == "1"  # print a line per entry
+
+LOG_COLUMNS = (
+    "timestamp", "user_message", "cache_hit", "cache_similarity", "local_model_used",
+    "local_source", "local_confidence", "deepseek_used", "manus_used", "model", "route", "fallback",
+    "flight_id", "coalesced", "cost", "latency", "quality_score", "response", "error",
+)
+INSERT_LOG = (f"INSERT INTO orchestrator_logs ({', '.join(LOG_COLUMNS)}, created_at) "
+              f"VALUES ({', '.join('?' * (len(LOG_COLUMNS) + 1))})")
+UPSERT_ROLLUP = """
+    INSERT INTO orchestrator_log_rollup (minute, tier, requests, cost, latency, errors)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(minute, tier) DO UPDATE SET
+        requests = requests + excluded.requests, cost = cost + excluded.cost,
+        latency = latency + excluded.latency, errors = errors + excluded.errors"""
+
+def tier(entry: Dict[str, Any]) -> str:
+    if entry["cache_hit"]:
+        return "cache"
+    if entry["local_model_used"]:
+        return "local"
+    if entry["deepseek_used"]:
+        return "deepseek"
+    return "other"
+
+def _clip(text: Optional[str]) -> Optional[str]:
+    if text is None or len(text) <= LOG_SINK_TEXT_CHARS:
+        return text
+    return f"{text[:LOG_SINK_TEXT_CHARS]}… [+{len(text) - LOG_SINK_TEXT_CHARS} chars]"
+
+class LogSink:
+    """Orchestrator log rows, written off the request path.
+
+    put() never waits: it turns the entry into a row (long texts clipped,
+    response bodies sampled) and appends it to a bounded buffer that a
+    background task writes LOG_SINK_BATCH_ROWS per transaction. Under
+    backpressure it degrades instead of blocking: above LOG_SINK_HIGH_WATER
+    cache and local hits are only counted, and at LOG_SINK_CAPACITY every
+    entry is. Counted entries land in orchestrator_log_rollup (requests,
+    cost, latency and errors per minute and tier), so totals stay right
+    even when rows are shed. Entries with an error or a fallback keep
+    their response text whatever the sample rate."""
+
+    def __init__(self, capacity: int = LOG_SINK_CAPACITY):
+        self.capacity = capacity
+        self._rows: Deque[Tuple[Any, ...]] = deque()
+        self._rollup: Dict[Tuple[int, str], List[float]] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.queued = 0
+        self.written = 0
+        self.aggregated = 0
+        self.clipped = 0
+        self.unsampled = 0
+        self.failed = 0
+        self.flushes = 0
+        self.peak = 0
+
+    def put(self, entry: Dict[str, Any]):
+        """Queue one orchestrator log entry; returns immediately."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        fill = len(self._rows)
+        routine = entry["error"] is None and entry["fallback"] is None and tier(entry) in ("cache", "local")
+        if fill >= self.capacity or (routine and fill >= self.capacity * LOG_SINK_HIGH_WATER):
+            self._count(entry)
+        else:
+            self._rows.append(self._row(entry))
+            self.queued += 1
+            self.peak = max(self.peak, len(self._rows))
+            if len(self._rows) >= LOG_SINK_BATCH_ROWS:
+                self._wakeup.set()
+        if LOG_SINK_VERBOSE:
+            print(f"Orchestrator log: {tier(entry)} {entry['latency']:.3f}s cost={entry['cost']} "
+                  f"error={entry['error']} message={entry['user_message'][:60]!r}")
+
+    def _row(self, entry: Dict[str, Any]) -> Tuple[Any, ...]:
+        values = dict(entry)
+        for key in ("user_message", "response"):
+            clipped = _clip(values[key])
+            if clipped is not values[key]:
+                self.clipped += 1
+                values[key] = clipped
+        keep = values["error"] is not None or values["fallback"] is not None or random.random() < LOG_SINK_RESPONSE_SAMPLE
+        if not keep and values["response"] is not None:
+            values["response"] = None
+            self.unsampled += 1
+        return tuple(values[c] for c in LOG_COLUMNS) + (int(time.time()),)
+
+    def _count(self, entry: Dict[str, Any]):
+        key = (entry["timestamp"] // 60 * 60, tier(entry))
+        totals = self._rollup.setdefault(key, [0, 0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += entry["cost"]
+        totals[2] += entry["latency"]
+        totals[3] += entry["error"] is not None
+        self.aggregated += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), LOG_SINK_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write the buffered rows and rollup counts, LOG_SINK_BATCH_ROWS per transaction."""
+        async with self._flush_lock:
+            while self._rows or self._rollup:
+                batch = [self._rows.popleft() for _ in range(min(LOG_SINK_BATCH_ROWS, len(self._rows)))]
+                rollup, self._rollup = self._rollup, {}
+                try:
+                    async with db.writer() as conn:
+                        if batch:
+                            await conn.executemany(INSERT_LOG, batch)
+                        if rollup:
+                            await conn.executemany(UPSERT_ROLLUP, [(minute, name, *totals)
+                                                                   for (minute, name), totals in rollup.items()])
+                except Exception as e:
+                    # Logs are expendable; never let a bad write stall the sink
+                    print(f"Orchestrator log flush of {len(batch)} rows failed: {e}")
+                    self.failed += len(batch)
+                    return
+                self.flushes += 1
+                self.written += len(batch)
+
+    async def close(self):
+        """Flush what is buffered and stop the background writer (call on shutdown)."""
+        async with self._flush_lock:
+            if self._task is not None:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._rows),
+            "capacity": self.capacity,
+            "peak": self.peak,
+            "queued": self.queued,
+            "written": self.written,
+            "aggregated": self.aggregated,
+            "clipped": self.clipped,
+            "response_unsampled": self.unsampled,
+            "failed": self.failed,
+            "flushes": self.flushes,
+        }
+
+# Global instance
+log_sink = LogSink()
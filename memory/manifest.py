@@ -7,6 +7,7 @@ import subprocess
 from typing import Dict, Any, Optional
 
 from memory import db, budget
+from memory.query_cache import query_cache
 
 MANIFEST_FILE = "/home/ubuntu/manifest.json"
 
@@ -17,7 +18,8 @@ async def update_manifest():
         "date": datetime.now().isoformat(),
         "current_credits": await db.token_balance(),
         "daily_credit_limit": budget.DAILY_CAP,
-        "cache_hit_rate": await get_cache_hit_rate(), # Placeholder
+        "cache_hit_rate": await get_cache_hit_rate(),
+        "query_cache_hit_rate": query_cache.hit_rate(),
         "backend_health": await get_backend_health(), # Placeholder
         "commit_hash": get_current_commit_hash(),
         "last_orchestrator_log": await get_last_orchestrator_log_summary()
@@ -28,10 +30,18 @@ async def update_manifest():
     print(f"Manifest updated: {MANIFEST_FILE}")
     return manifest_data
 
+CACHE_HIT_RATE_WINDOW = 24 * 3600  # seconds of orchestrator_logs the hit rate covers
+
 async def get_cache_hit_rate() -> float:
-    """Placeholder for calculating cache hit rate."""
-    # In a real implementation, this would query cache statistics
-    return 0.0 # Assuming 0% for now
+    """Share of orchestrated requests answered from the response cache over the last day.
+
+    Read from orchestrator_logs, so it covers every worker and survives restarts."""
+    async with db.reader() as conn:
+        cursor = await conn.execute(
+            "SELECT AVG(cache_hit) FROM orchestrator_logs WHERE timestamp >= ?",
+            (int(time.time()) - CACHE_HIT_RATE_WINDOW,))
+        rate = (await cursor.fetchone())[0]
+    return rate or 0.0
 
 async def get_backend_health() -> str:
     """Placeholder for checking backend health."""
@@ -54,15 +64,15 @@ def get_current_commit_hash() -> str:
 async def get_last_orchestrator_log_summary() -> Optional[Dict[str, Any]]:
     """Retrieves a summary of the last orchestrator log entry."""
     try:
-        pool = await db.get_db_pool()
-        cursor = await pool.execute("""
-            SELECT timestamp, user_message, deepseek_used, cost, latency, response, error
-            FROM orchestrator_logs
-            ORDER BY timestamp DESC
-            LIMIT 1
-        """
-        )
-        last_log = await cursor.fetchone()
+        async with db.reader() as conn:
+            cursor = await conn.execute("""
+                SELECT timestamp, user_message, deepseek_used, cost, latency, response, error
+                FROM orchestrator_logs
+                ORDER BY timestamp DESC
+                LIMIT 1
+            """
+            )
+            last_log = await cursor.fetchone()
         if last_log:
             return dict(last_log)
         return None
@@ -1,18 +1,40 @@
 import asyncio
+import os
 import time
-from typing import Dict, Any, Optional
+from typing import AsyncIterator, Dict, Any, Optional
 
-from memory.deepseek_utils import deepseek_chat_completion
-from memory import db, budget
+from memory.deepseek_utils import deepseek_chat_completion, deepseek_chat_stream
+from memory import budget
+from memory.ledger import ledger
+from memory.log_sink import log_sink
+from memory.response_cache import message_key, response_cache, semantic_cache
+from memory.single_flight import single_flight
+from memory.local_responder import local_responder
+from memory.router import model_router
+from memory.circuit_breaker import OPEN, deepseek_breaker
 
-async def orchestrate_request(user_message: str) -> Dict[str, Any]:
-    log_entry = {
+ORCHESTRATOR_LOG_DURABLE = False # True: /chat waits until its log row is committed
+ORCHESTRATOR_DEADLINE = float(os.getenv("ORCHESTRATOR_DEADLINE", "120")) # seconds a request may take unless its caller says otherwise
+FALLBACK_SIMILARITY = 0.8 # with DeepSeek unavailable, cached answers to prompts this similar are served
+FALLBACK_LOCAL_CONFIDENCE = 0.5 # ... and local answers this confident
+UNAVAILABLE_REPLY = "I'm having trouble connecting to my external brain. Please try again later."
+
+def new_log_entry(user_message: str) -> Dict[str, Any]:
+    return {
         "timestamp": int(time.time()),
         "user_message": user_message,
         "cache_hit": False,
+        "cache_similarity": None, # best semantic-cache match; 1.0 on an exact hit
         "local_model_used": False,
+        "local_source": None, # local handler with the best candidate, used or not
+        "local_confidence": None,
         "deepseek_used": False,
         "manus_used": False,
+        "model": None, # chosen by memory/router.py when DeepSeek is called
+        "route": None,
+        "fallback": None, # why DeepSeek was skipped or failed: breaker_open, deadline, upstream_error
+        "flight_id": None, # shared by requests coalesced onto one DeepSeek call
+        "coalesced": False, # True if this request joined another's call instead of making one
         "cost": 0,
         "latency": 0,
         "quality_score": None, # Placeholder for future quality assessment
@@ -20,43 +42,143 @@ async def orchestrate_request(user_message: str) -> Dict[str, Any]:
         "error": None
     }
 
+async def check_caches(user_message: str, log_entry: Dict[str, Any]) -> bool:
+    """Fill log_entry from the exact or semantic cache; True on a hit."""
+    # A repeated question costs no DeepSeek call and no budget
+    cached = await response_cache.get(user_message)
+    if cached is not None:
+        log_entry["cache_hit"] = True
+        log_entry["cache_similarity"] = 1.0
+        log_entry["response"] = cached
+        return True
+
+    # Reuse the answer to a close paraphrase
+    cached, log_entry["cache_similarity"] = await semantic_cache.lookup(user_message)
+    if cached is not None:
+        log_entry["cache_hit"] = True
+        log_entry["response"] = cached
+        return True
+    return False
+
+async def check_local(user_message: str, log_entry: Dict[str, Any]) -> bool:
+    """Fill log_entry from the local responder; True if it was confident enough."""
+    reply, log_entry["local_confidence"], log_entry["local_source"] = await local_responder.respond(user_message)
+    if reply is None:
+        return False
+    log_entry["local_model_used"] = True
+    log_entry["response"] = reply
+    return True
+
+async def degraded_answer(user_message: str, log_entry: Dict[str, Any], reason: str) -> bool:
+    """With DeepSeek unavailable, fill log_entry from a looser cache match or a
+    less confident local answer; True if either had one. The reply is
+    still logged with the reason DeepSeek was skipped."""
+    log_entry["fallback"] = reason
+    cached, similarity = await semantic_cache.lookup(user_message, threshold=FALLBACK_SIMILARITY)
+    if cached is not None:
+        log_entry["cache_hit"] = True
+        log_entry["cache_similarity"] = similarity
+        log_entry["response"] = cached
+        return True
+    reply, confidence, source = await local_responder.respond(user_message, threshold=FALLBACK_LOCAL_CONFIDENCE)
+    if reply is not None:
+        log_entry["local_model_used"] = True
+        log_entry["local_source"], log_entry["local_confidence"] = source, confidence
+        log_entry["response"] = reply
+        return True
+    return False
+
+def unavailable_reason(deadline: float) -> str:
+    if time.monotonic() >= deadline:
+        return "deadline"
+    if deepseek_breaker.state == OPEN:
+        return "breaker_open"
+    return "upstream_error"
+
+async def log_request(log_entry: Dict[str, Any]):
+    # Handed to the batched log sink; the request doesn't wait for the write
+    log_sink.put(log_entry)
+    if ORCHESTRATOR_LOG_DURABLE:
+        await log_sink.flush()
+
+def usage_tokens(deepseek_response: Dict[str, Any]) -> Optional[int]:
+    usage = deepseek_response.get("usage") or {}
+    return usage.get("total_tokens")
+
+async def ask_deepseek(user_message: str, route: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+    """One upstream call, its budget charge and cache fill; shared by coalesced requests.
+    The response is None if the call failed."""
+    outcome = {"deepseek_used": True, "cost": 0, "response": None, "error": None}
+    messages = [
+        {"role": "user", "content": user_message}
+    ]
+    deepseek_response = await deepseek_chat_completion(messages, model=route["model"], max_tokens=route["max_tokens"],
+                                                       deadline=deadline)
+
+    if deepseek_response and deepseek_response["choices"][0]["message"]["content"]:
+        response_content = deepseek_response["choices"][0]["message"]["content"]
+        outcome["response"] = response_content
+        # Charge the tokens the API reports, or the route's running estimate if it reports none
+        cost = usage_tokens(deepseek_response) or route["estimated_cost"]
+        if await budget.spend_with_plan("DeepSeek_API_Call", cost):
+            outcome["cost"] = cost
+            await response_cache.put(user_message, response_content)
+            await semantic_cache.put(user_message, response_content)
+        else:
+            outcome["error"] = "DeepSeek API call blocked due to budget."
+            outcome["response"] = "I'm sorry, I've run out of budget for external API calls today."
+    else:
+        outcome["error"] = "DeepSeek API call failed or returned no content."
+    return outcome
+
+async def orchestrate_request(user_message: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Answer a message from the cheapest tier that can. deadline is the
+    time.monotonic() instant the reply is due (default ORCHESTRATOR_DEADLINE
+    from now); past it, or while DeepSeek's circuit is open, the request
+    falls back to a looser cached or local answer."""
+    log_entry = new_log_entry(user_message)
+    if deadline is None:
+        deadline = time.monotonic() + ORCHESTRATOR_DEADLINE
+
     start_time = time.time()
 
     try:
-        # 1. Check Cache (Placeholder)
-        # For now, we'll simulate a cache miss
-        # if cache.get(user_message):
-        #     log_entry["cache_hit"] = True
-        #     log_entry["response"] = cache.get(user_message)
-        #     return log_entry
-
-        # 2. Check Local/Docker Model (Placeholder)
-        # if local_model.predict(user_message):
-        #     log_entry["local_model_used"] = True
-        #     log_entry["response"] = local_model.predict(user_message)
-        #     return log_entry
-
-        # 3. Use DeepSeek API (Default)
-        messages = [
-            {"role": "user", "content": user_message}
-        ]
-        deepseek_response = await deepseek_chat_completion(messages, model="deepseek-reasoner")
-        log_entry["deepseek_used"] = True
-
-        if deepseek_response and deepseek_response["choices"][0]["message"]["content"]:
-            response_content = deepseek_response["choices"][0]["message"]["content"]
-            log_entry["response"] = response_content
-            # Placeholder for actual token counting and cost deduction
-            # For now, assume a fixed cost for DeepSeek
-            deepseek_cost = 500 # Example cost
-            if await budget.spend_with_plan("DeepSeek_API_Call", deepseek_cost):
-                log_entry["cost"] = deepseek_cost
+        # 1. Check Cache (exact, then semantic)
+        if await check_caches(user_message, log_entry):
+            return log_entry
+
+        # 2. Local fast path: rules, stored answers and known facts; escalates when unsure
+        if await check_local(user_message, log_entry):
+            return log_entry
+
+        # 3. Use DeepSeek API with the routed model; identical prompts in flight share one call.
+        # While the circuit is open, fail fast instead of queueing behind timeouts
+        if deepseek_breaker.state != OPEN:
+            route = await model_router.choose(user_message)
+            log_entry["model"], log_entry["route"] = route["model"], route["route"]
+            # The shared call may outlive this caller's deadline: requests that join it
+            # can wait longer, so it runs to ORCHESTRATOR_DEADLINE at least, and each
+            # caller stops waiting at its own deadline
+            shared_deadline = max(deadline, time.monotonic() + ORCHESTRATOR_DEADLINE)
+            try:
+                outcome, log_entry["flight_id"], log_entry["coalesced"] = await asyncio.wait_for(
+                    single_flight.do((message_key(user_message), route["model"]),
+                                     lambda: ask_deepseek(user_message, route, shared_deadline)),
+                    deadline - time.monotonic())
+                log_entry.update(outcome)
+            except asyncio.TimeoutError:
+                # The call (ours, or the one this request joined) is still running
+                log_entry["deepseek_used"] = True
+                log_entry["error"] = "DeepSeek API call exceeded the request deadline."
+            if log_entry["coalesced"]:
+                log_entry["cost"] = 0 # charged once, to the request that made the call
+
+        if log_entry["response"] is None:
+            if await degraded_answer(user_message, log_entry, unavailable_reason(deadline)):
+                log_entry["error"] = None
             else:
-                log_entry["error"] = "DeepSeek API call blocked due to budget."
-                log_entry["response"] = "I'm sorry, I've run out of budget for external API calls today."
-        else:
-            log_entry["error"] = "DeepSeek API call failed or returned no content."
-            log_entry["response"] = "I'm having trouble connecting to my external brain. Please try again later."
+                log_entry["error"] = log_entry["error"] or "DeepSeek is unavailable (circuit open)."
+                log_entry["response"] = UNAVAILABLE_REPLY
 
         # 4. Fallback to Manus (Placeholder - if DeepSeek fails or quality is low)
         # This logic would be more complex, involving quality assessment of DeepSeek's response
@@ -75,30 +197,115 @@ async def orchestrate_request(user_message: str) -> Dict[str, Any]:
 
     finally:
         log_entry["latency"] = time.time() - start_time
-        # Log the full entry (e.g., to logs/orchestrator.csv or a database)
-        pool = await db.get_db_pool()
-        await pool.execute(
-            """INSERT INTO orchestrator_logs (
-                timestamp, user_message, cache_hit, local_model_used, 
-                deepseek_used, manus_used, cost, latency, quality_score, 
-                response, error, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                log_entry["timestamp"],
-                log_entry["user_message"],
-                log_entry["cache_hit"],
-                log_entry["local_model_used"],
-                log_entry["deepseek_used"],
-                log_entry["manus_used"],
-                log_entry["cost"],
-                log_entry["latency"],
-                log_entry["quality_score"],
-                log_entry["response"],
-                log_entry["error"],
-                int(time.time())
-            )
-        )
-        print(f"Orchestrator Logged to DB: {log_entry}")
+        await log_request(log_entry)
         return log_entry
 
+async def first_chunk_by(stream: AsyncIterator[Dict[str, Any]], deadline: float) -> AsyncIterator[Dict[str, Any]]:
+    """Pass stream through; asyncio.TimeoutError if nothing arrives by deadline (time.monotonic())."""
+    try:
+        try:
+            first = await asyncio.wait_for(stream.__anext__(), deadline - time.monotonic())
+        except StopAsyncIteration:
+            return
+        yield first
+        async for item in stream:
+            yield item
+    finally:
+        await stream.aclose()
+
+async def orchestrate_stream(user_message: str, deadline: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Streaming orchestrate_request for /chat/stream.
+
+    Yields {"delta": text} as reply text arrives ({"reasoning": text} for
+    the reasoner's thinking), then {"done": log_entry} once the reply is
+    complete and logged. A cache hit or local answer is sent as a single delta.
+    If DeepSeek sends nothing by the deadline (default ORCHESTRATOR_DEADLINE
+    from now) or fails before any text, the request falls back like
+    orchestrate_request; once text is streaming it runs to the end. The budget
+    is charged before the upstream call: text already streamed to the
+    client can't be withdrawn if the charge is refused afterwards. Once the
+    stream ends the charge is settled against the usage it reported, and
+    refunded if no text arrived."""
+    log_entry = new_log_entry(user_message)
+    if deadline is None:
+        deadline = time.monotonic() + ORCHESTRATOR_DEADLINE
+    start_time = time.time()
+    charged = 0
+    usage = None
+    parts = []
+
+    try:
+        if await check_caches(user_message, log_entry) or await check_local(user_message, log_entry):
+            yield {"delta": log_entry["response"]}
+        elif deepseek_breaker.state == OPEN:
+            if await degraded_answer(user_message, log_entry, "breaker_open"):
+                yield {"delta": log_entry["response"]}
+            else:
+                log_entry["error"] = "DeepSeek is unavailable (circuit open)."
+                log_entry["response"] = UNAVAILABLE_REPLY
+        else:
+            route = await model_router.choose(user_message)
+            log_entry["model"], log_entry["route"] = route["model"], route["route"]
+            # Usage isn't known until the end, so the route's running estimate is charged
+            if not await budget.spend_with_plan("DeepSeek_API_Call", route["estimated_cost"]):
+                log_entry["error"] = "DeepSeek API call blocked due to budget."
+                log_entry["response"] = "I'm sorry, I've run out of budget for external API calls today."
+            else:
+                log_entry["cost"] = charged = route["estimated_cost"]
+                log_entry["deepseek_used"] = True
+                messages = [
+                    {"role": "user", "content": user_message}
+                ]
+                try:
+                    async for delta in first_chunk_by(deepseek_chat_stream(messages, model=route["model"],
+                                                                           max_tokens=route["max_tokens"]), deadline):
+                        if delta.get("usage"):
+                            usage = delta["usage"]
+                        if delta.get("reasoning_content"):
+                            yield {"reasoning": delta["reasoning_content"]}
+                        if delta.get("content"):
+                            parts.append(delta["content"])
+                            yield {"delta": delta["content"]}
+                except asyncio.TimeoutError:
+                    log_entry["error"] = "DeepSeek API call exceeded the request deadline."
+                except RuntimeError as e:
+                    if parts:
+                        raise # part of the reply is already with the client
+                    log_entry["error"] = str(e)
+                if parts:
+                    log_entry["response"] = "".join(parts)
+                    await response_cache.put(user_message, log_entry["response"])
+                    await semantic_cache.put(user_message, log_entry["response"])
+                elif await degraded_answer(user_message, log_entry, unavailable_reason(deadline)):
+                    log_entry["error"] = None
+                    yield {"delta": log_entry["response"]}
+                else:
+                    log_entry["error"] = log_entry["error"] or "DeepSeek API call failed or returned no content."
+                    log_entry["response"] = UNAVAILABLE_REPLY
+
+    except Exception as e:
+        log_entry["error"] = str(e)
+        log_entry["response"] = "An unexpected error occurred during orchestration."
+
+    finally:
+        # Also runs when the client disconnects mid-stream
+        if charged:
+            await settle_stream_charge(log_entry, charged, usage, streamed=bool(parts))
+        log_entry["latency"] = time.time() - start_time
+        await log_request(log_entry)
+
+    yield {"done": log_entry}
 
+async def settle_stream_charge(log_entry: Dict[str, Any], charged: int, usage: Optional[Dict[str, Any]],
+                               streamed: bool):
+    """Correct a stream's up-front charge: nothing if no text was
+    streamed, else the tokens the last chunk reported (the estimate
+    stands if the stream ended without reporting them, e.g. the client left)."""
+    if not streamed:
+        cost = 0
+    else:
+        cost = (usage or {}).get("total_tokens") or charged
+    if cost != charged:
+        # A negative spend is a refund
+        await ledger.spend("DeepSeek_API_Call", cost - charged)
+    log_entry["cost"] = cost
@@ -0,0 +1,44 @@
+import base64
+import json
+from typing import Any, AsyncIterator, Dict, Sequence, Tuple, Union
+
+from memory import db
+
+# Configuration
+STREAM_BATCH_ROWS = 500  # rows pulled from aiosqlite per round-trip when streaming
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Opaque keyset cursor: the sort key of the last row a client has seen."""
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode()
+
+def decode_cursor(cursor: str, required: Dict[str, Union[type, Tuple[type, ...]]]) -> Dict[str, Any]:
+    """The position encode_cursor() produced. Raises ValueError if it isn't
+    one, or lacks any key in `required` or holds a value of the wrong type
+    (e.g. a cursor from another endpoint)."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(position, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    for key, types in required.items():
+        value = position.get(key)
+        if isinstance(value, bool) or not isinstance(value, types):
+            raise ValueError(f"Invalid cursor: {cursor} (needs {key})")
+    return position
+
+async def iter_rows(sql: str, params: Sequence[Any] = (), batch_rows: int = STREAM_BATCH_ROWS) -> AsyncIterator[Any]:
+    """Yield rows as aiosqlite reads them, holding at most one batch in memory.
+
+    A reader connection stays checked out until the iteration finishes."""
+    async with db.reader() as conn:
+        cursor = await conn.execute(sql, params)
+        try:
+            while True:
+                rows = await cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            await cursor.close()
@@ -0,0 +1,382 @@
+import asyncio
+import os
+import sys
+import numpy as np
+from typing import List, Optional, Tuple
+
+from memory import db
+from memory.embeddings import embedder
+from memory.signature_index import _popcount
+
+# Configuration
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "none")  # "none", "int8" or "binary"
+RERANK_FACTOR = 10  # coarse candidates per requested result, re-ranked at full precision
+LOAD_BATCH_ROWS = 10_000
+SCORE_CHUNK_ROWS = 16384
+INITIAL_CAPACITY = 1024
+QUANT_MIN_FIT_ROWS = 256  # below this many rows the index keeps float32 rows and searches them exactly
+QUANT_FIT_SAMPLE = 4096  # embeddings the quantizer is fitted on (reservoir of appended rows / random rows at load)
+QUANT_REFIT_GROWTH = 2.0  # refit and re-encode once the index holds this many times the rows it was fitted at
+
+class QuantizedIndex:
+    """Compressed in-memory codes for conv_turn embeddings with two-stage search.
+
+    "int8" stores one byte per dimension (per-dimension min/max scaling,
+    4x smaller than float32); "binary" stores one bit per dimension
+    (sign around the per-dimension mean, packed into 64-bit words, 32x
+    smaller). Queries are scored coarsely against the codes, then the
+    top top_k * RERANK_FACTOR candidates are re-ranked exactly using the
+    float32 BLOBs read back from SQLite, so full-precision vectors never
+    have to live in RAM.
+
+    The quantizer is fitted on a sample of QUANT_FIT_SAMPLE embeddings,
+    never on fewer than QUANT_MIN_FIT_ROWS: until then rows stay float32
+    and are searched exactly. When the index grows QUANT_REFIT_GROWTH-fold
+    past the size it was fitted at, a background rebuild refits on fresh
+    rows and re-encodes everything, so codes don't saturate as the
+    embedding distribution drifts."""
+
+    def __init__(self, mode: str = "int8", dim: int = embedder.dim):
+        if mode not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self.mode = mode
+        self.dim = dim
+        self.words = (dim + 63) // 64  # binary codes are padded to whole uint64 words
+        self.loaded = False
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._rng = np.random.default_rng()
+        self._refit_task: Optional[asyncio.Task] = None
+        self._refit_target: Optional["QuantizedIndex"] = None
+        self.refits = 0
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+        width = self.dim if self.mode == "int8" else self.words * 8
+        self.codes = np.empty((INITIAL_CAPACITY, width), dtype=np.int8 if self.mode == "int8" else np.uint8)
+        self.ids = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.kinds = np.empty(INITIAL_CAPACITY, dtype=np.int32)
+        self.kind_codes = {None: 0}
+        self.raw = np.empty((0, self.dim), dtype=np.float32)  # rows held before the quantizer is fitted
+        self.sample = np.empty((QUANT_FIT_SAMPLE, self.dim), dtype=np.float32)  # reservoir of appended rows
+        self.seen = 0
+        self.offset = None  # int8: per-dimension minimum; binary: per-dimension mean
+        self.scale = None  # int8 only: per-dimension step
+        self.fitted_rows = 0
+        self.generation = getattr(self, "generation", 0) + 1
+
+    def bytes_per_row(self) -> int:
+        return self.codes.shape[1]
+
+    def fit(self, vectors: np.ndarray):
+        """Choose quantizer parameters from a sample of embeddings."""
+        if self.mode == "int8":
+            lo, hi = vectors.min(axis=0), vectors.max(axis=0)
+            self.offset = lo.astype(np.float32)
+            self.scale = np.maximum((hi - lo) / 255.0, 1e-12).astype(np.float32)
+        else:
+            self.offset = vectors.mean(axis=0).astype(np.float32)
+
+    def quantize(self, vectors: np.ndarray) -> np.ndarray:
+        if self.mode == "int8":
+            steps = np.rint((vectors - self.offset) / self.scale)
+            return (np.clip(steps, 0, 255) - 128).astype(np.int8)
+        bits = np.packbits(vectors > self.offset, axis=1)
+        padded = np.zeros((len(vectors), self.words * 8), dtype=np.uint8)
+        padded[:, :bits.shape[1]] = bits
+        return padded
+
+    def _observe(self, vectors: np.ndarray):
+        """Reservoir-sample appended rows, so a refit sees old and new embeddings alike."""
+        positions = self.seen + np.arange(len(vectors))
+        self.seen += len(vectors)
+        slots = np.where(positions < QUANT_FIT_SAMPLE, positions,
+                         (self._rng.random(len(vectors)) * (positions + 1)).astype(np.int64))
+        keep = slots < QUANT_FIT_SAMPLE
+        self.sample[slots[keep]] = vectors[keep]
+
+    def _sampled(self) -> np.ndarray:
+        return self.sample[:min(self.seen, QUANT_FIT_SAMPLE)]
+
+    def refit_due(self) -> bool:
+        return self.offset is not None and self.size >= self.fitted_rows * QUANT_REFIT_GROWTH
+
+    def _append(self, ids, kinds, vectors: np.ndarray):
+        self._observe(vectors)
+        if self.offset is None and self.size + len(ids) >= QUANT_MIN_FIT_ROWS:
+            # Enough rows for a real fit: encode the float rows held so far
+            self.fit(self._sampled())
+            self.fitted_rows = self.size + len(ids)
+            self.codes[:self.size] = self.quantize(self.raw[:self.size])
+            self.raw = np.empty((0, self.dim), dtype=np.float32)
+        n = len(ids)
+        needed = self.size + n
+        if needed > len(self.ids):
+            capacity = len(self.ids)
+            while capacity < needed:
+                capacity *= 2
+            self.ids = np.resize(self.ids, capacity)
+            self.kinds = np.resize(self.kinds, capacity)
+            grown = np.empty((capacity, self.codes.shape[1]), dtype=self.codes.dtype)
+            grown[:self.size] = self.codes[:self.size]
+            self.codes = grown
+        for kind in kinds:
+            if kind not in self.kind_codes:
+                self.kind_codes[kind] = len(self.kind_codes)
+        self.ids[self.size:needed] = ids
+        self.kinds[self.size:needed] = [self.kind_codes[k] for k in kinds]
+        if self.offset is None:
+            self.raw = np.concatenate([self.raw[:self.size], vectors])
+        else:
+            self.codes[self.size:needed] = self.quantize(vectors)
+        self.size = needed
+        if self.loaded and self.refit_due() and self._refit_task is None:
+            try:
+                self._refit_task = asyncio.get_running_loop().create_task(self._refit())
+            except RuntimeError:
+                pass  # no event loop (offline report): nothing to refit from
+
+    async def _refit(self):
+        """Rebuild from SQLite with a freshly fitted quantizer, then swap it in.
+
+        Searches keep using the current codes meanwhile; turns added during
+        the rebuild are forwarded to it."""
+        generation = self.generation
+        fresh = QuantizedIndex(self.mode, self.dim)
+        self._refit_target = fresh
+        try:
+            await fresh.load()
+            if generation != self.generation:
+                return  # a reload (e.g. after retention) replaced the index meanwhile
+            for name in ("size", "codes", "ids", "kinds", "kind_codes", "raw", "sample", "seen",
+                         "offset", "scale", "fitted_rows"):
+                setattr(self, name, getattr(fresh, name))
+            self.refits += 1
+        except Exception as e:
+            print(f"Quantized index refit failed: {e}")
+        finally:
+            self._refit_target = None
+            self._refit_task = None
+
+    async def load(self):
+        """Stream embedded conv_turn rows from SQLite, keeping only their codes."""
+        async with self._lock:
+            await self._load()
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self._load()
+
+    async def _fit_sample(self) -> np.ndarray:
+        """Embeddings of up to QUANT_FIT_SAMPLE random turns, looked up by id."""
+        async with db.reader() as conn:
+            cursor = await conn.execute("SELECT MIN(id), MAX(id) FROM conv_turn")
+            lo, hi = await cursor.fetchone()
+            if lo is None:
+                return np.empty((0, self.dim), dtype=np.float32)
+            ids = np.unique(self._rng.integers(lo, hi + 1, QUANT_FIT_SAMPLE)).tolist()
+            cursor = await conn.execute(
+                f"SELECT embedding FROM conv_turn WHERE embedding IS NOT NULL AND id IN ({','.join('?' * len(ids))})",
+                ids)
+            vectors = [db.unpack_embedding(r["embedding"]) for r in await cursor.fetchall()]
+        return np.asarray([v for v in vectors if v is not None and len(v) == self.dim],
+                          dtype=np.float32).reshape(-1, self.dim)
+
+    async def _load(self):
+        self._reset()
+        sample = await self._fit_sample()
+        if len(sample) >= QUANT_MIN_FIT_ROWS:
+            self.fit(sample)
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT id, kind, embedding FROM conv_turn WHERE embedding IS NOT NULL ORDER BY id")
+            newest = 0
+            while True:
+                rows = await cursor.fetchmany(LOAD_BATCH_ROWS)
+                if not rows:
+                    break
+                ids, kinds, vectors = [], [], []
+                for row in rows:
+                    vector = db.unpack_embedding(row["embedding"])
+                    if vector is None or len(vector) != self.dim:
+                        continue
+                    ids.append(row["id"])
+                    kinds.append(row["kind"])
+                    vectors.append(vector)
+                if ids:
+                    self._append(ids, kinds, np.asarray(vectors, dtype=np.float32))
+                newest = rows[-1]["id"]
+
+        # Turns added while the rows were streaming are not in the cursor
+        pending = [p for p in self._pending if p[0] > newest]
+        if pending:
+            self._append([p[0] for p in pending], [p[1] for p in pending],
+                         np.asarray([p[2] for p in pending], dtype=np.float32))
+        self._pending = []
+        self.fitted_rows = self.size
+        self.loaded = True
+        print(f"Quantized index loaded ({self.mode}): {self.size} embeddings, "
+              f"{self.bytes_per_row()} bytes/row vs {self.dim * 4} for float32")
+
+    def last_id(self) -> int:
+        return int(self.ids[self.size - 1]) if self.size else 0
+
+    def add(self, turn_id: int, embedding: List[float], kind: Optional[str] = None):
+        """Append a single embedding; called by db.add_turn after each insert."""
+        if embedding is None or len(embedding) != self.dim:
+            return
+        if not self.loaded:
+            self._pending.append((turn_id, kind, embedding))
+            return
+        if self._refit_target is not None:
+            self._refit_target.add(turn_id, embedding, kind)
+        self._append([turn_id], [kind], np.asarray([embedding], dtype=np.float32))
+
+    def coarse_search(self, query: List[float], n: int, kind: Optional[str] = None,
+                      metric: str = "l1") -> List[int]:
+        """Turn ids of the n best rows by their quantized codes."""
+        if self.size == 0 or n <= 0:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        scores = np.empty(self.size, dtype=np.float32)
+        if self.offset is None:
+            scores[:] = exact_scores(q, self.raw[:self.size], metric)
+        elif self.mode == "binary":
+            q_words = self.quantize(q[None])[0].view("<u8")
+            words = self.codes[:self.size].view("<u8")
+            scores[:] = _popcount(words[:, 0] ^ q_words[0])
+            for j in range(1, self.words):
+                scores += _popcount(words[:, j] ^ q_words[j])
+        else:
+            q_norm = np.linalg.norm(q) or 1.0
+            for start in range(0, self.size, SCORE_CHUNK_ROWS):
+                end = min(start + SCORE_CHUNK_ROWS, self.size)
+                chunk = (self.codes[start:end].astype(np.float32) + 128.0) * self.scale + self.offset
+                if metric == "cosine":
+                    norms = np.linalg.norm(chunk, axis=1)
+                    norms[norms == 0] = 1.0
+                    scores[start:end] = 1.0 - (chunk @ q) / (norms * q_norm)
+                else:
+                    scores[start:end] = np.abs(chunk - q).sum(axis=1)
+
+        candidates = self.size
+        if kind is not None:
+            code = self.kind_codes.get(kind)
+            if code is None:
+                return []
+            mask = self.kinds[:self.size] != code
+            scores[mask] = np.inf
+            candidates -= int(mask.sum())
+        n = min(n, candidates)
+        if n == 0:
+            return []
+        top = np.argpartition(scores, n - 1)[:n]
+        return [int(i) for i in self.ids[top]]
+
+    async def search(self, query: List[float], top_k: int = 3, kind: Optional[str] = None,
+                     metric: str = "l1") -> List[Tuple[int, float]]:
+        """Coarse search on codes, then exact re-rank from the stored float32 BLOBs."""
+        candidates = self.coarse_search(query, top_k * RERANK_FACTOR, kind, metric)
+        return (await rerank(query, candidates, metric))[:top_k]
+
+def exact_scores(query: List[float], vectors: np.ndarray, metric: str = "l1") -> np.ndarray:
+    q = np.asarray(query, dtype=np.float32)
+    if metric == "cosine":
+        denom = np.linalg.norm(vectors, axis=1) * np.linalg.norm(q)
+        denom[denom == 0] = 1.0
+        return np.maximum(1.0 - (vectors @ q) / denom, 0.0)
+    if metric == "l1":
+        return np.abs(vectors - q).sum(axis=1)
+    raise ValueError(f"Unknown metric: {metric}")
+
+async def rerank(query: List[float], turn_ids: List[int], metric: str = "l1") -> List[Tuple[int, float]]:
+    """Exact (turn_id, distance) for the given turns, read from SQLite, best first."""
+    if not turn_ids:
+        return []
+    placeholders = ",".join("?" * len(turn_ids))
+    async with db.reader() as conn:
+        cursor = await conn.execute(
+            f"SELECT id, embedding FROM conv_turn WHERE embedding IS NOT NULL AND id IN ({placeholders})",
+            turn_ids)
+        rows = [(r["id"], db.unpack_embedding(r["embedding"])) for r in await cursor.fetchall()]
+    rows = [(turn_id, vector) for turn_id, vector in rows if len(vector) == len(query)]
+    if not rows:
+        return []
+    scores = exact_scores(query, np.asarray([v for _, v in rows], dtype=np.float32), metric)
+    order = np.argsort(scores, kind="stable")
+    return [(rows[i][0], float(scores[i])) for i in order]
+
+def _incremental(mode: str, ids: np.ndarray, vectors: np.ndarray) -> "QuantizedIndex":
+    """An index fed one row at a time, rebuilt whenever a refit is due, as a
+    loaded index does through _refit()."""
+    index = QuantizedIndex(mode, dim=vectors.shape[1])
+    for i in range(len(ids)):
+        index._append(ids[i:i + 1], [None], vectors[i:i + 1])
+        if index.refit_due():
+            index = QuantizedIndex(mode, dim=vectors.shape[1])
+            index._append(ids[:i + 1], [None] * (i + 1), vectors[:i + 1])
+    return index
+
+def quantization_report(vectors: np.ndarray, k: int = 10, n_queries: int = 200,
+                        metric: str = "l1") -> List[dict]:
+    """Memory per row and recall@k of each quantization mode against exact search.
+
+    Each mode is measured twice: fitted on all rows at once, and fed one
+    row at a time (as turns arrive on a fresh database) with its refits,
+    so recall shouldn't depend on how the index was built. Re-ranking uses
+    the in-memory floats here instead of SQLite, which gives the same
+    ranking as the BLOB re-rank without touching a database."""
+    n = len(vectors)
+    ids = np.arange(1, n + 1)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(n, min(n_queries, n), replace=False)
+    noise = 0.1 * float(vectors.std())
+    queries = vectors[picks] + rng.normal(0, noise, (len(picks), vectors.shape[1])).astype(np.float32)
+    exact = [set(np.argsort(exact_scores(q, vectors, metric))[:k] + 1) for q in queries]
+
+    report = [{"mode": "float32", "bytes_per_row": vectors.shape[1] * 4,
+               "coarse_recall": 1.0, "reranked_recall": 1.0}]
+    for mode in ("int8", "binary"):
+        bulk = QuantizedIndex(mode, dim=vectors.shape[1])
+        bulk._append(ids, [None] * n, vectors)
+        for name, index in ((mode, bulk), (f"{mode}/1x1", _incremental(mode, ids, vectors))):
+            coarse_hits = reranked_hits = 0
+            for q, truth in zip(queries, exact):
+                coarse = index.coarse_search(q, k, metric=metric)
+                coarse_hits += len(truth & set(coarse))
+                candidates = np.asarray(index.coarse_search(q, k * RERANK_FACTOR, metric=metric))
+                scores = exact_scores(q, vectors[candidates - 1], metric)
+                reranked_hits += len(truth & set(candidates[np.argsort(scores)[:k]]))
+            total = k * len(queries)
+            report.append({"mode": name, "bytes_per_row": index.bytes_per_row(),
+                           "coarse_recall": coarse_hits / total, "reranked_recall": reranked_hits / total})
+    return report
+
+async def _print_quantization_report(synthetic_rows: int = 0):
+    if synthetic_rows:
+        vectors = np.asarray(embedder.encode([f"synthetic turn {i}" for i in range(synthetic_rows)]),
+                             dtype=np.float32)
+    else:
+        async with db.reader() as conn:
+            cursor = await conn.execute("SELECT embedding FROM conv_turn WHERE embedding IS NOT NULL")
+            vectors = [db.unpack_embedding(r["embedding"]) for r in await cursor.fetchall()]
+        vectors = np.asarray([v for v in vectors if len(v) == embedder.dim], dtype=np.float32)
+        await db.close_db_pool()
+    print(f"recall@10 over {len(vectors)} embeddings ({embedder.backend.name}), re-rank x{RERANK_FACTOR}")
+    print(f"{'mode':>11} {'bytes/row':>10} {'saved':>7} {'coarse':>8} {'reranked':>9}")
+    full = vectors.shape[1] * 4
+    for row in quantization_report(vectors):
+        saved = 1 - row["bytes_per_row"] / full
+        print(f"{row['mode']:>11} {row['bytes_per_row']:>10} {saved:>7.0%} "
+              f"{row['coarse_recall']:>8.3f} {row['reranked_recall']:>9.3f}")
+
+# Global instance (only used when EMBEDDING_QUANTIZATION is not "none")
+quantized_index = QuantizedIndex(EMBEDDING_QUANTIZATION if EMBEDDING_QUANTIZATION != "none" else "int8")
+
+if __name__ == "__main__":
+    # python -m memory.quantized_index [synthetic_rows]
+    asyncio.run(_print_quantization_report(int(sys.argv[1]) if len(sys.argv) > 1 else 0))
@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Configuration
+QUERY_CACHE_SIZE = 1024  # entries
+QUERY_CACHE_TTL = 300  # seconds
+
+class QueryCache:
+    """LRU + TTL cache for /query results with write-aware invalidation.
+
+    Entries remember the write generation of the kind they filter on.
+    Adding an embedded turn of kind K bumps K's generation and the
+    generation of unfiltered queries (kind None), so only entries whose
+    results could have changed become stale; they are dropped lazily on
+    their next lookup or by LRU eviction."""
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generations: Dict[Optional[str], int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, kind: Optional[str] = None) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at, generation = entry
+            if expires_at > time.monotonic() and generation == self._generations.get(kind, 0):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def generation(self, kind: Optional[str] = None) -> int:
+        """Read before computing a value, then pass to put()."""
+        return self._generations.get(kind, 0)
+
+    def put(self, key: Hashable, value: Any, kind: Optional[str] = None, generation: Optional[int] = None):
+        """Store value as of generation (default: now). A value computed
+        across an invalidation of its kind is stale already; it's dropped."""
+        current = self._generations.get(kind, 0)
+        if generation is None:
+            generation = current
+        elif generation != current:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl, generation)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, kind: Optional[str] = None):
+        """Called by db.add_turn when an embedded turn of this kind is inserted."""
+        self._generations[None] = self._generations.get(None, 0) + 1
+        if kind is not None:
+            self._generations[kind] = self._generations.get(kind, 0) + 1
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hit_rate(),
+        }
+
+# Global instance
+query_cache = QueryCache()
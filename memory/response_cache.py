@@ -0,0 +1,364 @@
+import asyncio
+import hashlib
+import os
+import re
+import sys
+import time
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from memory import db
+from memory.embeddings import EMBEDDING_BACKEND, embedder
+from memory.workers import MULTI_WORKER
+
+# Configuration
+RESPONSE_CACHE_SIZE = 4096  # answers kept in memory (LRU)
+RESPONSE_CACHE_TTL = 24 * 3600  # seconds an answer may be replayed
+RESPONSE_CACHE_MAX_ROWS = 100_000  # rows kept in SQLite; the oldest are pruned beyond this
+RESPONSE_CACHE_PRUNE_EVERY = 500  # puts between pruning passes
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # min cosine similarity to reuse an answer
+SEMANTIC_CACHE_SIZE = 2048  # prompts kept; the lowest-value entry is evicted beyond this
+SEMANTIC_CACHE_HIT_CREDIT = 3600  # seconds of recency each hit is worth when choosing what to evict
+SEMANTIC_CACHE_HIT_FLUSH_INTERVAL = 5.0  # seconds hit counts are held in memory before one batched UPDATE
+# MD5 vectors carry no similarity between different texts, so the layer only runs on a semantic backend
+SEMANTIC_CACHE_ENABLED = EMBEDDING_BACKEND != "md5"
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_message(message: str) -> str:
+    """Case, Unicode form, whitespace and trailing punctuation don't change the question."""
+    text = unicodedata.normalize("NFKC", message).casefold()
+    return _WHITESPACE.sub(" ", text).strip().rstrip("?!.").strip()
+
+def message_key(message: str) -> str:
+    return hashlib.sha256(normalize_message(message).encode()).hexdigest()
+
+class ResponseCache:
+    """Exact-match cache of orchestrator answers, keyed on the normalized message.
+
+    The in-memory LRU answers repeats without I/O. Every answer is also
+    written to the response_cache table, so it survives restarts and a
+    miss in one worker's LRU can still be served from SQLite (one primary
+    key lookup) before paying for a DeepSeek round trip. Entries expire
+    after RESPONSE_CACHE_TTL in both tiers."""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        """Warm the LRU with the newest unexpired answers."""
+        async with self._lock:
+            await self._load()
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self._load()
+
+    async def _load(self):
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT key, response, expires_at FROM response_cache WHERE expires_at > ? ORDER BY created_at DESC LIMIT ?",
+                (int(time.time()), self.max_size))
+            rows = await cursor.fetchall()
+        self._entries.clear()
+        for row in reversed(rows):  # oldest first, so the newest end up most recently used
+            self._entries[row["key"]] = (row["response"], row["expires_at"])
+        self.loaded = True
+        print(f"Response cache loaded: {len(self._entries)} answers")
+
+    def _remember(self, key: str, response: str, expires_at: float):
+        self._entries[key] = (response, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, message: str) -> Optional[str]:
+        await self.ensure_loaded()
+        key = message_key(message)
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            response, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            del self._entries[key]
+
+        # Written by another worker, or evicted from this LRU
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?", (key, int(now)))
+            row = await cursor.fetchone()
+        if row is not None:
+            self._remember(key, row["response"], row["expires_at"])
+            self.hits += 1
+            return row["response"]
+        self.misses += 1
+        return None
+
+    async def put(self, message: str, response: str):
+        await self.ensure_loaded()
+        key = message_key(message)
+        now = int(time.time())
+        expires_at = now + int(self.ttl)
+        self._remember(key, response, expires_at)
+        async with db.writer() as conn:
+            await conn.execute(
+                "INSERT OR REPLACE INTO response_cache(key,message,response,created_at,expires_at) VALUES (?,?,?,?,?)",
+                (key, normalize_message(message), response, now, expires_at))
+        self._puts += 1
+        if self._puts % RESPONSE_CACHE_PRUNE_EVERY == 0:
+            await self.prune()
+
+    async def prune(self):
+        """Drop expired rows and keep at most RESPONSE_CACHE_MAX_ROWS in SQLite."""
+        async with db.writer() as conn:
+            await conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (int(time.time()),))
+            await conn.execute("""
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )""", (RESPONSE_CACHE_MAX_ROWS,))
+
+    async def clear(self):
+        self._entries.clear()
+        async with db.writer() as conn:
+            await conn.execute("DELETE FROM response_cache")
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
+
+class SemanticCache:
+    """Answers to earlier prompts, reused for paraphrases above a cosine threshold.
+
+    Prompt embeddings live in a normalized float32 matrix, so a lookup is
+    one matrix-vector product. Entries expire after RESPONSE_CACHE_TTL;
+    past SEMANTIC_CACHE_SIZE the entry with the lowest
+    last_used + hits * SEMANTIC_CACHE_HIT_CREDIT is evicted, so both age
+    and usage count. Entries persist in semantic_cache; in multi-worker
+    mode each lookup first picks up rows other workers added. Hits are
+    counted in memory and written back in the background, one batch per
+    SEMANTIC_CACHE_HIT_FLUSH_INTERVAL, so a hit never waits on the writer."""
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_size: int = SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        self._reset()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_updates: Dict[int, Tuple[int, int]] = {}  # entry id -> (hits, last_used) not yet written
+        self._hits_flushed = time.time()
+        self._hit_flush: Optional[asyncio.Task] = None
+
+    def _reset(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, embedder.dim), dtype=np.float32)
+        self.expires_at = np.empty(0, dtype=np.float64)
+        self.last_used = np.empty(0, dtype=np.float64)
+        self.hit_counts = np.empty(0, dtype=np.int64)
+        self.responses: Dict[int, str] = {}
+        self.last_id = 0
+
+    @staticmethod
+    def _unit(vectors) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _append(self, rows):
+        rows = [r for r in rows if r["id"] not in self.responses and len(r["embedding"]) == embedder.dim * 4]
+        if not rows:
+            return
+        self.ids = np.concatenate([self.ids, [r["id"] for r in rows]])
+        self.vectors = np.concatenate([self.vectors, self._unit([db.unpack_embedding(r["embedding"]) for r in rows])])
+        self.expires_at = np.concatenate([self.expires_at, [r["expires_at"] for r in rows]])
+        self.last_used = np.concatenate([self.last_used, [r["last_used"] for r in rows]])
+        self.hit_counts = np.concatenate([self.hit_counts, [r["hits"] for r in rows]])
+        for r in rows:
+            self.responses[r["id"]] = r["response"]
+        self.last_id = max(self.last_id, rows[-1]["id"])
+
+    def _keep(self, mask: np.ndarray):
+        for entry_id in self.ids[~mask]:
+            del self.responses[int(entry_id)]
+        self.ids, self.vectors = self.ids[mask], self.vectors[mask]
+        self.expires_at, self.last_used = self.expires_at[mask], self.last_used[mask]
+        self.hit_counts = self.hit_counts[mask]
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self._load()
+
+    async def _load(self):
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT id, response, embedding, expires_at, last_used, hits FROM semantic_cache WHERE expires_at > ? ORDER BY id",
+                (int(time.time()),))
+            rows = await cursor.fetchall()
+        self._reset()
+        self._append(rows)
+        self.loaded = True
+        print(f"Semantic cache loaded: {len(self.ids)} prompts")
+
+    async def _catch_up(self):
+        """Pick up prompts answered by other workers."""
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT id, response, embedding, expires_at, last_used, hits FROM semantic_cache WHERE id > ? ORDER BY id",
+                (self.last_id,))
+            rows = await cursor.fetchall()
+        self._append(rows)
+
+    async def lookup(self, message: str, threshold: Optional[float] = None) -> Tuple[Optional[str], Optional[float]]:
+        """(response, similarity) of the closest unexpired prompt; response is None below the threshold."""
+        if not SEMANTIC_CACHE_ENABLED:
+            return None, None
+        await self.ensure_loaded()
+        if MULTI_WORKER:
+            await self._catch_up()
+        now = time.time()
+        live = self.expires_at > now
+        if not live.all():
+            self._keep(live)
+        if not len(self.ids):
+            self.misses += 1
+            return None, None
+
+        sims = self.vectors @ self._unit(embedder.embed(message))[0]
+        best = int(sims.argmax())
+        similarity = float(sims[best])
+        if similarity < (self.threshold if threshold is None else threshold):
+            self.misses += 1
+            return None, similarity
+
+        self.hits += 1
+        self.last_used[best] = now
+        self.hit_counts[best] += 1
+        entry_id = int(self.ids[best])
+        hits, _ = self._hit_updates.get(entry_id, (0, 0))
+        self._hit_updates[entry_id] = (hits + 1, int(now))
+        if now - self._hits_flushed >= SEMANTIC_CACHE_HIT_FLUSH_INTERVAL and (
+                self._hit_flush is None or self._hit_flush.done()):
+            self._hit_flush = asyncio.ensure_future(self.flush_hits())
+        return self.responses[entry_id], similarity
+
+    async def flush_hits(self):
+        """Write the hit counts gathered since the last flush (also call on shutdown)."""
+        updates, self._hit_updates = self._hit_updates, {}
+        self._hits_flushed = time.time()
+        if not updates:
+            return
+        try:
+            async with db.writer() as conn:
+                await conn.executemany(
+                    "UPDATE semantic_cache SET hits = hits + ?, last_used = MAX(last_used, ?) WHERE id = ?",
+                    [(hits, last_used, entry_id) for entry_id, (hits, last_used) in updates.items()])
+        except Exception as e:
+            print(f"Semantic cache hit flush of {len(updates)} entries failed: {e}")
+
+    async def put(self, message: str, response: str):
+        if not SEMANTIC_CACHE_ENABLED:
+            return
+        await self.ensure_loaded()
+        now = int(time.time())
+        embedding = embedder.embed(message)
+        async with db.writer() as conn:
+            cursor = await conn.execute(
+                "INSERT INTO semantic_cache(message,response,embedding,created_at,expires_at,last_used,hits) VALUES (?,?,?,?,?,?,0)",
+                (message, response, db.pack_embedding(embedding), now, now + RESPONSE_CACHE_TTL, now))
+            entry_id = cursor.lastrowid
+        self._append([{"id": entry_id, "response": response, "embedding": db.pack_embedding(embedding),
+                       "expires_at": now + RESPONSE_CACHE_TTL, "last_used": now, "hits": 0}])
+        await self._evict()
+
+    async def _evict(self):
+        excess = len(self.ids) - self.max_size
+        if excess <= 0:
+            return
+        value = self.last_used + self.hit_counts * SEMANTIC_CACHE_HIT_CREDIT
+        victims = np.argsort(value, kind="stable")[:excess]
+        mask = np.ones(len(self.ids), dtype=bool)
+        mask[victims] = False
+        victim_ids = [(int(i),) for i in self.ids[victims]]
+        self._keep(mask)
+        self.evictions += len(victim_ids)
+        async with db.writer() as conn:
+            await conn.executemany("DELETE FROM semantic_cache WHERE id = ?", victim_ids)
+            await conn.execute("DELETE FROM semantic_cache WHERE expires_at <= ?", (int(time.time()),))
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": SEMANTIC_CACHE_ENABLED,
+            "threshold": self.threshold,
+            "size": len(self.ids),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+async def similarity_report(days: int = 7, step: float = 0.02) -> List[Dict[str, Any]]:
+    """Requests per cache_similarity bucket from orchestrator_logs, to pick a threshold.
+
+    A bucket's semantic hits are requests answered from the cache at that
+    similarity; misses went to DeepSeek. Read the replies logged in
+    borderline buckets to see where paraphrases stop being safe."""
+    async with db.reader() as conn:
+        cursor = await conn.execute("""
+            SELECT CAST(cache_similarity / ? AS INTEGER) * ? AS bucket,
+                   COUNT(*) AS requests, SUM(cache_hit) AS hits
+            FROM orchestrator_logs
+            WHERE cache_similarity IS NOT NULL AND cache_similarity < 1.0 AND timestamp >= ?
+            GROUP BY bucket ORDER BY bucket DESC
+        """, (step, step, int(time.time()) - days * 86400))
+        return [{"similarity": round(r["bucket"], 4), "requests": r["requests"], "semantic_hits": r["hits"]}
+                for r in await cursor.fetchall()]
+
+# Global instances
+response_cache = ResponseCache()
+semantic_cache = SemanticCache()
+
+async def _print_similarity_report(days: int):
+    try:
+        print(f"cache_similarity over the last {days} days (threshold {SEMANTIC_CACHE_THRESHOLD})")
+        print(f"{'similarity':>10} {'requests':>9} {'hits':>6}")
+        for row in await similarity_report(days):
+            print(f"{row['similarity']:>10.2f} {row['requests']:>9} {row['semantic_hits']:>6}")
+    finally:
+        await db.close_db_pool()
+
+if __name__ == "__main__":
+    # python -m memory.response_cache [days]
+    asyncio.run(_print_similarity_report(int(sys.argv[1]) if len(sys.argv) > 1 else 7))
@@ -0,0 +1,301 @@
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+import zlib
+import aiosqlite
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+from memory import db
+from memory.quantized_index import exact_scores
+from memory.workers import index_sync
+
+# Configuration
+RETENTION_HOT_DAYS = int(os.getenv("RETENTION_HOT_DAYS", "30"))  # turns older than this move to the archive
+RETENTION_SELF_DAYS = 2  # inner-voice monologue ("self" rows) ages out sooner
+RETENTION_HOT_MAX_ROWS = 500_000  # beyond this the oldest turns are archived regardless of age
+RETENTION_BATCH_ROWS = 2000  # turns moved per writer transaction
+RETENTION_INTERVAL = 3600  # seconds between retention passes
+RETENTION_VACUUM_PAGES = 1000  # freed pages returned to the filesystem per incremental_vacuum step
+ARCHIVE_DIR = os.path.join(os.path.dirname(db._DB_PATH), "archive")
+COLD_SCAN_ROWS = 8192  # archived embeddings scored per chunk by cold_search
+
+_ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conv_turn(
+        id INTEGER PRIMARY KEY, -- same id the turn had in the hot table
+        ts INTEGER NOT NULL,
+        role TEXT,
+        kind TEXT,
+        text BLOB NOT NULL, -- zlib-compressed UTF-8
+        meta BLOB, -- zlib-compressed JSON
+        embedding BLOB -- packed float32, as in the hot table
+    );
+    CREATE INDEX IF NOT EXISTS idx_conv_turn_ts ON conv_turn(ts);
+"""
+
+def _compress(text: Optional[str]) -> Optional[bytes]:
+    return zlib.compress(text.encode(), 6) if text is not None else None
+
+def _decompress(blob: Optional[bytes]) -> Optional[str]:
+    return zlib.decompress(blob).decode() if blob is not None else None
+
+def partition_path(ts: int) -> str:
+    """Archive file holding turns from the UTC month of ts."""
+    return os.path.join(ARCHIVE_DIR, time.strftime("conv_turn_%Y%m.sqlite", time.gmtime(ts)))
+
+def partitions() -> List[str]:
+    """Archive files, newest month first."""
+    return sorted(glob.glob(os.path.join(ARCHIVE_DIR, "conv_turn_*.sqlite")), reverse=True)
+
+async def _open_partition(path: str, read_only: bool = False) -> aiosqlite.Connection:
+    if read_only:
+        conn = await aiosqlite.connect(f"file:{path}?mode=ro", uri=True)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = await aiosqlite.connect(path)
+        await conn.executescript("PRAGMA synchronous = NORMAL;" + _ARCHIVE_SCHEMA)
+    conn.row_factory = aiosqlite.Row
+    return conn
+
+class RetentionEngine:
+    """Keeps conv_turn hot by moving old turns into monthly archive partitions.
+
+    A pass copies every turn older than RETENTION_HOT_DAYS (RETENTION_SELF_DAYS
+    for "self" rows, and the oldest rows past RETENTION_HOT_MAX_ROWS) into
+    memory/archive/conv_turn_YYYYMM.sqlite with zlib-compressed text, then
+    deletes it from the hot table. The copy commits before the delete and
+    uses INSERT OR IGNORE, so a pass interrupted between the two is simply
+    redone. Freed pages are released with incremental vacuum and the
+    in-memory indexes are rebuilt from what is left. Archived embeddings
+    stay searchable through cold_search()."""
+
+    def __init__(self):
+        self.passes = 0
+        self.rows_moved = 0
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def _cutoffs(self, now: float) -> Tuple[int, int, int]:
+        cutoff = int(now - RETENTION_HOT_DAYS * 86400)
+        self_cutoff = int(now - RETENTION_SELF_DAYS * 86400)
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT id FROM conv_turn ORDER BY id DESC LIMIT 1 OFFSET ?", (RETENTION_HOT_MAX_ROWS,))
+            row = await cursor.fetchone()
+        return cutoff, self_cutoff, row["id"] if row else 0
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Archive expired turns, vacuum, and rebuild the search indexes."""
+        async with self._lock:
+            start = time.perf_counter()
+            cutoff, self_cutoff, id_floor = await self._cutoffs(time.time())
+            moved: Dict[str, int] = {}
+            after_id = 0
+            archives: Dict[str, aiosqlite.Connection] = {}
+            try:
+                while True:
+                    async with db.reader() as conn:
+                        cursor = await conn.execute("""
+                            SELECT id, ts, role, kind, text, meta, embedding FROM conv_turn
+                            WHERE id > ? AND (ts < ? OR (role = 'self' AND ts < ?) OR id <= ?)
+                            ORDER BY id LIMIT ?
+                        """, (after_id, cutoff, self_cutoff, id_floor, RETENTION_BATCH_ROWS))
+                        rows = await cursor.fetchall()
+                    if not rows:
+                        break
+
+                    by_partition: Dict[str, List[tuple]] = {}
+                    for row in rows:
+                        by_partition.setdefault(partition_path(row["ts"]), []).append((
+                            row["id"], row["ts"], row["role"], row["kind"],
+                            _compress(row["text"]), _compress(row["meta"]), row["embedding"]))
+                    for path, archived in by_partition.items():
+                        if path not in archives:
+                            archives[path] = await _open_partition(path)
+                        await archives[path].executemany(
+                            "INSERT OR IGNORE INTO conv_turn(id,ts,role,kind,text,meta,embedding) VALUES (?,?,?,?,?,?,?)",
+                            archived)
+                        await archives[path].commit()
+                        name = os.path.basename(path)
+                        moved[name] = moved.get(name, 0) + len(archived)
+
+                    # Only delete once the archive copy is committed
+                    async with db.writer() as conn:
+                        await conn.executemany("DELETE FROM conv_turn WHERE id = ?", [(r["id"],) for r in rows])
+                    after_id = rows[-1]["id"]
+            finally:
+                for conn in archives.values():
+                    await conn.close()
+
+            total = sum(moved.values())
+            if total:
+                async with db.writer() as conn:
+                    await conn.execute(
+                        "INSERT INTO retention_log(ts,cutoff_ts,moved,partitions) VALUES (?,?,?,?)",
+                        (int(time.time()), cutoff, total, json.dumps(moved)))
+                # Drop archived turns from the in-memory tiers and the /query cache
+                await index_sync.reload()
+            freed = await self.vacuum()
+            self.passes += 1
+            self.rows_moved += total
+            result = {
+                "moved": total,
+                "partitions": moved,
+                "pages_freed": freed,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+            print(f"Retention pass: {result}")
+            return result
+
+    async def vacuum(self) -> int:
+        """Return free pages to the filesystem in small steps so writers are not held up."""
+        async with db.reader() as conn:
+            cursor = await conn.execute("PRAGMA auto_vacuum")
+            mode = (await cursor.fetchone())[0]
+        if mode != 2:  # INCREMENTAL
+            print("Retention: auto_vacuum is not INCREMENTAL; apply migration_retention.sql to reclaim space")
+            return 0
+        freed = 0
+        while True:
+            async with db.writer() as conn:
+                cursor = await conn.execute("PRAGMA freelist_count")
+                free = (await cursor.fetchone())[0]
+                if not free:
+                    break
+                await conn.executescript(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES});")
+            freed += min(free, RETENTION_VACUUM_PAGES)
+            await asyncio.sleep(0)
+        if freed:
+            # Shrink the WAL too, or the freed space lingers there until the next checkpoint
+            async with db.writer() as conn:
+                await conn.executescript("PRAGMA wal_checkpoint(TRUNCATE);")
+        return freed
+
+    async def cold_search(self, query: List[float], top_k: int = 3, kind: Optional[str] = None,
+                          metric: str = "l1", since: Optional[int] = None) -> List[Tuple[float, Dict[str, Any]]]:
+        """Exact (distance, turn) pairs over the archive, nearest first.
+
+        Partitions are scanned newest first, COLD_SCAN_ROWS embeddings at a
+        time, keeping only the running top_k; text is decompressed for the
+        winners only. since (a unix ts) skips older rows and partitions."""
+        best_scores = np.empty(0, dtype=np.float32)
+        best: List[Tuple[int, str]] = []  # (turn_id, partition) aligned with best_scores
+        sql = "SELECT id, embedding FROM conv_turn WHERE embedding IS NOT NULL"
+        params: List[Any] = []
+        if kind is not None:
+            sql += " AND kind = ?"
+            params.append(kind)
+        if since is not None:
+            sql += " AND ts >= ?"
+            params.append(since)
+        row_bytes = len(query) * 4
+        for path in partitions():
+            if since is not None and os.path.basename(path) < os.path.basename(partition_path(since)):
+                break
+            conn = await _open_partition(path, read_only=True)
+            try:
+                cursor = await conn.execute(sql, params)
+                while True:
+                    rows = await cursor.fetchmany(COLD_SCAN_ROWS)
+                    if not rows:
+                        break
+                    rows = [r for r in rows if isinstance(r["embedding"], bytes) and len(r["embedding"]) == row_bytes]
+                    if not rows:
+                        continue
+                    vectors = np.frombuffer(b"".join(r["embedding"] for r in rows), dtype="<f4").reshape(len(rows), -1)
+                    scores = np.concatenate([best_scores, exact_scores(query, vectors, metric).astype(np.float32)])
+                    candidates = best + [(r["id"], path) for r in rows]
+                    keep = np.argsort(scores, kind="stable")[:top_k]
+                    best_scores, best = scores[keep], [candidates[i] for i in keep]
+            finally:
+                await conn.close()
+
+        by_path: Dict[str, List[int]] = {}
+        for turn_id, path in best:
+            by_path.setdefault(path, []).append(turn_id)
+        turns: Dict[int, Dict[str, Any]] = {}
+        for path, ids in by_path.items():
+            conn = await _open_partition(path, read_only=True)
+            try:
+                cursor = await conn.execute(
+                    f"SELECT id, ts, role, kind, text, meta FROM conv_turn WHERE id IN ({','.join('?' * len(ids))})", ids)
+                for r in await cursor.fetchall():
+                    meta = _decompress(r["meta"])
+                    turns[r["id"]] = {
+                        "id": r["id"],
+                        "text": _decompress(r["text"]),
+                        "kind": r["kind"],
+                        "meta": json.loads(meta) if meta else None,
+                        "role": r["role"],
+                        "ts": r["ts"],
+                        "archived": True,
+                    }
+            finally:
+                await conn.close()
+        return [(float(score), turns[turn_id]) for score, (turn_id, _) in zip(best_scores, best) if turn_id in turns]
+
+    async def report(self) -> Dict[str, Any]:
+        """Hot table size against the page cache budget, and what the archive holds."""
+        async with db.reader() as conn:
+            cursor = await conn.execute("SELECT role, COUNT(*) AS n FROM conv_turn GROUP BY role")
+            by_role = {r["role"]: r["n"] for r in await cursor.fetchall()}
+            pragmas = {}
+            for pragma in ("page_count", "page_size", "freelist_count", "auto_vacuum"):
+                cursor = await conn.execute(f"PRAGMA {pragma}")
+                pragmas[pragma] = (await cursor.fetchone())[0]
+        db_bytes = (pragmas["page_count"] - pragmas["freelist_count"]) * pragmas["page_size"]
+        archive = {}
+        for path in partitions():
+            conn = await _open_partition(path, read_only=True)
+            try:
+                cursor = await conn.execute("SELECT COUNT(*) FROM conv_turn")
+                archive[os.path.basename(path)] = {"rows": (await cursor.fetchone())[0],
+                                                   "bytes": os.path.getsize(path)}
+            finally:
+                await conn.close()
+        return {
+            "hot_rows": sum(by_role.values()),
+            "hot_rows_by_role": by_role,
+            "db_bytes": db_bytes,
+            "free_pages": pragmas["freelist_count"],
+            "incremental_vacuum": pragmas["auto_vacuum"] == 2,
+            "page_cache_bytes": db.DB_CACHE_KIB * 1024,
+            "fits_page_cache": db_bytes <= db.DB_CACHE_KIB * 1024,
+            "archive": archive,
+            "passes": self.passes,
+            "rows_moved": self.rows_moved,
+        }
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Retention pass failed: {e}")
+            await asyncio.sleep(RETENTION_INTERVAL)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+# Global instance
+retention = RetentionEngine()
+
+async def _main(command: str):
+    try:
+        if command == "run":
+            await retention.run_once()
+        print(json.dumps(await retention.report(), indent=2))
+    finally:
+        await db.close_db_pool()
+
+if __name__ == "__main__":
+    # python -m memory.retention [report|run]
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "report"))
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from memory import db
+
+# Configuration
+ROUTER_ENABLED = os.getenv("MODEL_ROUTER", "1") != "0"  # 0: everything goes to the reasoner, as before
+ROUTER_MAX_LATENCY = float(os.getenv("ROUTER_MAX_LATENCY", "60"))  # seconds; a slower reasoner route is downgraded
+ROUTER_BUDGET_RESERVE = 20  # reasoner calls' worth of budget kept back; below it reasoning is downgraded
+ROUTER_LONG_WORDS = 80  # prompts longer than this need a long answer
+ROUTER_EWMA_ALPHA = 0.1  # weight of each new observation in the running latency/cost
+ROUTER_REFRESH_INTERVAL = 30  # seconds between reads of new orchestrator_logs rows
+ROUTER_HISTORY_DAYS = 7  # orchestrator_logs window the statistics start from
+ROUTER_DECISIONS_KEPT = 200
+
+# Routes: model, max_tokens sent upstream, and priors for latency (seconds)
+# and cost (tokens) used until the route has been observed.
+ROUTES: Dict[str, Dict[str, Any]] = {
+    "chat": {"model": "deepseek-chat", "max_tokens": 512, "latency": 3.0, "cost": 150},
+    "long": {"model": "deepseek-chat", "max_tokens": 2048, "latency": 10.0, "cost": 600},
+    "reasoning": {"model": "deepseek-reasoner", "max_tokens": 4096, "latency": 30.0, "cost": 500},
+}
+DEFAULT_ROUTE = "reasoning"
+DOWNGRADE = {"reasoning": "long"}  # where a route goes when it is too slow or the budget is tight
+
+_REASONING = re.compile(
+    r"\b(why|prove|proof|derive|step by step|explain|analy[sz]e|compare|design|plan|trade-?offs?"
+    r"|debug|optimi[sz]e|calculate|solve|estimate|evaluate|should i|how (do|does|would|should|can))\b")
+_MATH = re.compile(r"\d\s*[-+*/^=<>]\s*\d|\b(integral|derivative|equation|probability)\b")
+_CODE = re.compile(r"```|\b(def|class|function|traceback|stack trace|exception|compile|regex|sql)\b")
+_LONG_FORM = re.compile(r"\b(write|draft|summari[sz]e|translate|rewrite|list)\b")
+
+def classify(message: str) -> Tuple[str, Dict[str, Any]]:
+    """(prompt class, features) from regexes and length alone; no model call."""
+    text = message.lower()
+    features = {
+        "words": len(text.split()),
+        "reasoning": bool(_REASONING.search(text)),
+        "math": bool(_MATH.search(text)),
+        "code": bool(_CODE.search(text)),
+        "long_form": bool(_LONG_FORM.search(text)),
+    }
+    if features["reasoning"] or features["math"]:
+        return "reasoning", features
+    if features["code"] or features["long_form"] or features["words"] > ROUTER_LONG_WORDS:
+        return "long", features
+    return "chat", features
+
+class RouteStats:
+    """Running (EWMA) latency and cost of one route."""
+
+    def __init__(self, latency: float, cost: float):
+        self.latency = latency
+        self.cost = cost
+        self.observed = 0
+
+    def observe(self, latency: float, cost: float):
+        if self.observed == 0:
+            self.latency, self.cost = latency, cost
+        else:
+            self.latency += ROUTER_EWMA_ALPHA * (latency - self.latency)
+            self.cost += ROUTER_EWMA_ALPHA * (cost - self.cost)
+        self.observed += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"latency": round(self.latency, 3), "cost": round(self.cost, 1), "observed": self.observed}
+
+class ModelRouter:
+    """Picks the model and max_tokens for a prompt.
+
+    The prompt's class (chat, long, reasoning) picks a route. A reasoning
+    route is downgraded to a cheaper one when its observed latency exceeds
+    ROUTER_MAX_LATENCY, or when the remaining budget would not cover
+    ROUTER_BUDGET_RESERVE more reasoner calls. Route statistics are
+    learned from orchestrator_logs, so they cover every worker."""
+
+    def __init__(self):
+        self.stats = {name: RouteStats(route["latency"], route["cost"]) for name, route in ROUTES.items()}
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=ROUTER_DECISIONS_KEPT)
+        self.counts: Dict[str, int] = {}
+        self.last_id = 0
+        self.refreshed = 0.0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, force: bool = False):
+        """Fold orchestrator_logs rows written since the last refresh into the statistics."""
+        if not force and time.time() - self.refreshed < ROUTER_REFRESH_INTERVAL:
+            return
+        async with self._lock:
+            if not force and time.time() - self.refreshed < ROUTER_REFRESH_INTERVAL:
+                return
+            since = 0 if self.last_id else int(time.time()) - ROUTER_HISTORY_DAYS * 86400
+            async with db.reader() as conn:
+                # Coalesced followers didn't make a call; failed and fallback calls say nothing about a route's cost
+                cursor = await conn.execute("""
+                    SELECT id, route, latency, cost FROM orchestrator_logs
+                    WHERE id > ? AND timestamp >= ? AND route IS NOT NULL
+                      AND deepseek_used AND NOT coalesced AND error IS NULL AND fallback IS NULL
+                    ORDER BY id
+                """, (self.last_id, since))
+                for row in await cursor.fetchall():
+                    self.last_id = row["id"]
+                    if row["route"] in self.stats:
+                        self.stats[row["route"]].observe(row["latency"], row["cost"])
+            self.refreshed = time.time()
+
+    async def choose(self, message: str) -> Dict[str, Any]:
+        """The route for a prompt: {"route", "model", "max_tokens", "estimated_cost", "reason"}."""
+        if not ROUTER_ENABLED:
+            return self._decision(message, DEFAULT_ROUTE, "router disabled", {})
+        await self.refresh()
+        route, features = classify(message)
+        reason = f"class {route}"
+        if route in DOWNGRADE:
+            from memory.ledger import ledger
+            await ledger.ensure_loaded()
+            stats = self.stats[route]
+            if stats.latency > ROUTER_MAX_LATENCY:
+                reason += f", {route} latency {stats.latency:.1f}s > {ROUTER_MAX_LATENCY:.0f}s"
+                route = DOWNGRADE[route]
+            elif ledger.balance() < stats.cost * ROUTER_BUDGET_RESERVE:
+                reason += f", budget {ledger.balance()} < {ROUTER_BUDGET_RESERVE} calls"
+                route = DOWNGRADE[route]
+        return self._decision(message, route, reason, features)
+
+    def _decision(self, message: str, route: str, reason: str, features: Dict[str, Any]) -> Dict[str, Any]:
+        decision = {
+            "route": route,
+            "model": ROUTES[route]["model"],
+            "max_tokens": ROUTES[route]["max_tokens"],
+            "estimated_cost": max(1, round(self.stats[route].cost)),
+            "reason": reason,
+        }
+        self.counts[route] = self.counts.get(route, 0) + 1
+        self.decisions.append({"timestamp": int(time.time()), "message": message[:80],
+                               "features": features, **decision})
+        return decision
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "enabled": ROUTER_ENABLED,
+            "routes": {name: {**ROUTES[name], **self.stats[name].to_dict()} for name in ROUTES},
+            "chosen": dict(self.counts),
+            "recent": list(self.decisions)[-20:],
+        }
+
+async def what_if(days: int = 7) -> Dict[str, Any]:
+    """Replay logged DeepSeek requests through today's classifier.
+
+    For each route the policy would pick, compare what those requests
+    actually cost and took (as logged) with the route's current
+    statistics, and with sending everything to DEFAULT_ROUTE."""
+    await model_router.refresh(force=True)
+    async with db.reader() as conn:
+        cursor = await conn.execute("""
+            SELECT user_message, latency, cost FROM orchestrator_logs
+            WHERE timestamp >= ? AND deepseek_used AND NOT coalesced AND error IS NULL AND fallback IS NULL
+        """, (int(time.time()) - days * 86400,))
+        rows = await cursor.fetchall()
+
+    routes: Dict[str, Dict[str, float]] = {}
+    for row in rows:
+        route, _ = classify(row["user_message"])
+        bucket = routes.setdefault(route, {"requests": 0, "actual_cost": 0, "actual_latency": 0.0})
+        bucket["requests"] += 1
+        bucket["actual_cost"] += row["cost"]
+        bucket["actual_latency"] += row["latency"]
+
+    baseline = model_router.stats[DEFAULT_ROUTE]
+    totals = {"actual_cost": 0.0, "policy_cost": 0.0, "baseline_cost": 0.0,
+              "actual_latency": 0.0, "policy_latency": 0.0, "baseline_latency": 0.0}
+    for route, bucket in routes.items():
+        stats = model_router.stats[route]
+        bucket["policy_cost"] = round(stats.cost * bucket["requests"])
+        bucket["policy_latency"] = round(stats.latency * bucket["requests"], 2)
+        bucket["actual_latency"] = round(bucket["actual_latency"], 2)
+        totals["actual_cost"] += bucket["actual_cost"]
+        totals["policy_cost"] += bucket["policy_cost"]
+        totals["baseline_cost"] += baseline.cost * bucket["requests"]
+        totals["actual_latency"] += bucket["actual_latency"]
+        totals["policy_latency"] += bucket["policy_latency"]
+        totals["baseline_latency"] += baseline.latency * bucket["requests"]
+    requests = len(rows)
+    return {
+        "days": days,
+        "requests": requests,
+        "routes": routes,
+        "totals": {k: round(v, 2) for k, v in totals.items()},
+        "mean_latency": {k: round(totals[f"{k}_latency"] / requests, 3) if requests else None
+                         for k in ("actual", "policy", "baseline")},
+    }
+
+# Global instance
+model_router = ModelRouter()
+
+async def _main(args: List[str]):
+    try:
+        if args and args[0] == "classify":
+            print(classify(" ".join(args[1:])))
+        else:
+            print(json.dumps(await what_if(int(args[0]) if args else ROUTER_HISTORY_DAYS), indent=2))
+    finally:
+        await db.close_db_pool()
+
+if __name__ == "__main__":
+    # python -m memory.router [days] | classify MESSAGE
+    asyncio.run(_main(sys.argv[1:]))
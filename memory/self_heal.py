@@ -31,10 +31,9 @@ def apply_patch(patch: str, file: str):
         f.writelines(lines)
 
 async def log_fix(patch: str):
-    pool = await db.get_db_pool()
-    await pool.execute("INSERT INTO debug_log(source,level,msg,patch,ts) VALUES (?,?,?,?,?)",
-                ("self_heal", "fix", "applied auto-patch", patch, int(os.time())))
-    await pool.commit()
+    async with db.writer() as conn:
+        await conn.execute("INSERT INTO debug_log(source,level,msg,patch,ts) VALUES (?,?,?,?,?)",
+                    ("self_heal", "fix", "applied auto-patch", patch, int(os.time())))
 
 async def tail_and_heal():
     # This function would typically run as a separate process or thread
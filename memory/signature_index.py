@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import os
+from itertools import combinations
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+from memory import db
+
+SIGNATURE_BYTES = 16  # the MD5 digest behind the md5 embedding backend
+SUBSTRINGS = 8  # multi-index tables, 16 bits each
+SIGNATURE_PROBE_BITS = int(os.getenv("SIGNATURE_PROBE_BITS", "1"))  # flipped bits probed per substring
+EXACT_RADIUS = SUBSTRINGS * (SIGNATURE_PROBE_BITS + 1) - 1  # any code within this distance is probed
+SIGNATURE_FULL_SCAN = os.getenv("SIGNATURE_FULL_SCAN", "0") == "1"  # rank every row when too few are within EXACT_RADIUS
+TAIL_MERGE_ROWS = 4096
+INITIAL_CAPACITY = 1024
+
+# XOR masks of every 16-bit pattern with at most SIGNATURE_PROBE_BITS bits set
+PROBE_MASKS = np.array(sorted({sum(1 << b for b in bits)
+                               for r in range(SIGNATURE_PROBE_BITS + 1)
+                               for bits in combinations(range(16), r)}), dtype=np.uint16)
+
+def text_to_signature(text: str) -> bytes:
+    """Raw 128-bit MD5 signature of a text."""
+    return hashlib.md5(text.encode()).digest()
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(words)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1)
+
+class SignatureIndex:
+    """Packed MD5 signatures of conv_turn rows ranked by Hamming distance.
+
+    Each signature is split into SUBSTRINGS 16-bit substrings, and every
+    substring position has a sorted table of (substring, row). Two codes
+    within EXACT_RADIUS bits differ in at most SIGNATURE_PROBE_BITS bits on
+    at least one substring, so near-duplicates are found by binary-searching
+    each table for the query's substring and its neighbours at up to that
+    many flipped bits (multi-probe), instead of a scan. Rows inserted since
+    the last merge sit in a small unsorted tail."""
+
+    def __init__(self):
+        self.loaded = False
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self.searches = 0
+        self.short = 0  # searches with fewer than top_k rows within EXACT_RADIUS
+        self.full_scans = 0
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+        self.codes = np.empty((INITIAL_CAPACITY, SIGNATURE_BYTES), dtype=np.uint8)
+        self.ids = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.kinds = np.empty(INITIAL_CAPACITY, dtype=np.int32)
+        self.kind_codes = {None: 0}
+        self.table_keys = [np.empty(0, dtype=np.uint16) for _ in range(SUBSTRINGS)]
+        self.table_rows = [np.empty(0, dtype=np.int32) for _ in range(SUBSTRINGS)]
+        self.merged = 0  # rows [0, merged) are in the sorted tables
+
+    def _words(self) -> np.ndarray:
+        return self.codes[:self.size].view("<u8")
+
+    def _substrings(self, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        end = self.size if end is None else end
+        return self.codes[start:end].view("<u2")
+
+    def _append(self, ids, kinds, codes: np.ndarray):
+        n = len(ids)
+        needed = self.size + n
+        if needed > len(self.ids):
+            capacity = len(self.ids)
+            while capacity < needed:
+                capacity *= 2
+            self.ids = np.resize(self.ids, capacity)
+            self.kinds = np.resize(self.kinds, capacity)
+            grown = np.empty((capacity, SIGNATURE_BYTES), dtype=np.uint8)
+            grown[:self.size] = self.codes[:self.size]
+            self.codes = grown
+        for kind in kinds:
+            if kind not in self.kind_codes:
+                self.kind_codes[kind] = len(self.kind_codes)
+        self.ids[self.size:needed] = ids
+        self.kinds[self.size:needed] = [self.kind_codes[k] for k in kinds]
+        self.codes[self.size:needed] = codes
+        self.size = needed
+        if self.size - self.merged >= TAIL_MERGE_ROWS:
+            self._merge_tail()
+
+    def _merge_tail(self):
+        """Merge unsorted tail rows into the sorted substring tables."""
+        subs = self._substrings(self.merged)
+        rows = np.arange(self.merged, self.size, dtype=np.int32)
+        for t in range(SUBSTRINGS):
+            order = np.argsort(subs[:, t], kind="stable")
+            keys, new_rows = subs[order, t], rows[order]
+            at = np.searchsorted(self.table_keys[t], keys, side="right")
+            self.table_keys[t] = np.insert(self.table_keys[t], at, keys)
+            self.table_rows[t] = np.insert(self.table_rows[t], at, new_rows)
+        self.merged = self.size
+
+    async def load(self):
+        """(Re)build from the text of every embedded conv_turn row."""
+        async with self._lock:
+            await self._load()
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self._load()
+
+    async def _load(self):
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT id, kind, text FROM conv_turn WHERE embedding IS NOT NULL ORDER BY id")
+            rows = await cursor.fetchall()
+
+        self._reset()
+        if rows:
+            codes = np.frombuffer(b"".join(text_to_signature(r["text"]) for r in rows), dtype=np.uint8)
+            self._append([r["id"] for r in rows], [r["kind"] for r in rows],
+                         codes.reshape(-1, SIGNATURE_BYTES))
+        self._merge_tail()
+
+        # Turns added while the SELECT was running are not in `rows`
+        newest = rows[-1]["id"] if rows else 0
+        for turn_id, kind, signature in self._pending:
+            if turn_id > newest:
+                self._append([turn_id], [kind], np.frombuffer(signature, dtype=np.uint8)[None])
+        self._pending = []
+        self.loaded = True
+        print(f"Signature index loaded: {self.size} signatures")
+
+    def last_id(self) -> int:
+        return int(self.ids[self.size - 1]) if self.size else 0
+
+    def add(self, turn_id: int, text: str, kind: Optional[str] = None):
+        """Append a single turn; called by db.add_turn after each embedded insert."""
+        signature = text_to_signature(text)
+        if not self.loaded:
+            self._pending.append((turn_id, kind, signature))
+            return
+        self._append([turn_id], [kind], np.frombuffer(signature, dtype=np.uint8)[None])
+
+    def search(self, text: str, top_k: int = 3, kind: Optional[str] = None) -> List[Tuple[int, float]]:
+        """Return (turn_id, hamming_distance) pairs, closest first.
+
+        Only rows within EXACT_RADIUS are returned, so there may be fewer
+        than top_k (MD5 signatures of different texts are ~64 bits apart).
+        With SIGNATURE_FULL_SCAN, such searches instead rank every row by a
+        full popcount scan."""
+        if self.size == 0 or top_k <= 0:
+            return []
+        kind_code = None
+        if kind is not None:
+            kind_code = self.kind_codes.get(kind)
+            if kind_code is None:
+                return []
+
+        signature = np.frombuffer(text_to_signature(text), dtype=np.uint8)
+        q_words, q_subs = signature.view("<u8"), signature.view("<u2")
+
+        candidates = [np.arange(self.merged, self.size, dtype=np.int32)]
+        for t in range(SUBSTRINGS):
+            keys = self.table_keys[t]
+            probes = q_subs[t] ^ PROBE_MASKS
+            lo = np.searchsorted(keys, probes, side="left")
+            hi = np.searchsorted(keys, probes, side="right")
+            candidates.extend(self.table_rows[t][a:b] for a, b in zip(lo, hi) if b > a)
+        rows = np.unique(np.concatenate(candidates))
+        hits = self._rank(rows, q_words, kind_code, top_k, EXACT_RADIUS)
+        self.searches += 1
+        if len(hits) < top_k:
+            self.short += 1
+            if SIGNATURE_FULL_SCAN:
+                self.full_scans += 1
+                hits = self._rank(None, q_words, kind_code, top_k, None)
+        return hits
+
+    def _rank(self, rows, q_words, kind_code, top_k, radius) -> List[Tuple[int, float]]:
+        words = self._words() if rows is None else self._words()[rows]
+        # Column-wise popcounts are far faster than reducing a (n, 2) array along axis 1
+        dists = _popcount(words[:, 0] ^ q_words[0]).astype(np.int32)
+        for j in range(1, words.shape[1]):
+            dists += _popcount(words[:, j] ^ q_words[j])
+        positions = np.arange(self.size) if rows is None else rows
+        keep = np.ones(len(dists), dtype=bool)
+        if radius is not None:
+            keep &= dists <= radius
+        if kind_code is not None:
+            keep &= self.kinds[positions] == kind_code
+        dists, positions = dists[keep], positions[keep]
+        k = min(top_k, len(dists))
+        if k == 0:
+            return []
+        top = np.argpartition(dists, k - 1)[:k]
+        top = top[np.argsort(dists[top], kind="stable")]
+        return [(int(self.ids[positions[i]]), float(dists[i])) for i in top]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "radius": EXACT_RADIUS,
+            "probes_per_table": len(PROBE_MASKS),
+            "searches": self.searches,
+            "short": self.short,
+            "full_scan": SIGNATURE_FULL_SCAN,
+            "full_scans": self.full_scans,
+        }
+
+# Global instance
+signature_index = SignatureIndex()
@@ -0,0 +1,42 @@
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key starts fn() as its own task; anyone asking
+    for the same key while it runs awaits that task instead of starting
+    another. The task is shielded, so a caller that is cancelled (client
+    disconnect) doesn't cancel the call for the others. Results are not
+    kept after the call finishes; caching is the response caches' job."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, Tuple[asyncio.Task, str]] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, str, bool]:
+        """(result, flight_id, shared); shared is True for callers that joined a call in flight."""
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            task, flight_id = flight
+            return await asyncio.shield(task), flight_id, True
+
+        flight_id = uuid.uuid4().hex[:12]
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = (task, flight_id)
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self.calls += 1
+        return await asyncio.shield(task), flight_id, False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+# Global instance
+single_flight = SingleFlight()
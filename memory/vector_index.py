@@ -0,0 +1,252 @@
+import asyncio
+import numpy as np
+from typing import List, Optional, Tuple
+
+from memory import db
+from memory.embeddings import embedder
+
+EMBEDDING_DIM = embedder.dim
+INITIAL_CAPACITY = 1024
+L1_CHUNK_ROWS = 16384  # keeps the |v - q| scratch buffer inside L2 cache
+BATCH_CHUNK_ROWS = 65536  # rows scored per matrix-matrix step in search_batch
+
+class VectorIndex:
+    """In-memory matrix of all conv_turn embeddings for vectorized top-k search.
+
+    Rows are loaded once from SQLite and then appended to by db.add_turn, so
+    /query never has to touch the embedding column again."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.loaded = False
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+        self.ids = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.kinds = np.empty(INITIAL_CAPACITY, dtype=np.int32)
+        self.vectors = np.empty((INITIAL_CAPACITY, self.dim), dtype=np.float32)
+        self.norms = np.empty(INITIAL_CAPACITY, dtype=np.float32)
+        self.kind_codes = {None: 0}
+
+    def _kind_code(self, kind: Optional[str]) -> int:
+        if kind not in self.kind_codes:
+            self.kind_codes[kind] = len(self.kind_codes)
+        return self.kind_codes[kind]
+
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self.ids = np.resize(self.ids, capacity)
+        self.kinds = np.resize(self.kinds, capacity)
+        self.norms = np.resize(self.norms, capacity)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+
+    def _append(self, ids, kinds, vectors: np.ndarray):
+        self._append_coded(ids, [self._kind_code(k) for k in kinds], vectors)
+
+    def _append_coded(self, ids, kind_codes, vectors: np.ndarray):
+        n = len(ids)
+        self._reserve(n)
+        end = self.size + n
+        self.ids[self.size:end] = ids
+        self.kinds[self.size:end] = kind_codes
+        self.vectors[self.size:end] = vectors
+        self.norms[self.size:end] = np.linalg.norm(vectors, axis=1)
+        self.size = end
+
+    async def load(self, since_id: int = 0):
+        """(Re)build the matrix from embedded conv_turn rows.
+
+        With since_id, only rows newer than it are appended to what is
+        already in memory (used when restoring a persisted index)."""
+        async with self._lock:
+            await self._load(since_id)
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self._load()
+
+    async def _load(self, since_id: int = 0):
+        async with db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT id, kind, embedding FROM conv_turn WHERE embedding IS NOT NULL AND id > ? ORDER BY id",
+                (since_id,))
+            rows = await cursor.fetchall()
+
+        if not since_id:
+            self._reset()
+        ids, kinds, blobs = [], [], []
+        row_bytes = self.dim * 4
+        for row in rows:
+            blob = row["embedding"]
+            if isinstance(blob, str):  # legacy JSON row
+                blob = db.pack_embedding(db.unpack_embedding(blob))
+            if blob is None or len(blob) != row_bytes:
+                continue
+            ids.append(row["id"])
+            kinds.append(row["kind"])
+            blobs.append(blob)
+        if ids:
+            vectors = np.frombuffer(b"".join(blobs), dtype="<f4").reshape(-1, self.dim)
+            self._append(ids, kinds, vectors)
+
+        # Turns added while the SELECT was running are not in `rows`
+        newest = ids[-1] if ids else since_id
+        pending = [p for p in self._pending if p[0] > newest]
+        if pending:
+            self._append([p[0] for p in pending], [p[1] for p in pending],
+                         np.asarray([p[2] for p in pending], dtype=np.float32))
+        self._pending = []
+        self.loaded = True
+        print(f"Vector index loaded: {self.size} embeddings")
+
+    def last_id(self) -> int:
+        return int(self.ids[self.size - 1]) if self.size else 0
+
+    def positions(self, turn_ids: List[int]) -> np.ndarray:
+        """Row positions of the given turn ids (ids not in the index are skipped)."""
+        ids = self.ids[:self.size]  # appended in id order, so already sorted
+        wanted = np.asarray(turn_ids, dtype=np.int64)
+        at = np.searchsorted(ids, wanted)
+        at = at[at < len(ids)]
+        return at[np.isin(ids[at], wanted)]
+
+    def add(self, turn_id: int, embedding: List[float], kind: Optional[str] = None):
+        """Append a single embedding; called by db.add_turn after each insert."""
+        if embedding is None or len(embedding) != self.dim:
+            return
+        if not self.loaded:
+            self._pending.append((turn_id, kind, embedding))
+            return
+        self._append([turn_id], [kind], np.asarray([embedding], dtype=np.float32))
+
+    def search(self, query: List[float], top_k: int = 3, kind: Optional[str] = None,
+               metric: str = "l1", rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Return (turn_id, distance) pairs, lowest distance first.
+
+        metric is "l1" (L1 distance) or "cosine" (1 - cosine similarity).
+        rows restricts scoring to those row positions (ANN candidates)."""
+        if self.size == 0 or top_k <= 0:
+            return []
+
+        if rows is None:
+            vectors = self.vectors[:self.size]
+            ids = self.ids[:self.size]
+            norms = self.norms[:self.size]
+            kinds = self.kinds[:self.size]
+        else:
+            vectors, ids = self.vectors[rows], self.ids[rows]
+            norms, kinds = self.norms[rows], self.kinds[rows]
+
+        q = np.asarray(query, dtype=np.float32)
+        if q.shape != (self.dim,):
+            raise ValueError(f"Query has {q.size} dimensions, index has {self.dim}")
+        if metric == "cosine":
+            denom = norms * np.linalg.norm(q)
+            denom[denom == 0] = 1.0
+            scores = 1.0 - (vectors @ q) / denom
+            np.maximum(scores, 0.0, out=scores)  # float32 rounding can dip below 0
+        elif metric == "l1":
+            scores = self._l1_scores(vectors, q)
+        else:
+            raise ValueError(f"Unknown metric: {metric}")
+
+        # Masking is cheaper than gathering the matching rows before scoring
+        candidates = len(scores)
+        if kind is not None:
+            code = self.kind_codes.get(kind)
+            if code is None:
+                return []
+            mask = kinds != code
+            scores[mask] = np.inf
+            candidates -= int(mask.sum())
+
+        k = min(top_k, candidates)
+        if k == 0:
+            return []
+        top = np.argpartition(scores, k - 1)[:k]
+        top = top[np.argsort(scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def search_batch(self, queries: List[List[float]], top_ks: List[int],
+                     kinds: List[Optional[str]], metric: str = "l1") -> List[List[Tuple[int, float]]]:
+        """Top-k for many queries in a single pass over the matrix.
+
+        For cosine, each chunk of stored rows is scored against every query
+        at once (one matrix-matrix product) and a running top-k per query is
+        kept, so the embeddings stream through memory once per batch. L1 has
+        no matrix-product form, so it runs the per-query chunked scan."""
+        if metric == "l1":
+            return [self.search(q, k, kind, metric) for q, k, kind in zip(queries, top_ks, kinds)]
+        if metric != "cosine":
+            raise ValueError(f"Unknown metric: {metric}")
+
+        n_q = len(queries)
+        results = [[] for _ in range(n_q)]
+        k_max = max(top_ks, default=0)
+        if self.size == 0 or n_q == 0 or k_max <= 0:
+            return results
+
+        Q = np.asarray(queries, dtype=np.float32)
+        if Q.shape != (n_q, self.dim):
+            raise ValueError(f"Queries must have {self.dim} dimensions")
+        # -1 = no kind filter, -2 = kind never seen (no row can match)
+        codes = np.array([-1 if k is None else self.kind_codes.get(k, -2) for k in kinds])
+        filtered = codes != -1
+        q_norms = np.linalg.norm(Q, axis=1)
+        Q_unit = Q / np.where(q_norms == 0, 1.0, q_norms)[:, None]
+
+        best_scores = np.full((n_q, k_max), np.inf, dtype=np.float32)
+        best_rows = np.full((n_q, k_max), -1, dtype=np.int64)
+        for start in range(0, self.size, BATCH_CHUNK_ROWS):
+            end = min(start + BATCH_CHUNK_ROWS, self.size)
+            # Rank by negative similarity in place; converted to 1 - cos at the end
+            norms = self.norms[start:end]
+            scores = Q_unit @ self.vectors[start:end].T
+            scores /= np.where(norms == 0, 1.0, norms)
+            np.negative(scores, out=scores)
+            if filtered.any():
+                mask = (codes[:, None] != self.kinds[None, start:end]) & filtered[:, None]
+                np.putmask(scores, mask, np.inf)
+
+            scores = np.hstack([best_scores, scores])
+            rows = np.hstack([best_rows, np.broadcast_to(np.arange(start, end), (n_q, end - start))])
+            top = np.argpartition(scores, k_max - 1, axis=1)[:, :k_max]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+
+        finite = np.isfinite(best_scores)
+        best_scores[finite] = np.maximum(1.0 + best_scores[finite], 0.0)
+        for j in range(n_q):
+            order = np.argsort(best_scores[j], kind="stable")[:top_ks[j]]
+            results[j] = [(int(self.ids[best_rows[j, i]]), float(best_scores[j, i]))
+                          for i in order if np.isfinite(best_scores[j, i])]
+        return results
+
+    def _l1_scores(self, vectors: np.ndarray, q: np.ndarray) -> np.ndarray:
+        n = len(vectors)
+        scores = np.empty(n, dtype=np.float32)
+        scratch = np.empty((min(n, L1_CHUNK_ROWS), self.dim), dtype=np.float32)
+        ones = np.ones(self.dim, dtype=np.float32)
+        for start in range(0, n, L1_CHUNK_ROWS):
+            chunk = vectors[start:start + L1_CHUNK_ROWS]
+            buf = scratch[:len(chunk)]
+            np.subtract(chunk, q, out=buf)
+            np.abs(buf, out=buf)
+            np.dot(buf, ones, out=scores[start:start + len(chunk)])
+        return scores
+
+# Global instance
+vector_index = VectorIndex()
@@ -0,0 +1,72 @@
+import os
+from typing import List, Optional, Tuple
+
+from memory.ann_index import ann_index
+from memory.quantized_index import EMBEDDING_QUANTIZATION, quantized_index, rerank
+from memory.workers import index_sync
+
+# Routes vector search to the float32 ANN index or, when EMBEDDING_QUANTIZATION
+# is "int8"/"binary", to the compressed tier so full vectors stay on disk.
+QUANTIZED = EMBEDDING_QUANTIZATION != "none"
+
+async def load():
+    if QUANTIZED:
+        await quantized_index.load()
+    else:
+        await ann_index.load()
+
+async def reload():
+    """Rebuild the active tier from SQLite once retention has archived turns."""
+    if QUANTIZED:
+        if quantized_index.loaded:
+            quantized_index.loaded = False  # turns added meanwhile wait in _pending
+            await quantized_index.load()
+    elif ann_index.store.loaded or os.path.exists(ann_index.path):
+        await ann_index.rebuild()
+
+def save():
+    if not QUANTIZED and ann_index.store.loaded:
+        ann_index.save()
+
+def last_id() -> int:
+    """Newest turn id held by the active tier."""
+    if QUANTIZED:
+        return quantized_index.last_id()
+    return ann_index.store.last_id()
+
+def add(turn_id: int, embedding: List[float], kind: Optional[str] = None):
+    if QUANTIZED:
+        quantized_index.add(turn_id, embedding, kind)
+    else:
+        ann_index.add(turn_id, embedding, kind)
+
+async def search(query: List[float], top_k: int = 3, kind: Optional[str] = None,
+                 metric: str = "l1", nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+    """(turn_id, distance) pairs, nearest first, from whichever tier is active."""
+    await index_sync.catch_up()
+    if QUANTIZED:
+        await quantized_index.ensure_loaded()
+        return await quantized_index.search(query, top_k, kind, metric)
+    await ann_index.ensure_loaded()
+    return ann_index.search(query, top_k, kind, metric, nprobe)
+
+async def search_batch(queries: List[List[float]], top_ks: List[int], kinds: List[Optional[str]],
+                       metric: str = "l1", nprobes: Optional[List[Optional[int]]] = None
+                       ) -> List[List[Tuple[int, float]]]:
+    if QUANTIZED:
+        await quantized_index.ensure_loaded()
+        return [await quantized_index.search(q, top_k, kind, metric)
+                for q, top_k, kind in zip(queries, top_ks, kinds)]
+    await ann_index.ensure_loaded()
+    return ann_index.search_batch(queries, top_ks, kinds, metric, nprobes)
+
+async def score_ids(query: List[float], turn_ids: List[int], kind: Optional[str] = None,
+                    metric: str = "l1") -> List[Tuple[int, float]]:
+    """Exact distances for a known candidate set (e.g. lexical hits), nearest first."""
+    if QUANTIZED:
+        # kind is already enforced by whoever produced the candidates
+        return await rerank(query, turn_ids, metric)
+    await ann_index.ensure_loaded()
+    store = ann_index.store
+    rows = store.positions(turn_ids)
+    return store.search(query, len(rows), kind, metric, rows=rows)
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Awaitable, Callable, List
+
+from memory import db
+
+# Configuration
+MULTI_WORKER = os.getenv("MULTI_WORKER", "0") == "1"  # set when running uvicorn with --workers > 1
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL = 15  # seconds a leader keeps its lease without renewing
+LEASE_RENEW_INTERVAL = 5  # seconds between renew/acquire attempts
+
+class LeaderElection:
+    """Runs background singletons in exactly one worker process.
+
+    Workers compete for a row in worker_lease; an upsert with RETURNING
+    succeeds only for the current holder or when the lease has expired,
+    so exactly one worker holds it at a time. The holder runs the start
+    callbacks and renews every LEASE_RENEW_INTERVAL; if it dies, another
+    worker takes over once LEASE_TTL has passed. A start callback that
+    raises gives the lease up, so no worker holds it without running them."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.is_leader = False
+        self._starts: List[Callable[[], Awaitable[None]]] = []
+        self._stops: List[Callable[[], Awaitable[None]]] = []
+        self._task = None
+
+    def on_elected(self, start: Callable[[], Awaitable[None]], stop: Callable[[], Awaitable[None]]):
+        self._starts.append(start)
+        self._stops.append(stop)
+
+    async def try_acquire(self) -> bool:
+        now = time.time()
+        async with db.writer() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO worker_lease(name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE worker_lease.holder = excluded.holder OR worker_lease.expires_at < ?
+                RETURNING holder
+            """, (self.name, WORKER_ID, now + LEASE_TTL, now))
+            return await cursor.fetchone() is not None
+
+    async def _run(self):
+        while True:
+            try:
+                acquired = await self.try_acquire()
+            except Exception as e:
+                print(f"Lease {self.name} check failed: {e}")
+                acquired = False
+            if acquired and not self.is_leader:
+                self.is_leader = True
+                print(f"Worker {WORKER_ID} elected leader for {self.name}")
+                try:
+                    for start in self._starts:
+                        await start()
+                except Exception as e:
+                    # Don't hold the lease without running the services; stop what
+                    # did start and let this or another worker try again
+                    print(f"Starting {self.name} services failed, releasing the lease: {e}")
+                    await self._resign()
+            elif not acquired and self.is_leader:
+                print(f"Worker {WORKER_ID} lost leadership for {self.name}")
+                await self._stop()
+            await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+    async def _stop(self):
+        """Run every stop callback, even if one fails."""
+        self.is_leader = False
+        for stop in self._stops:
+            try:
+                await stop()
+            except Exception as e:
+                print(f"Stopping {self.name} services failed: {e}")
+
+    async def _resign(self):
+        await self._stop()
+        try:
+            # Hand over immediately instead of waiting for the lease to expire
+            async with db.writer() as conn:
+                await conn.execute("DELETE FROM worker_lease WHERE name = ? AND holder = ?", (self.name, WORKER_ID))
+        except Exception as e:
+            print(f"Releasing lease {self.name} failed: {e}")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            await self._resign()
+
+class IndexSync:
+    """Keeps this worker's in-memory indexes and query cache in step with other workers.
+
+    Each worker holds its own vector/signature indexes and /query cache.
+    In multi-worker mode db.add_turn leaves them alone and catch_up() pulls
+    every embedded turn newer than the last one seen from SQLite, whoever
+    wrote it, then invalidates the cached queries of the affected kinds.
+    When a retention pass has archived turns (a new retention_log row) or
+    a worker asked for a rebuild (a new index_rebuild_log row, e.g. after a
+    bulk import), the indexes are rebuilt from SQLite instead."""
+
+    def __init__(self):
+        self.last_seen = 0
+        self.markers_seen = (0, 0)
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        """Call before the indexes load: rows after this point are caught up incrementally."""
+        async with db.reader() as conn:
+            cursor = await conn.execute("SELECT COALESCE(MAX(id), 0) FROM conv_turn")
+            self.last_seen = (await cursor.fetchone())[0]
+            self.markers_seen = await self._markers(conn)
+
+    async def reload(self):
+        """Rebuild this worker's indexes from SQLite after a retention pass removed turns."""
+        async with self._lock:
+            await self._reload()
+
+    async def request_rebuild(self, reason: str):
+        """Rebuild here now, and in every other worker on its next catch_up()."""
+        async with db.writer() as conn:
+            await conn.execute("INSERT INTO index_rebuild_log(ts, reason, worker) VALUES (?, ?, ?)",
+                               (int(time.time()), reason, WORKER_ID))
+        await self.reload()
+
+    @staticmethod
+    async def _markers(conn) -> tuple:
+        cursor = await conn.execute("""
+            SELECT (SELECT COALESCE(MAX(id), 0) FROM retention_log),
+                   (SELECT COALESCE(MAX(id), 0) FROM index_rebuild_log)""")
+        return tuple(await cursor.fetchone())
+
+    async def _reload(self):
+        from memory import vector_search
+        from memory.signature_index import signature_index
+        from memory.query_cache import query_cache
+        async with db.reader() as conn:
+            self.markers_seen = await self._markers(conn)
+            cursor = await conn.execute("SELECT COALESCE(MAX(id), 0) FROM conv_turn")
+            self.last_seen = max(self.last_seen, (await cursor.fetchone())[0])
+        await vector_search.reload()
+        if signature_index.loaded:
+            signature_index.loaded = False  # turns added meanwhile wait in _pending
+            await signature_index.load()
+        query_cache.clear()
+
+    async def _rebuild_needed(self) -> bool:
+        async with db.reader() as conn:
+            return await self._markers(conn) != self.markers_seen
+
+    async def catch_up(self):
+        from memory import vector_search
+        from memory.signature_index import signature_index
+        from memory.query_cache import query_cache
+        if not MULTI_WORKER:
+            return
+        async with self._lock:
+            # Another worker archived or imported turns; a full reload also covers every new row
+            if await self._rebuild_needed():
+                await self._reload()
+                return
+            async with db.reader() as conn:
+                cursor = await conn.execute(
+                    "SELECT id, kind, text, embedding FROM conv_turn WHERE id > ? AND embedding IS NOT NULL ORDER BY id",
+                    (self.last_seen,))
+                rows = await cursor.fetchall()
+            if not rows:
+                return
+            # An index loaded after start() may already hold some of these rows
+            vector_last, signature_last = vector_search.last_id(), signature_index.last_id()
+            kinds = set()
+            for row in rows:
+                if row["id"] > vector_last:
+                    vector_search.add(row["id"], db.unpack_embedding(row["embedding"]), row["kind"])
+                if row["id"] > signature_last:
+                    signature_index.add(row["id"], row["text"], row["kind"])
+                kinds.add(row["kind"])
+            for kind in kinds:
+                query_cache.invalidate(kind)
+            self.last_seen = rows[-1]["id"]
+
+# Global instances
+leader = LeaderElection("background")
+index_sync = IndexSync()
@@ -0,0 +1,145 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from memory import db
+
+# Configuration
+WRITE_BUFFER_MAX_ROWS = 256  # flush as soon as this many inserts are waiting
+WRITE_BUFFER_MAX_DELAY = 0.005  # seconds a queued insert may wait for others to join its commit
+
+class WriteBuffer:
+    """Group-commit buffer for hot-path INSERTs (conversation turns, orchestrator logs).
+
+    Inserts queued within WRITE_BUFFER_MAX_DELAY of each other are written
+    by one background flush: inserts with the same SQL go through a single
+    executemany, all in one transaction on the writer, so N concurrent
+    /chat calls cost one commit instead of 3N. Only plain INSERTs belong
+    here: rowids are derived from last_insert_rowid(), which assumes every
+    row of an executemany is inserted.
+
+    Each queued insert gets a future resolving to its rowid once
+    committed. Awaiting it is the durable mode; dropping it is
+    fire-and-forget (the row is lost if the process dies before the next
+    flush). close() flushes whatever is left.
+
+    If a flush fails, its rows are retried one at a time, each in its own
+    savepoint, so one bad row fails only its own future."""
+
+    def __init__(self, max_rows: int = WRITE_BUFFER_MAX_ROWS, max_delay: float = WRITE_BUFFER_MAX_DELAY):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._pending: List[Tuple[str, Sequence[Any], asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def submit(self, sql: str, params: Sequence[Any], durable: bool = True) -> asyncio.Future:
+        """Queue an INSERT; the returned future resolves to its rowid after commit.
+
+        durable=False: nobody will await the future, so a failed insert is logged here."""
+        future = asyncio.get_running_loop().create_future()
+        if not durable:
+            future.add_done_callback(_log_failure)
+        self._pending.append((sql, params, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        if len(self._pending) >= self.max_rows:
+            self._full.set()
+        return future
+
+    async def insert(self, sql: str, params: Sequence[Any], durable: bool = True) -> Optional[int]:
+        """Queue an INSERT; when durable, wait for its commit and return the rowid."""
+        future = self.submit(sql, params, durable)
+        if durable:
+            return await future
+        return None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if len(self._pending) < self.max_rows:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far in one transaction."""
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                # One executemany per statement; queue order is kept within each statement
+                by_sql: Dict[str, List[int]] = {}
+                for i, (sql, _, _) in enumerate(batch):
+                    by_sql.setdefault(sql, []).append(i)
+                rowids = [None] * len(batch)
+                async with db.writer() as conn:
+                    for sql, positions in by_sql.items():
+                        await conn.executemany(sql, [batch[i][1] for i in positions])
+                        # The writer is exclusive, so the statement's rowids are consecutive
+                        cursor = await conn.execute("SELECT last_insert_rowid()")
+                        last = (await cursor.fetchone())[0]
+                        for i, rowid in zip(positions, range(last - len(positions) + 1, last + 1)):
+                            rowids[i] = rowid
+            except Exception as e:
+                print(f"Write buffer flush of {len(batch)} rows failed, retrying row by row: {e}")
+                rowids = await self._write_each(batch)
+
+            self.flushes += 1
+            self.rows_written += sum(not isinstance(rowid, Exception) for rowid in rowids)
+            for (_, _, future), rowid in zip(batch, rowids):
+                if future.done():
+                    continue
+                if isinstance(rowid, Exception):
+                    future.set_exception(rowid)
+                else:
+                    future.set_result(rowid)
+
+    async def _write_each(self, batch: List[Tuple[str, Sequence[Any], asyncio.Future]]) -> List[Any]:
+        """Rowid, or the exception, for each row, inserted one by one in one transaction."""
+        results: List[Any] = []
+        try:
+            async with db.writer() as conn:
+                for sql, params, _ in batch:
+                    await conn.execute("SAVEPOINT write_buffer_row")
+                    try:
+                        cursor = await conn.execute(sql, params)
+                        results.append(cursor.lastrowid)
+                    except Exception as e:
+                        await conn.execute("ROLLBACK TO write_buffer_row")
+                        results.append(e)
+                    await conn.execute("RELEASE write_buffer_row")
+        except Exception as e:
+            # The transaction itself failed (e.g. the commit): nothing was written
+            print(f"Write buffer retry of {len(batch)} rows failed: {e}")
+            return [e] * len(batch)
+        return results
+
+    async def close(self):
+        """Flush outstanding inserts and stop the background flusher (call on shutdown)."""
+        # Holding the flush lock means the flusher is idle or waiting, never mid-transaction
+        async with self._flush_lock:
+            if self._task is not None:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
+        await self.flush()
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Write buffer insert failed: {future.exception()}")
+
+# Global instance
+write_buffer = WriteBuffer()
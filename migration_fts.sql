@@ -0,0 +1,50 @@
+-- Migration for Full-Text Search (hybrid lexical + vector retrieval)
+-- Version: 1.2.0
+-- Date: 2026-10-18
+
+-- External-content FTS5 tables: the text lives only in conv_turn/concepts,
+-- the FTS tables hold just the inverted index keyed by rowid = id.
+CREATE VIRTUAL TABLE IF NOT EXISTS conv_turn_fts USING fts5(
+    text,
+    content='conv_turn',
+    content_rowid='id',
+    tokenize='porter unicode61'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS concepts_fts USING fts5(
+    text,
+    content='concepts',
+    content_rowid='id',
+    tokenize='porter unicode61'
+);
+
+-- Keep the FTS indexes in sync with every write path (add_turn, reflect, sync)
+CREATE TRIGGER IF NOT EXISTS conv_turn_fts_insert AFTER INSERT ON conv_turn BEGIN
+    INSERT INTO conv_turn_fts(rowid, text) VALUES (new.id, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS conv_turn_fts_delete AFTER DELETE ON conv_turn BEGIN
+    INSERT INTO conv_turn_fts(conv_turn_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS conv_turn_fts_update AFTER UPDATE OF text ON conv_turn BEGIN
+    INSERT INTO conv_turn_fts(conv_turn_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO conv_turn_fts(rowid, text) VALUES (new.id, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS concepts_fts_insert AFTER INSERT ON concepts BEGIN
+    INSERT INTO concepts_fts(rowid, text) VALUES (new.id, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS concepts_fts_delete AFTER DELETE ON concepts BEGIN
+    INSERT INTO concepts_fts(concepts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS concepts_fts_update AFTER UPDATE OF text ON concepts BEGIN
+    INSERT INTO concepts_fts(concepts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO concepts_fts(rowid, text) VALUES (new.id, new.text);
+END;
+
+-- Index rows that existed before this migration
+INSERT INTO conv_turn_fts(conv_turn_fts) VALUES ('rebuild');
+INSERT INTO concepts_fts(concepts_fts) VALUES ('rebuild');
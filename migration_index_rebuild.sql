@@ -0,0 +1,14 @@
+-- Migration for cross-worker index rebuilds (see memory/workers.py IndexSync)
+-- Version: 1.14.0
+-- Date: 2026-10-18
+
+-- A row here tells every worker to rebuild its in-memory indexes from SQLite
+-- on its next catch_up(), e.g. after a bulk import wrote conv_turn rows with
+-- their original ids, which an incremental id > last_seen scan would miss.
+-- (Retention passes signal the same through retention_log.)
+CREATE TABLE IF NOT EXISTS index_rebuild_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    worker TEXT NOT NULL
+);
@@ -18,7 +18,7 @@ CREATE TABLE IF NOT EXISTS concepts (
     text TEXT NOT NULL UNIQUE,
     kind TEXT,
     meta TEXT, -- JSON metadata
-    embedding TEXT, -- JSON array of floats
+    embedding BLOB, -- Packed little-endian float32 (see db.pack_embedding)
     created_at INTEGER DEFAULT (strftime('%s', 'now')),
     source TEXT DEFAULT 'local',
     confidence REAL DEFAULT 0.5
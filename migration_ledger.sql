@@ -0,0 +1,23 @@
+-- Migration for the Token Ledger (replaces token_balance.txt)
+-- Version: 1.3.0
+-- Date: 2026-10-18
+
+-- Append-only record of every debit; the in-memory ledger is rebuilt from it
+CREATE TABLE IF NOT EXISTS token_spend (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    day TEXT NOT NULL, -- UTC date (YYYY-MM-DD) the spend counts against
+    category TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    ts INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_token_spend_day ON token_spend(day, id);
+
+-- Periodic snapshot of a day's totals so startup only replays spends after it
+CREATE TABLE IF NOT EXISTS token_checkpoint (
+    day TEXT PRIMARY KEY,
+    spent INTEGER NOT NULL,
+    by_category TEXT NOT NULL, -- JSON object: category -> tokens
+    last_spend_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL
+);
@@ -0,0 +1,33 @@
+-- Migration for full-text search over lessons (see LocalResponder.knowledge)
+-- Version: 1.13.0
+-- Date: 2026-10-18
+
+-- db.add_lesson/db.fetch use this table; older deployments created it by hand
+CREATE TABLE IF NOT EXISTS lessons (
+    txt TEXT NOT NULL,
+    ts INTEGER NOT NULL
+);
+
+-- External-content FTS5 index keyed by the lessons rowid, like conv_turn_fts
+CREATE VIRTUAL TABLE IF NOT EXISTS lessons_fts USING fts5(
+    txt,
+    content='lessons',
+    content_rowid='rowid',
+    tokenize='porter unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS lessons_fts_insert AFTER INSERT ON lessons BEGIN
+    INSERT INTO lessons_fts(rowid, txt) VALUES (new.rowid, new.txt);
+END;
+
+CREATE TRIGGER IF NOT EXISTS lessons_fts_delete AFTER DELETE ON lessons BEGIN
+    INSERT INTO lessons_fts(lessons_fts, rowid, txt) VALUES ('delete', old.rowid, old.txt);
+END;
+
+CREATE TRIGGER IF NOT EXISTS lessons_fts_update AFTER UPDATE OF txt ON lessons BEGIN
+    INSERT INTO lessons_fts(lessons_fts, rowid, txt) VALUES ('delete', old.rowid, old.txt);
+    INSERT INTO lessons_fts(rowid, txt) VALUES (new.rowid, new.txt);
+END;
+
+-- Index lessons that existed before this migration
+INSERT INTO lessons_fts(lessons_fts) VALUES ('rebuild');
@@ -0,0 +1,11 @@
+-- Migration for the local fast-path responder (see memory/local_responder.py)
+-- Version: 1.9.0
+-- Date: 2026-10-18
+
+-- Best local candidate for every request: the handler that produced it and
+-- its confidence. Set whether it answered (local_model_used = 1) or fell
+-- short of the threshold and escalated, so the threshold can be tuned
+ALTER TABLE orchestrator_logs ADD COLUMN local_source TEXT;
+ALTER TABLE orchestrator_logs ADD COLUMN local_confidence REAL;
+
+CREATE INDEX IF NOT EXISTS idx_orchestrator_logs_local_model_used ON orchestrator_logs(local_model_used);
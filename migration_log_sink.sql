@@ -0,0 +1,16 @@
+-- Migration for the batched orchestrator log sink (see memory/log_sink.py)
+-- Version: 1.12.0
+-- Date: 2026-10-18
+
+-- Requests the sink only counted instead of logging a row (buffer past its
+-- high-water mark or full), per minute and tier (cache, local, deepseek,
+-- other). latency is the sum over the minute's requests
+CREATE TABLE IF NOT EXISTS orchestrator_log_rollup (
+    minute INTEGER NOT NULL,
+    tier TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    cost INTEGER NOT NULL DEFAULT 0,
+    latency REAL NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (minute, tier)
+);
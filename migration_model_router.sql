@@ -0,0 +1,10 @@
+-- Migration for the cost/latency-aware model router (see memory/router.py)
+-- Version: 1.10.0
+-- Date: 2026-10-18
+
+-- The model and route each DeepSeek request was sent to; the router's
+-- per-route latency and cost statistics are read back from these rows
+ALTER TABLE orchestrator_logs ADD COLUMN model TEXT;
+ALTER TABLE orchestrator_logs ADD COLUMN route TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_orchestrator_logs_route ON orchestrator_logs(route);
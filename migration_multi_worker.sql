@@ -0,0 +1,16 @@
+-- Migration for multi-worker deployments (MULTI_WORKER=1)
+-- Version: 1.4.0
+-- Date: 2026-10-18
+
+-- Authoritative daily spend shared by all workers; debited with UPDATE ... RETURNING
+CREATE TABLE IF NOT EXISTS token_budget (
+    day TEXT PRIMARY KEY, -- UTC date (YYYY-MM-DD)
+    spent INTEGER NOT NULL DEFAULT 0
+);
+
+-- Leases for background singletons (monitor, inter-Manus sync) run by one elected worker
+CREATE TABLE IF NOT EXISTS worker_lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL, -- hostname:pid of the leader
+    expires_at REAL NOT NULL
+);
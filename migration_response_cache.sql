@@ -0,0 +1,14 @@
+-- Migration for the orchestrator response cache (see memory/response_cache.py)
+-- Version: 1.6.0
+-- Date: 2026-10-18
+
+-- Answers keyed on the normalized user message; survives restarts and is shared by workers
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY, -- sha256 of the normalized message
+    message TEXT NOT NULL, -- normalized message, for inspection
+    response TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at ON response_cache(expires_at);
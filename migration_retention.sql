@@ -0,0 +1,18 @@
+-- Migration for tiered retention of conv_turn (see memory/retention.py)
+-- Version: 1.5.0
+-- Date: 2026-10-18
+
+-- One row per retention pass; workers reload their in-memory indexes when it changes
+CREATE TABLE IF NOT EXISTS retention_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    cutoff_ts INTEGER NOT NULL, -- turns older than this were archived
+    moved INTEGER NOT NULL,
+    partitions TEXT NOT NULL -- JSON object: partition file -> rows moved
+);
+
+-- Let the retention pass hand freed pages back to the filesystem a few at a
+-- time (PRAGMA incremental_vacuum). An existing database only switches
+-- auto_vacuum mode after a full VACUUM, so run this while the API is stopped.
+PRAGMA auto_vacuum = INCREMENTAL;
+VACUUM;
@@ -0,0 +1,20 @@
+-- Migration for the semantic response cache (see memory/response_cache.py)
+-- Version: 1.7.0
+-- Date: 2026-10-18
+
+-- Answered prompts with their embeddings, matched by cosine similarity
+CREATE TABLE IF NOT EXISTS semantic_cache (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message TEXT NOT NULL,
+    response TEXT NOT NULL,
+    embedding BLOB NOT NULL, -- Packed little-endian float32 (see db.pack_embedding)
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL,
+    last_used INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+
+-- Best cosine similarity found by the semantic cache for each request
+-- (1.0 for exact-cache hits, NULL when it was not consulted); used to tune
+-- SEMANTIC_CACHE_THRESHOLD
+ALTER TABLE orchestrator_logs ADD COLUMN cache_similarity REAL;
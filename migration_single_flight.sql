@@ -0,0 +1,10 @@
+-- Migration for coalesced upstream calls (see memory/single_flight.py)
+-- Version: 1.8.0
+-- Date: 2026-10-18
+
+-- Requests that shared one DeepSeek call carry the same flight_id; the one
+-- that made the call has coalesced = 0 and carries the cost, the rest 1
+ALTER TABLE orchestrator_logs ADD COLUMN flight_id TEXT;
+ALTER TABLE orchestrator_logs ADD COLUMN coalesced BOOLEAN NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_orchestrator_logs_flight_id ON orchestrator_logs(flight_id);
@@ -0,0 +1,10 @@
+-- Migration for upstream deadlines and the circuit breaker (see memory/circuit_breaker.py)
+-- Version: 1.11.0
+-- Date: 2026-10-18
+
+-- Why a request did not get a DeepSeek answer: breaker_open, deadline or
+-- upstream_error. The reply logged with it came from a looser cache match,
+-- a less confident local answer, or is the apology
+ALTER TABLE orchestrator_logs ADD COLUMN fallback TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_orchestrator_logs_fallback ON orchestrator_logs(fallback);
@@ -15,7 +15,7 @@ role        TEXT CHECK (role IN (
 )),
 text        TEXT NOT NULL,
 meta        TEXT,
-embedding   TEXT -- Changed from BLOB to TEXT
+embedding   BLOB -- Packed little-endian float32 (see db.pack_embedding)
 );
 
 CREATE TABLE concept(
@@ -24,7 +24,7 @@ name        TEXT UNIQUE,
 aliases     TEXT,
 summary     TEXT,
 meta        TEXT,
-embedding   TEXT -- Changed from BLOB to TEXT
+embedding   BLOB -- Packed little-endian float32 (see db.pack_embedding)
 );
 
 CREATE TABLE concept_link(